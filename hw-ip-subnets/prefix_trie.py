@@ -0,0 +1,220 @@
+'''
+A path-compressed binary (Patricia) trie mapping IP prefixes to values.
+Prefixes and addresses are represented as ints, as with `IPAddress.address`,
+and the trie is created for a fixed address length (32 for IPv4, 128 for
+IPv6).  Lookups visit at most one node per distinct prefix length on the path
+to the address, so their cost is bounded by the address length rather than by
+the number of prefixes in the trie.
+
+>>> trie = PrefixTrie(32)
+>>> trie.insert(0x0a140000, 23, 'c')
+>>> trie.insert(0x0a140000, 24, 'd')
+>>> trie.insert(0x00000000, 0, 'k')
+>>> trie.lookup(0x0a140019)
+'d'
+>>> trie.lookup(0x0a140114)
+'c'
+>>> trie.lookup(0x0a140301)
+'k'
+>>> trie.remove(0x0a140000, 24)
+True
+>>> trie.lookup(0x0a140019)
+'c'
+>>> trie.remove(0x0a140000, 24)
+False
+>>> len(trie)
+2
+>>> [(hex(key), prefix_len, value) for key, prefix_len, value in trie.items()]
+[('0x0', 0, 'k'), ('0xa140000', 23, 'c')]
+'''
+
+class _Node(object):
+    __slots__ = ('key', 'prefix_len', 'value', 'is_route', 'children')
+
+    def __init__(self, key, prefix_len):
+        self.key = key
+        self.prefix_len = prefix_len
+        self.value = None
+        self.is_route = False
+        self.children = [None, None]
+
+class PrefixTrie(object):
+    def __init__(self, address_len):
+        '''
+        Instantiate an empty trie for addresses of the given length.
+
+        address_len: int (32 or 128)
+        '''
+        self.address_len = address_len
+        self._root = _Node(0, 0)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _bit(self, key, i):
+        '''Return bit i of key, where bit 0 is the most significant bit.'''
+        return (key >> (self.address_len - 1 - i)) & 1
+
+    def _mask(self, prefix_len):
+        return ((1 << prefix_len) - 1) << (self.address_len - prefix_len)
+
+    def _common_len(self, key1, len1, key2, len2):
+        '''Return the length of the common prefix of two prefixes.'''
+        limit = min(len1, len2)
+        diff = key1 ^ key2
+        if diff == 0:
+            return limit
+        return min(limit, self.address_len - diff.bit_length())
+
+    def insert(self, key, prefix_len, value):
+        '''
+        Map the prefix having the most significant prefix_len bits of key to
+        value, replacing any value previously associated with the prefix.
+
+        key: int
+        prefix_len: int
+        '''
+
+        key &= self._mask(prefix_len)
+        node = self._root
+        while True:
+            if node.prefix_len == prefix_len:
+                if not node.is_route:
+                    node.is_route = True
+                    self._count += 1
+                node.value = value
+                return
+
+            b = self._bit(key, node.prefix_len)
+            child = node.children[b]
+            if child is None:
+                new = _Node(key, prefix_len)
+                new.value = value
+                new.is_route = True
+                node.children[b] = new
+                self._count += 1
+                return
+
+            common = self._common_len(key, prefix_len,
+                    child.key, child.prefix_len)
+            if common == child.prefix_len:
+                # child is a prefix of the new prefix; keep descending
+                node = child
+                continue
+
+            new = _Node(key, prefix_len)
+            new.value = value
+            new.is_route = True
+            self._count += 1
+            if common == prefix_len:
+                # the new prefix is a prefix of child; insert it in between
+                new.children[self._bit(child.key, prefix_len)] = child
+                node.children[b] = new
+            else:
+                # the prefixes diverge; join them under a glue node
+                glue = _Node(key & self._mask(common), common)
+                glue.children[self._bit(key, common)] = new
+                glue.children[self._bit(child.key, common)] = child
+                node.children[b] = glue
+            return
+
+    def _find(self, key, prefix_len):
+        '''Return the path of nodes from the root to the node matching the
+        prefix exactly, or None if there is no such node.'''
+
+        path = [self._root]
+        node = self._root
+        while node.prefix_len < prefix_len:
+            node = node.children[self._bit(key, node.prefix_len)]
+            if node is None or node.prefix_len > prefix_len or \
+                    (key ^ node.key) & self._mask(node.prefix_len):
+                return None
+            path.append(node)
+        if node.prefix_len != prefix_len:
+            return None
+        return path
+
+    def get(self, key, prefix_len):
+        '''
+        Return the value associated with exactly the given prefix, or None if
+        there is no such prefix.
+
+        key: int
+        prefix_len: int
+        '''
+
+        path = self._find(key & self._mask(prefix_len), prefix_len)
+        if path is None or not path[-1].is_route:
+            return None
+        return path[-1].value
+
+    def remove(self, key, prefix_len):
+        '''
+        Remove the prefix having the most significant prefix_len bits of key.
+        Return True if the prefix was found, False otherwise.
+
+        key: int
+        prefix_len: int
+        '''
+
+        path = self._find(key & self._mask(prefix_len), prefix_len)
+        if path is None or not path[-1].is_route:
+            return False
+
+        node = path[-1]
+        node.is_route = False
+        node.value = None
+        self._count -= 1
+
+        # Collapse nodes that no longer hold a route and no longer join two
+        # subtries, working back towards the root (which is never removed).
+        while len(path) > 1:
+            node = path.pop()
+            if node.is_route:
+                break
+            children = [c for c in node.children if c is not None]
+            if len(children) == 2:
+                break
+            parent = path[-1]
+            i = parent.children.index(node)
+            parent.children[i] = children[0] if children else None
+        return True
+
+    def lookup(self, address):
+        '''
+        Return the value associated with the longest prefix matching address,
+        or None if no prefix matches.
+
+        address: int
+        '''
+
+        address_len = self.address_len
+        best = None
+        node = self._root
+        while node is not None:
+            prefix_len = node.prefix_len
+            if (address ^ node.key) >> (address_len - prefix_len):
+                break
+            if node.is_route:
+                best = node.value
+            if prefix_len == address_len:
+                break
+            node = node.children[(address >> (address_len - 1 - prefix_len)) & 1]
+        return best
+
+    def items(self):
+        '''
+        Generate a (key, prefix_len, value) tuple for every prefix in the trie,
+        in address order, with shorter prefixes preceding longer ones that
+        they contain.
+        '''
+
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node.is_route:
+                yield node.key, node.prefix_len, node.value
+            for child in reversed(node.children):
+                if child is not None:
+                    stack.append(child)
@@ -9,23 +9,30 @@ Populate a forwarding table:
 
 Test the IPAddress.__contains__() method
 >>> IPAddress('128.187.0.1') in Subnet(IPAddress('128.187.0.0'), 24)
-None
+True
 >>> IPAddress('128.187.1.0') in Subnet(IPAddress('128.187.0.0'), 24)
-None
+False
 >>> IPAddress('128.187.2.0') in Subnet(IPAddress('128.188.0.0'), 16)
-None
+False
 >>> IPAddress('128.187.0.0') in Subnet(IPAddress('128.187.0.0'), 23)
-None
+True
 >>> IPAddress('128.187.1.0') in Subnet(IPAddress('128.187.0.0'), 23)
-None
+True
 >>> IPAddress('128.187.2.0') in Subnet(IPAddress('128.187.0.0'), 23)
-None
+False
 >>> IPAddress('2001:db8:f00d::1') in Subnet(IPAddress('2001:db8::'), 32)
-None
+True
 >>> IPAddress('2001:db8:f00d::1') in Subnet(IPAddress('2001:db8::'), 64)
-None
+False
 >>> IPAddress('2001:db8::feed:1:1') in Subnet(IPAddress('2001:db8::'), 96)
-None
+False
+
+Hosts are generated lazily, even from large subnets:
+>>> [str(ip) for ip in Subnet(IPAddress('128.187.0.0'), 30).hosts()]
+['128.187.0.1', '128.187.0.2']
+>>> hosts = Subnet(IPAddress('2001:db8::'), 32).hosts()
+>>> str(next(hosts)), str(next(hosts))
+('2001:db8::', '2001:db8::1')
 
 Populate a forwarding table:
 >>> table = ForwardingTable()
@@ -37,24 +44,42 @@ Populate a forwarding table:
 
 Now test the ForwardingTable.get_forwarding_entry() method:
 >>> table.get_forwarding_entry(IPAddress('128.187.0.1'))
-None
+4
 >>> table.get_forwarding_entry(IPAddress('128.187.0.3'))
-None
+4
 >>> table.get_forwarding_entry(IPAddress('128.187.0.4'))
-None
+3
 >>> table.get_forwarding_entry(IPAddress('128.187.1.1'))
-None
+2
 >>> table.get_forwarding_entry(IPAddress('128.187.2.1'))
-None
+1
 >>> table.get_forwarding_entry(IPAddress('128.187.3.1'))
-None
+1
 >>> table.get_forwarding_entry(IPAddress('128.187.4.1'))
-None
+0
+
+Check a batch of lines, as main() does with a file or standard input:
+>>> import sys
+>>> check_lines(['128.187.1.1', '128.187.0.0/24 128.187.0.200', '', '128.187.0.0/24 128.187.1.1'],
+...         sys.stdout, table)
+128.187.1.1 2
+TRUE (128.187.0.200 is in 128.187.0.0/24)
+FALSE (128.187.1.1 is not in 128.187.0.0/24)
+3
+
+Each line of a table file holds one entry:
+>>> import io
+>>> load_table(io.StringIO('# routes\\n10.0.0.0/8 a\\n10.20.0.0/16\\n'))
+Traceback (most recent call last):
+...
+ValueError: line 3: 10.20.0.0/16: expected "<prefix>/<prefix_len> <entry>"
 '''
 
-import binascii
+import collections
 import socket
 
+from prefix_trie import PrefixTrie
+
 int_type_int = type(0xff)
 int_type_long = type(0xffffffffffffffff)
 
@@ -63,7 +88,19 @@ class IPAddress(object):
     An IP address object.  The address instance var is an int.  If it is an
     IPv6 address, then its length is 128 bits; otherwise, it is an IPv4
     address, and its length is 32 bits.
+
+    An IPAddress can be created from a presentation-format str, from an int
+    and an address family, or from a packed 4- or 16-byte `bytes` instance,
+    such as a slice of a packet header.
     '''
+
+    __slots__ = ('address', 'address_family', 'address_len')
+
+    # bounded cache of instances, keyed by the value they were created from;
+    # see set_intern_cache_size()
+    _intern_cache = None
+    _intern_cache_size = 0
+
     def __init__(self, address, family=None):
         if isinstance(address, (int_type_int, int_type_long)):
             assert family is not None, 'Address family must be specified'
@@ -73,14 +110,29 @@ class IPAddress(object):
             else:
                 self.address_len = 32
             self.address = address
-        else: # str
-            if ':' in address:
+        else: # str or bytes
+            self.address, self.address_family = \
+                    self.__class__._parse(address)
+            if self.address_family == socket.AF_INET6:
                 self.address_len = 128
-                self.address_family = socket.AF_INET6
             else:
                 self.address_len = 32
-                self.address_family = socket.AF_INET
-            self.address = self.__class__._str_to_int(address, self.address_family)
+
+    @classmethod
+    def _parse(cls, address):
+        '''Convert an IP address string, in presentation format, or a packed
+        IP address to an (int, address family) tuple.'''
+        if isinstance(address, str):
+            if ':' in address:
+                family = socket.AF_INET6
+            else:
+                family = socket.AF_INET
+            return cls._str_to_int(address, family), family
+        if len(address) == 16:
+            return int.from_bytes(address, 'big'), socket.AF_INET6
+        if len(address) != 4:
+            raise ValueError('Packed address must be 4 or 16 bytes')
+        return int.from_bytes(address, 'big'), socket.AF_INET
 
     @classmethod
     def _int_to_str(cls, address, family):
@@ -89,29 +141,74 @@ class IPAddress(object):
             address_len = 128
         else:
             address_len = 32
-        return socket.inet_ntop(family, binascii.unhexlify(('%x' % address).zfill(address_len >> 2)))
+        return socket.inet_ntop(family, address.to_bytes(address_len >> 3, 'big'))
 
     @classmethod
     def _str_to_int(cls, address, family):
         '''Convert an IP address string, in presentation format, to an integer.'''
-        return int_type_long(binascii.hexlify(socket.inet_pton(family, address)), 16)
+        return int.from_bytes(socket.inet_pton(family, address), 'big')
+
+    @classmethod
+    def set_intern_cache_size(cls, size):
+        '''
+        Enable the cache used by intern(), holding at most size instances, or
+        disable (and empty) it if size is 0.
+
+        size: int
+        '''
+        cls._intern_cache_size = size
+        if size > 0:
+            cls._intern_cache = collections.OrderedDict()
+        else:
+            cls._intern_cache = None
+
+    @classmethod
+    def intern(cls, address, family=None):
+        '''
+        Return an IPAddress for the given address, as with the constructor,
+        reusing a previously created instance if the cache is enabled and
+        holds one.  The least recently used instance is discarded when the
+        cache is full.  Instances returned by this method are shared, so they
+        must not be modified.
+
+        address: str, bytes, or int (in which case family is required)
+        '''
+        cache = cls._intern_cache
+        if cache is None:
+            return cls(address, family)
+        if isinstance(address, (bytearray, memoryview)):
+            address = bytes(address)
+        key = (address, family)
+        try:
+            ip = cache[key]
+        except KeyError:
+            ip = cls(address, family)
+            cache[key] = ip
+            if len(cache) > cls._intern_cache_size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return ip
 
     @classmethod
     def _all_ones(cls, n_bits):
         '''Return an int that is n_bits bits long and whose value is all ones.'''
-        return 2**n_bits - 1
+        return (1 << n_bits) - 1
 
     def __hash__(self):
-        return hash(self.address)
+        return hash((self.address, self.address_family))
 
     def __str__(self):
         return self.__class__._int_to_str(self.address, self.address_family)
 
     def __eq__(self, other):
-        return self.address == other.address
+        # 0.0.0.0 and :: are different addresses
+        return self.address == other.address and \
+                self.address_family == other.address_family
 
     def __lt__(self, other):
-        return self.address < other.address
+        return (self.address_family, self.address) < \
+                (other.address_family, other.address)
 
     def __add__(self, other):
         assert isinstance(other, (int_type_int, int_type_long))
@@ -126,24 +223,25 @@ class IPAddress(object):
         Specifically, the mask should be an integer in which the most
         significant prefix_len bits are 1 and the least significant
         (self.address_len - prefix_len) bits are 0.'''
-        #FIXME
-        return 0
+        return self._all_ones(prefix_len) << (self.address_len - prefix_len)
 
     def prefix(self, prefix_len):
         '''Return the prefix for the given prefix length, as an integer.
         Specifically, the prefix should be an integer in which the most
         significant prefix_len bits match the bits in self.address, and the
         least significant (self.address_len - prefix_len) bits are 0.'''
-        #FIXME
-        return 0
+        return self.address & self.mask(prefix_len)
 
     def subnet(self, prefix_len):
         return Subnet(IPAddress(self.prefix(prefix_len), self.address_family), prefix_len)
 
 class Subnet(object):
+    __slots__ = ('prefix', 'prefix_len', '_mask')
+
     def __init__(self, prefix, prefix_len):
         self.prefix = prefix
         self.prefix_len = prefix_len
+        self._mask = prefix.mask(prefix_len)
 
     def __repr__(self):
         return str(self)
@@ -154,12 +252,28 @@ class Subnet(object):
     def __contains__(self, ip):
         '''Return True if the address corresponding to this IP instance is
         within this subnet, False otherwise.'''
-        #FIXME
-        return False
+        return ip.address_family == self.prefix.address_family and \
+                (ip.address ^ self.prefix.address) & self._mask == 0
 
     def __hash__(self):
         return hash((self.prefix, self.prefix_len))
 
+    def num_addresses(self):
+        return 1 << (self.prefix.address_len - self.prefix_len)
+
+    def hosts(self):
+        '''Generate the IPAddress of each host in this subnet, in order,
+        without creating them all at once.  For IPv4 subnets with a prefix
+        shorter than 31, the network and broadcast addresses are skipped.'''
+        family = self.prefix.address_family
+        start = self.prefix.prefix(self.prefix_len)
+        end = start + self.num_addresses()
+        if family == socket.AF_INET and self.prefix_len < 31:
+            start += 1
+            end -= 1
+        for address in range(start, end):
+            yield IPAddress(address, family)
+
     def __eq__(self, other):
         return self.prefix == other.prefix and self.prefix_len == other.prefix_len
 
@@ -167,40 +281,185 @@ class ForwardingTable(object):
     def __init__(self):
         self.entries = {}
 
+        # one longest-prefix-match index per address family, kept in sync
+        # with self.entries
+        self._tries = {
+                socket.AF_INET: PrefixTrie(32),
+                socket.AF_INET6: PrefixTrie(128),
+                }
+
     def add_entry(self, subnet, intf):
         self.entries[subnet] = intf
+        self._tries[subnet.prefix.address_family].insert( \
+                subnet.prefix.address, subnet.prefix_len, intf)
 
     def remove_entry(self, subnet):
         if subnet in self.entries:
             del self.entries[subnet]
+            self._tries[subnet.prefix.address_family].remove( \
+                    subnet.prefix.address, subnet.prefix_len)
 
     def get_forwarding_entry(self, ip_address):
         '''
         Return the subnet entry having the longest prefix match of ip_address.
         If there is no match, return None.
         '''
-        #FIXME
-        return None
+        return self._tries[ip_address.address_family].lookup(ip_address.address)
 
-def main():
+def _parse_subnet(s):
+    prefix, prefix_len = s.split('/')
+    return Subnet(IPAddress(prefix), int(prefix_len))
+
+def load_table(fh, table=None):
+    '''
+    Add the entries read from fh, one "<prefix>/<prefix_len> <entry>" per
+    line, to table (a new ForwardingTable, by default), and return it.  Blank
+    lines and lines starting with "#" are ignored; any other line that is not
+    an entry raises ValueError, giving its line number.
+
+    fh: file object (text)
+    table: ForwardingTable
+    '''
+    if table is None:
+        table = ForwardingTable()
+    for i, line in enumerate(fh, 1):
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        try:
+            if len(fields) != 2:
+                raise ValueError('expected "<prefix>/<prefix_len> <entry>"')
+            subnet = _parse_subnet(fields[0])
+        except (ValueError, OSError) as e:
+            raise ValueError('line %d: %s: %s' % (i, line.rstrip(), e))
+        table.add_entry(subnet, fields[1])
+    return table
+
+def check_lines(lines, out, table=None, batch_size=4096):
+    '''
+    Answer one question per line of lines, writing the answers to out, in
+    batches of batch_size lines.  A line holding "<prefix>/<prefix_len> <ip>"
+    is answered as on the command line; a line holding only "<ip>" is
+    answered with the ip and the entry for its longest prefix match in table,
+    or "-" if none matches.  Malformed lines are reported on standard error
+    and skipped.  Return the number of lines answered.
+
+    lines: iterable of str
+    out: file object (text)
+    table: ForwardingTable
+    batch_size: int
+    '''
     import sys
 
-    def usage():
-        sys.stderr.write('''Usage: %s <prefix>/<prefix_len> <ip>\n''')
+    # subnets repeat from line to line in logs, so they are parsed once;
+    # addresses are compared to them, and looked up in the tries, directly as
+    # ints, rather than through IPAddress instances
+    subnets = {}
+    if table is not None:
+        lookup4 = table._tries[socket.AF_INET].lookup
+        lookup6 = table._tries[socket.AF_INET6].lookup
+    inet_pton = socket.inet_pton
+    from_bytes = int.from_bytes
+
+    answered = 0
+    batch = []
+    for i, line in enumerate(lines, 1):
+        fields = line.split()
+        if not fields:
+            continue
+        try:
+            if len(fields) == 1:
+                if table is None:
+                    raise ValueError('no prefix or table to check against')
+                if ':' in fields[0]:
+                    entry = lookup6(from_bytes(
+                            inet_pton(socket.AF_INET6, fields[0]), 'big'))
+                else:
+                    entry = lookup4(from_bytes(
+                            inet_pton(socket.AF_INET, fields[0]), 'big'))
+                batch.append('%s %s\n' % (fields[0],
+                        '-' if entry is None else entry))
+            else:
+                subnet = subnets.get(fields[0])
+                if subnet is None:
+                    subnet = _parse_subnet(fields[0])
+                    subnet = subnets[fields[0]] = (subnet.prefix.address_family,
+                            subnet.prefix.prefix(subnet.prefix_len),
+                            subnet._mask, str(subnet))
+                family, prefix, mask, name = subnet
+                if ':' in fields[1]:
+                    ip_family = socket.AF_INET6
+                else:
+                    ip_family = socket.AF_INET
+                address = from_bytes(inet_pton(ip_family, fields[1]), 'big')
+                if ip_family == family and address & mask == prefix:
+                    batch.append('TRUE (%s is in %s)\n' % (fields[1], name))
+                else:
+                    batch.append('FALSE (%s is not in %s)\n' % \
+                            (fields[1], name))
+        except (ValueError, OSError) as e:
+            sys.stderr.write('line %d: %s: %s\n' % (i, line.rstrip(), e))
+            continue
+        answered += 1
+        if len(batch) >= batch_size:
+            out.write(''.join(batch))
+            batch = []
+    out.write(''.join(batch))
+    return answered
 
-    if len(sys.argv) < 3:
-        usage()
-        sys.exit(1)
+def main():
+    import argparse
+    import sys
 
-    prefix, prefix_len = sys.argv[1].split('/')
-    prefix = IPAddress(prefix)
-    prefix_len = int(prefix_len)
-    subnet = Subnet(prefix, prefix_len)
-    ip = IPAddress(sys.argv[2])
-    if ip in subnet:
-        sys.stdout.write('TRUE (%s is in %s)\n' % (ip, subnet))
+    parser = argparse.ArgumentParser(usage='''%(prog)s <prefix>/<prefix_len> <ip>
+       %(prog)s [-f FILE] [-t TABLE] [<prefix>/<prefix_len> ...]''',
+            description='Check whether an IP address is in a subnet.  '
+            'Given only prefixes (or none), check each line of FILE instead: '
+            'either "<prefix>/<prefix_len> <ip>", or "<ip>", which is '
+            'matched against the given prefixes and the TABLE entries.')
+    parser.add_argument('args', nargs='*', metavar='<prefix>/<prefix_len>')
+    parser.add_argument('-f', '--file', type=str, action='store',
+            default='-',
+            help='File of lines to check ("-" for standard input, '
+            'the default)')
+    parser.add_argument('-t', '--table', type=str, action='store',
+            help='File of forwarding table entries, one '
+            '"<prefix>/<prefix_len> <entry>" per line')
+    args = parser.parse_args(sys.argv[1:])
+
+    if len(args.args) == 2 and '/' not in args.args[1]:
+        subnet = _parse_subnet(args.args[0])
+        ip = IPAddress(args.args[1])
+        if ip in subnet:
+            sys.stdout.write('TRUE (%s is in %s)\n' % (ip, subnet))
+        else:
+            sys.stdout.write('FALSE (%s is not in %s)\n' % (ip, subnet))
+        return
+
+    table = None
+    if args.table is not None:
+        with open(args.table) as fh:
+            table = load_table(fh)
+    for arg in args.args:
+        if table is None:
+            table = ForwardingTable()
+        subnet = _parse_subnet(arg)
+        table.add_entry(subnet, str(subnet))
+
+    out = open(sys.stdout.fileno(), 'w', buffering=1 << 16, closefd=False)
+    if args.file == '-':
+        fh = open(sys.stdin.fileno(), buffering=1 << 16, closefd=False)
     else:
-        sys.stdout.write('FALSE (%s is not in %s)\n' % (ip, subnet))
+        fh = open(args.file, buffering=1 << 16)
+    try:
+        with fh:
+            check_lines(fh, out, table)
+        out.flush()
+    except BrokenPipeError:
+        # e.g., piped to head; nothing more to write
+        sys.stderr.close()
+    except KeyboardInterrupt:
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,293 @@
+'''
+A set of subnets, for address planning and access control lists.  A
+`SubnetSet` keeps its member subnets sorted by prefix (then prefix length),
+and, once needed, the address space they cover as a sorted list of disjoint
+address ranges, so that:
+
+ - membership of an address or subnet in the covered space is a binary
+   search over the ranges, O(log N);
+ - the member subnets within a given subnet are found by binary search over
+   the sorted members, O(log N + k), and those containing it by one hash lookup per
+   distinct member prefix length (at most 33 for IPv4, 129 for IPv6);
+ - union, intersection and difference merge the ranges of the two sets in
+   one pass, after they have been sorted, O(N log N) in all, and return the
+   result summarized as the fewest subnets that cover exactly its addresses.
+
+IPv4 and IPv6 subnets may be mixed; each address family is kept separately.
+
+>>> def subnets(*strs):
+...     return [Subnet(IPAddress(s.split('/')[0]), int(s.split('/')[1])) for s in strs]
+>>> acl = SubnetSet(subnets('10.0.0.0/24', '10.0.1.0/24', '10.0.2.0/23',
+...         '10.0.0.128/25', '192.168.0.0/16', '2001:db8::/32'))
+>>> list(acl.summarize())
+[10.0.0.0/22, 192.168.0.0/16, 2001:db8::/32]
+>>> IPAddress('10.0.3.7') in acl, subnets('10.0.0.0/21')[0] in acl
+(True, False)
+>>> acl.containing(subnets('10.0.0.192/26')[0])
+[10.0.0.0/24, 10.0.0.128/25]
+>>> acl.within(subnets('10.0.0.0/23')[0])
+[10.0.0.0/24, 10.0.0.128/25, 10.0.1.0/24]
+>>> acl.overlapping(subnets('10.0.2.0/24')[0])
+[10.0.2.0/23]
+
+>>> office = SubnetSet(subnets('10.0.1.0/24', '10.0.4.0/24'))
+>>> list(acl & office), list(office - acl)
+([10.0.1.0/24], [10.0.4.0/24])
+>>> list(SubnetSet(subnets('10.0.0.0/22')) - SubnetSet(subnets('10.0.1.0/24')))
+[10.0.0.0/24, 10.0.2.0/23]
+>>> list(office | SubnetSet(subnets('10.0.0.0/24', '10.0.5.0/24')))
+[10.0.0.0/23, 10.0.4.0/23]
+>>> (acl | office).num_addresses(socket.AF_INET)
+66816
+
+Host bits in the prefixes given are ignored:
+>>> hosts = SubnetSet(subnets('10.0.0.5/24', '10.0.0.9/24', '10.0.1.1/32'))
+>>> hosts
+SubnetSet([10.0.0.0/24, 10.0.1.1/32])
+>>> hosts.containing(subnets('10.0.0.0/25')[0]), hosts.within(subnets('10.0.0.7/23')[0])
+([10.0.0.0/24], [10.0.0.0/24, 10.0.1.1/32])
+'''
+
+import bisect
+import socket
+
+from subnet import IPAddress, Subnet
+
+_ADDRESS_LEN = {socket.AF_INET: 32, socket.AF_INET6: 128}
+
+def _key(subnet):
+    return (subnet.prefix.address_family,
+            subnet.prefix.prefix(subnet.prefix_len), subnet.prefix_len)
+
+def _normalize(subnet):
+    '''Return subnet, or, if its prefix has host bits set, the same subnet
+    with them cleared.'''
+    prefix = subnet.prefix.prefix(subnet.prefix_len)
+    if prefix == subnet.prefix.address:
+        return subnet
+    return Subnet(IPAddress(prefix, subnet.prefix.address_family),
+            subnet.prefix_len)
+
+def _range(subnet):
+    '''Return the first address of subnet and the address following its
+    last, as ints.'''
+    start = subnet.prefix.prefix(subnet.prefix_len)
+    return start, start + (1 << (subnet.prefix.address_len - subnet.prefix_len))
+
+def _merge(ranges):
+    '''Return the union of the given (start, end) ranges as a sorted list of
+    disjoint, non-adjacent ranges.'''
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def _intersect(ranges1, ranges2):
+    '''Return the intersection of two sorted lists of disjoint ranges.'''
+
+    result = []
+    i = j = 0
+    while i < len(ranges1) and j < len(ranges2):
+        start = max(ranges1[i][0], ranges2[j][0])
+        end = min(ranges1[i][1], ranges2[j][1])
+        if start < end:
+            result.append((start, end))
+        if ranges1[i][1] < ranges2[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+def _subtract(ranges1, ranges2):
+    '''Return the ranges of ranges1 not in ranges2, both being sorted lists
+    of disjoint ranges.'''
+
+    result = []
+    j = 0
+    for start, end in ranges1:
+        # skip the ranges to subtract that end before this one starts
+        while j < len(ranges2) and ranges2[j][1] <= start:
+            j += 1
+        k = j
+        while k < len(ranges2) and ranges2[k][0] < end:
+            if ranges2[k][0] > start:
+                result.append((start, ranges2[k][0]))
+            start = max(start, ranges2[k][1])
+            k += 1
+        if start < end:
+            result.append((start, end))
+    return result
+
+def _to_subnets(ranges, family):
+    '''Generate the fewest subnets that cover exactly the given sorted,
+    disjoint ranges.'''
+
+    address_len = _ADDRESS_LEN[family]
+    for start, end in ranges:
+        while start < end:
+            # the largest block that starts at start, aligned, and fits
+            if start:
+                bits = (start & -start).bit_length() - 1
+            else:
+                bits = address_len
+            bits = min(bits, (end - start).bit_length() - 1)
+            yield Subnet(IPAddress(start, family), address_len - bits)
+            start += 1 << bits
+
+class SubnetSet(object):
+    def __init__(self, subnets=()):
+        '''
+        Instantiate a set of the given subnets.  Duplicates are kept once.
+        Host bits set in a prefix are ignored.
+
+        subnets: iterable of Subnet instances
+        '''
+
+        unique = {}
+        for subnet in subnets:
+            subnet = _normalize(subnet)
+            unique[_key(subnet)] = subnet
+        keys = sorted(unique)
+        self._subnets = [unique[key] for key in keys]
+
+        # the sorted (family, prefix, prefix_len) keys of the members, for
+        # within(), and, for containing(), the keys as a set and the distinct
+        # prefix lengths of each family
+        self._sorted_keys = keys
+        self._keys = set(keys)
+        self._lengths = {}
+        for family, address, prefix_len in keys:
+            self._lengths.setdefault(family, set()).add(prefix_len)
+        for family in self._lengths:
+            self._lengths[family] = sorted(self._lengths[family])
+
+        # family -> merged (start, end) ranges; built when first needed
+        self._ranges = None
+
+    @classmethod
+    def _from_ranges(cls, ranges):
+        subnets = []
+        for family in sorted(ranges):
+            subnets.extend(_to_subnets(ranges[family], family))
+        result = cls(subnets)
+        result._ranges = ranges
+        return result
+
+    def __len__(self):
+        return len(self._subnets)
+
+    def __iter__(self):
+        return iter(self._subnets)
+
+    def __repr__(self):
+        return 'SubnetSet(%r)' % self._subnets
+
+    def _get_ranges(self):
+        if self._ranges is None:
+            by_family = {}
+            for subnet in self._subnets:
+                by_family.setdefault(subnet.prefix.address_family, []).append(
+                        _range(subnet))
+            self._ranges = dict((family, _merge(ranges)) \
+                    for family, ranges in by_family.items())
+        return self._ranges
+
+    def __contains__(self, item):
+        '''Return True if the IPAddress or Subnet item is entirely within the
+        address space covered by the members of this set.'''
+
+        if isinstance(item, Subnet):
+            start, end = _range(item)
+            family = item.prefix.address_family
+        else:
+            start, end = item.address, item.address + 1
+            family = item.address_family
+        ranges = self._get_ranges().get(family, [])
+        i = bisect.bisect_right(ranges, (start, float('inf'))) - 1
+        return i >= 0 and ranges[i][1] >= end
+
+    def containing(self, subnet):
+        '''Return the members that contain (or are equal to) subnet, from
+        the shortest prefix to the longest.'''
+
+        family = subnet.prefix.address_family
+        result = []
+        for prefix_len in self._lengths.get(family, []):
+            if prefix_len > subnet.prefix_len:
+                break
+            key = (family, subnet.prefix.prefix(prefix_len), prefix_len)
+            if key in self._keys:
+                result.append(Subnet(IPAddress(key[1], family), prefix_len))
+        return result
+
+    def within(self, subnet):
+        '''Return the members that are within (or equal to) subnet, in
+        order.'''
+
+        family = subnet.prefix.address_family
+        start, end = _range(subnet)
+        # members at start with a shorter prefix contain subnet, and sort
+        # before it
+        first = bisect.bisect_left(self._sorted_keys,
+                (family, start, subnet.prefix_len))
+        last = bisect.bisect_left(self._sorted_keys, (family, end, -1))
+        return self._subnets[first:last]
+
+    def overlapping(self, subnet):
+        '''Return the members that overlap subnet, i.e., that contain it or
+        are within it, in order.'''
+
+        return sorted(set(self.containing(subnet)) | set(self.within(subnet)),
+                key=_key)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def union(self, other):
+        '''Return the union of the address space of this set and other,
+        summarized.'''
+
+        ranges1, ranges2 = self._get_ranges(), other._get_ranges()
+        return self._from_ranges(dict((family,
+                _merge(ranges1.get(family, []) + ranges2.get(family, []))) \
+                for family in set(ranges1) | set(ranges2)))
+
+    def intersection(self, other):
+        '''Return the address space common to this set and other,
+        summarized.'''
+
+        ranges1, ranges2 = self._get_ranges(), other._get_ranges()
+        return self._from_ranges(dict((family,
+                _intersect(ranges1[family], ranges2[family])) \
+                for family in set(ranges1) & set(ranges2)))
+
+    def difference(self, other):
+        '''Return the address space of this set that is not in other,
+        summarized.'''
+
+        ranges1, ranges2 = self._get_ranges(), other._get_ranges()
+        return self._from_ranges(dict((family,
+                _subtract(ranges, ranges2.get(family, []))) \
+                for family, ranges in ranges1.items()))
+
+    def summarize(self):
+        '''Return the fewest subnets that cover exactly the same addresses as
+        the members of this set, as a SubnetSet.'''
+        return self._from_ranges(self._get_ranges())
+
+    def num_addresses(self, family):
+        '''Return the number of addresses of the given family covered by the
+        members of this set.'''
+        return sum(end - start for start, end in \
+                self._get_ranges().get(family, []))
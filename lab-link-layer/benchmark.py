@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+'''
+Benchmarks of `Switch._handle_frame()` on synthetic workloads (see
+`workload.py`), reporting frames per second, sampled per-frame latency and
+memory.  Results can be saved as JSON and compared against an earlier run:
+
+    $ python3 benchmark.py --hosts 100,10000 --output before.json
+    $ python3 benchmark.py --hosts 100,10000 --compare before.json
+
+The switch is driven directly, in one process, as a node of the simulator
+(see `simulator.py`), with its frames discarded rather than delivered.
+
+>>> import random
+>>> result = bench_switch(8, 100, 1000, 1.1, 64, random.Random(1))
+>>> result['name'], result['count'], result['frames_out'] >= 1000
+('switch ports=8 hosts=100 zipf=1.1 size=64', 1000, True)
+'''
+
+import argparse
+import random
+import sys
+
+from workload import zipf_choices, build_frames, measure, max_rss, \
+        save_results, compare_results
+
+def bench_switch(ports, hosts, count, zipf, size, rng):
+    '''
+    Benchmark Switch._handle_frame() for count frames between hosts spread
+    evenly over the ports.  Destinations are chosen with a Zipf
+    distribution, and sources uniformly.
+
+    ports: int
+    hosts: int
+    count: int (number of frames)
+    zipf: int or float (Zipf exponent for choosing destinations)
+    size: int (frame size)
+    rng: random.Random instance
+    '''
+
+    from simulator import Simulator, install_cougarnet_modules
+    install_cougarnet_modules()
+    from switch import Switch
+
+    config = ['NODES', 's1 type=switch'] + \
+            ['h%d' % i for i in range(ports)] + \
+            ['LINKS'] + \
+            ['h%d s1' % i for i in range(ports)]
+    sim = Simulator(config)
+    frames_out = []
+    sim.transmit = lambda node, intf, frame: frames_out.append(len(frame))
+    switch = sim.instantiate('s1', Switch, max_table_size=max(hosts, 1))
+
+    macs = [b'\x02\x00' + i.to_bytes(4, 'big') for i in range(hosts)]
+    dsts = zipf_choices(hosts, count, zipf, rng)
+    srcs = [rng.randrange(hosts) for i in range(count)]
+    frames = build_frames(macs, list(zip(srcs, dsts)), size)
+    items = [(frame, 's1-h%d' % (src % ports)) \
+            for frame, src in zip(frames, srcs)]
+
+    result = measure(lambda item: switch._handle_frame(*item), items)
+    result['name'] = 'switch ports=%d hosts=%d zipf=%g size=%d' % \
+            (ports, hosts, zipf, size)
+    result['frames_out'] = len(frames_out)
+    result['max_rss'] = max_rss()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the switch')
+    parser.add_argument('--ports', type=int, default=8,
+            help='Number of switch ports (default: 8)')
+    parser.add_argument('--hosts', default='100,10000',
+            help='Comma-separated numbers of hosts (default: 100,10000)')
+    parser.add_argument('--frames', type=int, default=100000,
+            help='Frames per benchmark (default: 100000)')
+    parser.add_argument('--zipf', type=float, default=1.1,
+            help='Zipf exponent for choosing destinations; 0 for uniform '
+            '(default: 1.1)')
+    parser.add_argument('--size', type=int, default=64,
+            help='Frame size (default: 64)')
+    parser.add_argument('--seed', type=int, default=1,
+            help='Random seed (default: 1)')
+    parser.add_argument('--output', '-o', metavar='FILE',
+            help='Save results to FILE as JSON')
+    parser.add_argument('--compare', '-c', metavar='FILE',
+            help='Compare results with those saved in FILE')
+    args = parser.parse_args(sys.argv[1:])
+
+    results = []
+    for hosts in [int(n) for n in args.hosts.split(',')]:
+        result = bench_switch(args.ports, hosts, args.frames, args.zipf,
+                args.size, random.Random(args.seed))
+        results.append(result)
+        print('%-50s %12.0f/s  p50 %6d ns  p99 %6d ns' % \
+                (result['name'], result['per_second'],
+                result['latency_ns']['p50'], result['latency_ns']['p99']))
+
+    if args.output:
+        save_results(args.output, results)
+    if args.compare:
+        compare_results(args.compare, results)
+
+if __name__ == '__main__':
+    main()
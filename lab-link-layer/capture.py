@@ -0,0 +1,311 @@
+'''
+Packet capture into a ring buffer.  `Capture.attach()` wraps a frame
+handler's `_handle_frame()` and `send_frame()` (on that instance only) so
+that every frame it receives or sends, and that matches the filter, is copied
+into the next slot of a buffer allocated once, up to `snaplen` bytes per
+frame.  When the buffer is full, the oldest frames are overwritten, so memory
+stays bounded however long capture runs.  The frames held can be written to
+a pcap file at any time with `write_pcap()`.
+
+Filters are written in a small subset of the tcpdump (BPF) syntax:
+primitives, each optionally preceded by `not`, joined by `and`:
+
+    arp | ip | ip6 | vlan | icmp | tcp | udp
+    ether proto N | proto N
+    ether [src|dst] host MAC
+    [src|dst] host IPV4
+    [src|dst] net PREFIX/LEN
+
+IP primitives match untagged IPv4 frames only.
+
+>>> capture = Capture(slots=2, snaplen=20, filter='ip and not dst host 10.0.0.9')
+>>> def frame(dst):
+...     return b'\\xff' * 6 + b'\\x00\\x00\\x00\\xaa\\xaa\\xaa' + b'\\x08\\x00' + \\
+...             b'\\x45' + bytes(11) + bytes((10, 0, 0, 1)) + bytes(dst) + bytes(20)
+>>> for dst in ((10, 0, 0, 2), (10, 0, 0, 9), (10, 0, 0, 3), (10, 0, 0, 4)):
+...     capture.record(frame(dst), 'a-s1', OUTBOUND)
+>>> capture.captured, len(capture)
+(3, 2)
+>>> [(intf, len(data), orig_len) for t, intf, direction, data, orig_len in capture.frames()]
+[('a-s1', 20, 54), ('a-s1', 20, 54)]
+>>> compile_filter('ether src host 00:00:00:aa:aa:aa and udp')(frame((10, 0, 0, 2)))
+False
+'''
+
+import array
+import atexit
+import signal
+import socket
+import struct
+import time
+
+#From /usr/include/linux/if_ether.h:
+ETH_P_IP = 0x0800 # Internet Protocol packet
+ETH_P_ARP = 0x0806 # Address Resolution packet
+ETH_P_8021Q = 0x8100 # 802.1Q VLAN Extended Header
+ETH_P_IPV6 = 0x86DD # IPv6 over bluebook
+
+#From /usr/include/linux/in.h:
+IPPROTO_ICMP = 1 # Internet Control Message Protocol
+IPPROTO_TCP = 6 # Transmission Control Protocol
+IPPROTO_UDP = 17 # User Datagram Protocol
+
+#From /usr/include/pcap/dlt.h:
+DLT_EN10MB = 1 # Ethernet (10Mb)
+
+PCAP_MAGIC = 0xa1b2c3d4
+
+INBOUND = 0
+OUTBOUND = 1
+
+_pcap_header = struct.Struct('=IHHiIII')
+_pcap_record = struct.Struct('=IIII')
+
+def _ethertype_is(ethertype):
+    hi, lo = ethertype >> 8, ethertype & 0xff
+    return lambda frame: len(frame) >= 14 and \
+            frame[12] == hi and frame[13] == lo
+
+def _ipv4_is(test):
+    # the frame is untagged IPv4, long enough to hold the fields tested
+    return lambda frame: len(frame) >= 34 and frame[12] == 0x08 and \
+            frame[13] == 0x00 and test(frame)
+
+def _mac(s):
+    return bytes(int(b, 16) for b in s.split(':'))
+
+def _prefix(s):
+    if '/' in s:
+        address, prefix_len = s.split('/')
+    else:
+        address, prefix_len = s, 32
+    prefix_len = int(prefix_len)
+    mask = ((1 << prefix_len) - 1) << (32 - prefix_len)
+    return int.from_bytes(socket.inet_aton(address), 'big') & mask, mask
+
+def _ip_fields(direction):
+    if direction == 'src':
+        return (26,)
+    elif direction == 'dst':
+        return (30,)
+    else:
+        return (26, 30)
+
+def _parse_primitive(tokens):
+    '''Consume one primitive from the front of tokens, and return a function
+    that tests whether a frame matches it.'''
+
+    token = tokens.pop(0)
+    if token == 'not':
+        test = _parse_primitive(tokens)
+        return lambda frame: not test(frame)
+
+    if token == 'arp':
+        return _ethertype_is(ETH_P_ARP)
+    if token == 'ip':
+        return _ethertype_is(ETH_P_IP)
+    if token == 'ip6':
+        return _ethertype_is(ETH_P_IPV6)
+    if token == 'vlan':
+        return _ethertype_is(ETH_P_8021Q)
+    if token in ('icmp', 'tcp', 'udp', 'proto'):
+        if token == 'proto':
+            protocol = int(tokens.pop(0), 0)
+        else:
+            protocol = {'icmp': IPPROTO_ICMP, 'tcp': IPPROTO_TCP,
+                    'udp': IPPROTO_UDP}[token]
+        return _ipv4_is(lambda frame: frame[23] == protocol)
+
+    if token == 'ether':
+        token = tokens.pop(0)
+        if token == 'proto':
+            return _ethertype_is(int(tokens.pop(0), 0))
+        direction = None
+        if token in ('src', 'dst'):
+            direction = token
+            token = tokens.pop(0)
+        if token != 'host':
+            raise ValueError('Expected "host" after "ether": %s' % token)
+        mac = _mac(tokens.pop(0))
+        if direction == 'src':
+            return lambda frame: frame[6:12] == mac
+        elif direction == 'dst':
+            return lambda frame: frame[:6] == mac
+        else:
+            return lambda frame: frame[6:12] == mac or frame[:6] == mac
+
+    direction = None
+    if token in ('src', 'dst'):
+        direction = token
+        token = tokens.pop(0)
+    if token in ('host', 'net'):
+        network, mask = _prefix(tokens.pop(0))
+        offsets = _ip_fields(direction)
+        def test(frame):
+            for offset in offsets:
+                if int.from_bytes(frame[offset:offset + 4], 'big') & mask == \
+                        network:
+                    return True
+            return False
+        return _ipv4_is(test)
+
+    raise ValueError('Unknown filter primitive: %s' % token)
+
+def compile_filter(expr):
+    '''
+    Return a function that returns True for the frames that match the filter
+    expression expr, or None if expr is empty (all frames match).
+
+    expr: str
+    '''
+
+    tokens = expr.split()
+    if not tokens:
+        return None
+    tests = [_parse_primitive(tokens)]
+    while tokens:
+        token = tokens.pop(0)
+        if token != 'and':
+            raise ValueError('Expected "and": %s' % token)
+        tests.append(_parse_primitive(tokens))
+    if len(tests) == 1:
+        return tests[0]
+    return lambda frame: all(test(frame) for test in tests)
+
+class Capture(object):
+    def __init__(self, slots=4096, snaplen=256, filter=None):
+        '''
+        Instantiate a capture holding up to the slots most recent frames, of
+        which only the first snaplen bytes are kept.
+
+        slots: int
+        snaplen: int
+        filter: str (filter expression; see compile_filter()) or callable
+        '''
+
+        self.slots = slots
+        self.snaplen = snaplen
+        if isinstance(filter, str):
+            filter = compile_filter(filter)
+        self.filter = filter
+
+        self._buf = memoryview(bytearray(slots * snaplen))
+        self._times = array.array('d', bytes(8 * slots))
+        self._lens = array.array('I', bytes(4 * slots))
+        self._caplens = array.array('I', bytes(4 * slots))
+        self._intfs = [None] * slots
+        self._directions = bytearray(slots)
+        self._next = 0
+
+        # total number of frames recorded, including those overwritten since
+        self.captured = 0
+
+    def __len__(self):
+        return min(self.captured, self.slots)
+
+    def record(self, frame, intf, direction):
+        '''
+        Copy frame into the next slot, if it matches the filter.
+
+        frame: bytes
+        intf: str
+        direction: int (INBOUND or OUTBOUND)
+        '''
+
+        if self.filter is not None and not self.filter(frame):
+            return
+        i = self._next
+        self._next = i + 1 if i + 1 < self.slots else 0
+        self.captured += 1
+
+        start = i * self.snaplen
+        length = len(frame)
+        if length <= self.snaplen:
+            self._buf[start:start + length] = frame
+            self._caplens[i] = length
+        else:
+            self._buf[start:start + self.snaplen] = \
+                    memoryview(frame)[:self.snaplen]
+            self._caplens[i] = self.snaplen
+        self._lens[i] = length
+        self._times[i] = time.time()
+        self._intfs[i] = intf
+        self._directions[i] = direction
+
+    def attach(self, node):
+        '''
+        Record the frames received by node._handle_frame() and sent by
+        node.send_frame().  This must be called before the event loop is
+        created, since it wraps _handle_frame().
+
+        node: frame handler (e.g., Host or Switch instance)
+        '''
+
+        handle_frame = node._handle_frame
+        send_frame = node.send_frame
+        record = self.record
+
+        def _handle_frame(frame, intf):
+            record(frame, intf, INBOUND)
+            return handle_frame(frame, intf)
+
+        def _send_frame(frame, intf):
+            record(frame, intf, OUTBOUND)
+            return send_frame(frame, intf)
+
+        node._handle_frame = _handle_frame
+        node.send_frame = _send_frame
+
+    def frames(self):
+        '''Yield a (time, intf, direction, data, orig_len) tuple for each frame
+        held, oldest first.'''
+
+        count = len(self)
+        first = (self._next - count) % self.slots
+        for j in range(count):
+            i = (first + j) % self.slots
+            start = i * self.snaplen
+            yield (self._times[i], self._intfs[i], self._directions[i],
+                    bytes(self._buf[start:start + self._caplens[i]]),
+                    self._lens[i])
+
+    def write_pcap(self, path, intf=None):
+        '''
+        Write the frames held (only those on intf, if given) to path in pcap
+        format, oldest first.
+
+        path: str
+        intf: str
+        '''
+
+        with open(path, 'wb') as fh:
+            fh.write(_pcap_header.pack(PCAP_MAGIC, 2, 4, 0, 0, self.snaplen,
+                    DLT_EN10MB))
+            for t, frame_intf, direction, data, orig_len in self.frames():
+                if intf is not None and frame_intf != intf:
+                    continue
+                usec = int(round(t * 1000000))
+                fh.write(_pcap_record.pack(usec // 1000000, usec % 1000000,
+                        len(data), orig_len))
+                fh.write(data)
+
+    def save_on_signal(self, path, signum=signal.SIGUSR1):
+        '''
+        Write the frames held to path whenever the process receives signal
+        signum, and when it exits.  Any handler already installed for signum
+        is still called, so that several captures in one process can share
+        the signal.
+
+        path: str
+        signum: int
+        '''
+
+        previous = signal.getsignal(signum)
+
+        def handler(signum, frame):
+            self.write_pcap(path)
+            if callable(previous):
+                previous(signum, frame)
+
+        signal.signal(signum, handler)
+        atexit.register(self.write_pcap, path)
@@ -0,0 +1,129 @@
+'''
+Lightweight views of Ethernet (including 802.1Q) headers, and builders for
+the Ethernet, IPv4 and ICMP headers of the frames that hosts send.  The header
+fields are unpacked with `struct.unpack_from()` directly from the frame, and
+the payload is exposed as a `memoryview` slice, so nothing beyond the header
+is copied.  Addresses are left in their packed (`bytes`) form.
+
+>>> frame = build_ethernet(b'\\xff' * 6, b'\\x00\\x00\\x00\\xaa\\xaa\\xaa', ETH_P_IP,
+...         vlan=10) + build_ipv4(b'\\x0a\\x00\\x00\\x02', b'\\x0a\\x00\\x00\\x01', 1,
+...         b'payload')
+>>> eth = EthernetHeader(frame)
+>>> eth.ethertype == ETH_P_IP, eth.vlan, eth.header_len, eth.is_broadcast()
+(True, 10, 18, True)
+>>> internet_checksum(eth.payload()[:20])
+0
+'''
+
+import struct
+
+#From /usr/include/linux/if_ether.h:
+ETH_P_IP = 0x0800 # Internet Protocol packet
+ETH_P_8021Q = 0x8100 # 802.1Q VLAN Extended Header
+
+#From /usr/include/linux/icmp.h:
+ICMP_ECHOREPLY = 0 # Echo Reply
+ICMP_ECHO = 8 # Echo Request
+
+ETH_HLEN = 14
+VLAN_HLEN = 4
+BROADCAST_MAC = b'\xff\xff\xff\xff\xff\xff'
+
+_eth = struct.Struct('!6s6sH')
+_vlan = struct.Struct('!HH')
+_ipv4 = struct.Struct('!BBHHHBBH4s4s')
+_icmp = struct.Struct('!BBH')
+
+class EthernetHeader(object):
+    '''
+    An Ethernet frame header.  If the frame has an 802.1Q tag, then `vlan` is
+    the VLAN ID, `ethertype` is the type of the encapsulated payload, and
+    `header_len` includes the tag; otherwise, `vlan` is None.
+    '''
+
+    __slots__ = ('frame', 'dst', 'src', 'ethertype', 'vlan', 'header_len')
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.dst, self.src, self.ethertype = _eth.unpack_from(frame, 0)
+        if self.ethertype == ETH_P_8021Q:
+            tci, self.ethertype = _vlan.unpack_from(frame, ETH_HLEN)
+            self.vlan = tci & 0x0fff
+            self.header_len = ETH_HLEN + VLAN_HLEN
+        else:
+            self.vlan = None
+            self.header_len = ETH_HLEN
+
+    def is_broadcast(self):
+        return self.dst == BROADCAST_MAC
+
+    def is_multicast(self):
+        '''Return True for group (including broadcast) destinations.'''
+        return self.dst[0] & 1 == 1
+
+    def payload(self):
+        '''Return the payload, as a memoryview of the frame.'''
+        return memoryview(self.frame)[self.header_len:]
+
+def build_ethernet(dst, src, ethertype, vlan=None):
+    '''
+    Return an Ethernet frame header, with an 802.1Q tag if vlan is not None.
+
+    dst: bytes
+    src: bytes
+    ethertype: int
+    vlan: int
+    '''
+
+    if vlan is None:
+        return _eth.pack(dst, src, ethertype)
+    return _eth.pack(dst, src, ETH_P_8021Q) + _vlan.pack(vlan, ethertype)
+
+def internet_checksum(data):
+    '''
+    Return the Internet checksum (RFC 1071) of data.
+
+    data: bytes, bytearray, or memoryview
+    '''
+
+    if len(data) & 1:
+        data = bytes(data) + b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data) >> 1), data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+def build_ipv4(src, dst, protocol, payload, ttl=64, id=0):
+    '''
+    Return an IPv4 packet (with no options), including its header checksum.
+
+    src, dst: bytes (4-byte IPv4 addresses)
+    protocol: int
+    payload: bytes
+    '''
+
+    header = bytearray(_ipv4.pack(0x45, 0, 20 + len(payload), id, 0,
+            ttl, protocol, 0, src, dst))
+    checksum = internet_checksum(header)
+    header[10] = checksum >> 8
+    header[11] = checksum & 0xff
+    return bytes(header) + payload
+
+def build_icmp(icmp_type, code, rest, data):
+    '''
+    Return an ICMP message, including its checksum.
+
+    icmp_type: int
+    code: int
+    rest: bytes (the 4 bytes following the checksum, e.g., identifier and
+    sequence number)
+    data: bytes
+    '''
+
+    msg = bytearray(_icmp.pack(icmp_type, code, 0))
+    msg += rest
+    msg += data
+    checksum = internet_checksum(msg)
+    msg[2] = checksum >> 8
+    msg[3] = checksum & 0xff
+    return bytes(msg)
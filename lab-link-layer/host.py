@@ -1,30 +1,41 @@
 #!/usr/bin/python3
 
+import argparse
 import os
 import socket
-
-from scapy.all import Ether, IP, ICMP
-from scapy.data import ETH_P_IP, IP_PROTOS 
+import sys
 
 from cougarnet.networksched import NetworkEventLoop
 from cougarnet.rawpkt import BaseFrameHandler
+from cougarnet.util import mac_binary_to_str, mac_str_to_binary, \
+        ip_str_to_binary
+
+from capture import Capture
+from headers import EthernetHeader
+from packet_template import EchoTemplate
 
 class Host(BaseFrameHandler):
     def __init__(self):
         super(Host, self).__init__()
 
+        # (src, srcmac) -> EchoTemplate
+        self._echo_templates = {}
+
     def _handle_frame(self, frame, intf):
-        frame = Ether(frame)
-        self.log(f'Received frame on %7s: {frame.src} -> {frame.dst}' % intf)
+        eth = EthernetHeader(frame)
+        self.log(f'Received frame on %7s: {mac_binary_to_str(eth.src)} -> {mac_binary_to_str(eth.dst)}' % intf)
 
     def send_icmp_echo(self, src, dst, srcmac, dstmac, id, seq):
-        frame = Ether(src=srcmac, dst=dstmac, type=ETH_P_IP)
-        ip = IP(src=src, dst=dst, proto=IP_PROTOS.icmp)
-        icmp = ICMP(type=8, id=id, seq=seq)
-        response = frame / ip / icmp / b'0123456789'
+        template = self._echo_templates.get((src, srcmac))
+        if template is None:
+            template = EchoTemplate(ip_str_to_binary(src), b'0123456789',
+                    mac_str_to_binary(srcmac))
+            self._echo_templates[(src, srcmac)] = template
+        frame = template.build(ip_str_to_binary(dst), id, seq,
+                dst_mac=mac_str_to_binary(dstmac))
 
         intf = self.get_first_interface()
-        self.send_frame(bytes(response), intf)
+        self.send_frame(frame, intf)
 
     def schedule_items(self, event_loop):
         pass
@@ -66,6 +77,19 @@ class HostE(Host):
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capture', '-c',
+            type=int, metavar='N', default=0,
+            help='Capture the last N frames received and sent')
+    parser.add_argument('--capture-filter',
+            metavar='EXPR', default='',
+            help='Capture only frames matching EXPR (e.g., "icmp")')
+    parser.add_argument('--capture-file',
+            metavar='PATH',
+            help='Write captured frames to PATH on SIGUSR1 and at exit '
+            '(default: HOSTNAME.pcap)')
+    args = parser.parse_args(sys.argv[1:])
+
     hostname = socket.gethostname()
     if hostname == 'a':
         cls = HostA
@@ -77,6 +101,10 @@ def main():
         cls = Host
 
     host = cls()
+    if args.capture:
+        capture = Capture(args.capture, filter=args.capture_filter)
+        capture.attach(host)
+        capture.save_on_signal(args.capture_file or '%s.pcap' % hostname)
     event_loop = NetworkEventLoop(host._handle_frame)
     host.schedule_items(event_loop)
     event_loop.run()
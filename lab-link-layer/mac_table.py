@@ -0,0 +1,162 @@
+'''
+A switch MAC address table, mapping each MAC address to the port (interface)
+it was last seen on, its VLAN, and the time it was last seen.  Lookups and
+updates are O(1).  Entries age out with a timer wheel: each entry sits in the
+bucket for the tick at which it is due to expire, and each tick only visits
+the entries in one bucket.  An entry that is refreshed is not moved when
+refreshed, but is rescheduled when its bucket comes due.  When the table is
+full, the least recently seen entry is evicted.
+
+>>> table = MacTable(aging_time=8, max_size=2)
+>>> table.learn(b'\\xaa' * 6, 's1-a', None, 0)
+>>> table.learn(b'\\xcc' * 6, 's1-c', None, 1)
+>>> table.lookup(b'\\xaa' * 6, 2)
+'s1-a'
+>>> table.learn(b'\\xaa' * 6, 's1-a', None, 5)
+>>> table.expire(9)
+1
+>>> table.lookup(b'\\xcc' * 6, 9) is None, table.lookup(b'\\xaa' * 6, 9)
+(True, 's1-a')
+>>> table.learn(b'\\xcc' * 6, 's1-c', None, 10)
+>>> table.learn(b'\\xee' * 6, 's1-e', None, 11)
+>>> len(table), table.evictions
+(2, 1)
+'''
+
+import collections
+import math
+
+class _Entry(object):
+    __slots__ = ('port', 'vlan', 'last_seen', 'tick')
+
+    def __init__(self, port, vlan, last_seen, tick):
+        self.port = port
+        self.vlan = vlan
+        self.last_seen = last_seen
+        self.tick = tick
+
+class MacTable(object):
+    def __init__(self, aging_time=8, max_size=8192, resolution=1):
+        '''
+        Instantiate an empty MAC address table.
+
+        aging_time: int or float (seconds after which an entry expires, if
+        not refreshed)
+        max_size: int (maximum number of entries)
+        resolution: int or float (seconds per timer wheel tick)
+        '''
+
+        self.aging_time = aging_time
+        self.max_size = max_size
+        self.resolution = resolution
+
+        self._entries = collections.OrderedDict()
+        self._wheel = [set() for i in range( \
+                int(math.ceil(aging_time / resolution)) + 2)]
+        self._next_tick = None
+
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _tick(self, t):
+        '''Return the first tick at or after time t.'''
+        return int(math.ceil(t / self.resolution))
+
+    def learn(self, mac, port, vlan, now):
+        '''
+        Record that mac was seen on port (and vlan) at time now.
+
+        mac: bytes
+        port: str
+        vlan: int or None
+        now: int or float
+        '''
+
+        entry = self._entries.get(mac)
+        if entry is not None:
+            entry.port = port
+            entry.vlan = vlan
+            entry.last_seen = now
+            self._entries.move_to_end(mac)
+            return
+
+        if len(self._entries) >= self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        tick = self._tick(now + self.aging_time)
+        if self._next_tick is None:
+            self._next_tick = self._tick(now)
+        self._entries[mac] = _Entry(port, vlan, now, tick)
+        self._wheel[tick % len(self._wheel)].add(mac)
+
+    def lookup(self, mac, now):
+        '''
+        Return the port on which mac was last seen, or None if there is no
+        unexpired entry for mac.
+
+        mac: bytes
+        now: int or float
+        '''
+
+        entry = self._entries.get(mac)
+        if entry is None or entry.last_seen + self.aging_time <= now:
+            return None
+        return entry.port
+
+    def get(self, mac):
+        '''Return the (port, vlan, last_seen) tuple for mac, or None.'''
+        entry = self._entries.get(mac)
+        if entry is None:
+            return None
+        return entry.port, entry.vlan, entry.last_seen
+
+    def remove_port(self, port):
+        '''Remove all entries for the given port (e.g., when it goes down).'''
+        for mac in [mac for mac, entry in self._entries.items() \
+                if entry.port == port]:
+            del self._entries[mac]
+
+    def expire(self, now):
+        '''
+        Advance the timer wheel to time now, removing the entries that have
+        expired.  Return the number of entries removed.
+
+        now: int or float
+        '''
+
+        if self._next_tick is None:
+            return 0
+
+        wheel = self._wheel
+        entries = self._entries
+        removed = 0
+        last_tick = int(math.floor(now / self.resolution))
+        # never go around the wheel more than once
+        first_tick = max(self._next_tick, last_tick - len(wheel) + 1)
+        for tick in range(first_tick, last_tick + 1):
+            bucket = wheel[tick % len(wheel)]
+            if not bucket:
+                continue
+            wheel[tick % len(wheel)] = set()
+            for mac in bucket:
+                entry = entries.get(mac)
+                if entry is None:
+                    continue
+                if entry.tick > tick:
+                    # due on a later trip around the wheel
+                    wheel[tick % len(wheel)].add(mac)
+                    continue
+                if entry.last_seen + self.aging_time <= now:
+                    del entries[mac]
+                    removed += 1
+                else:
+                    # refreshed since it was scheduled; reschedule
+                    entry.tick = self._tick(entry.last_seen + self.aging_time)
+                    wheel[entry.tick % len(wheel)].add(mac)
+        self._next_tick = last_tick + 1
+        self.expirations += removed
+        return removed
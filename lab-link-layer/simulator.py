@@ -0,0 +1,422 @@
+#!/usr/bin/python3
+'''
+An in-process simulator for the network configuration files, which runs every
+node of a scenario in one process, without network namespaces or root.  Each
+node whose `prog` is a Python script has that script's `main()` run with the
+node's hostname and arguments, against stand-ins for the `cougarnet` modules
+(`BaseFrameHandler`, `NetworkEventLoop` and `util`) that connect it to the
+simulated links.  Switches without a `prog` are simple learning bridges, and
+other nodes without a `prog` just record the frames they receive.
+
+Time is virtual: events run in time order from a heap, and `time.time()`
+returns the virtual time while the simulation runs, so a 20-second scenario
+finishes as fast as its frames can be handled.  Links deliver frames after
+their `delay` and, if a `bw` is given, after the time to transmit them.
+
+>>> sim = Simulator("""NODES
+... a
+... b
+... c
+... s1 type=switch
+...
+... LINKS
+... a,00:00:00:aa:aa:aa,10.0.0.1/24 s1
+... b,00:00:00:bb:bb:bb,10.0.0.2/24 s1
+... c,00:00:00:cc:cc:cc,10.0.0.3/24 s1 delay=5ms
+... """.splitlines())
+>>> sim.start()
+>>> a, b, c = sim.nodes['a'], sim.nodes['b'], sim.nodes['c']
+>>> payload = b'\\x08\\x00' + bytes(46)
+>>> sim.schedule(1, a.send_frame, (b'\\xff' * 6 + b'\\x00\\x00\\x00\\xaa\\xaa\\xaa' + payload, 'a-s1'))
+>>> sim.schedule(2, b.send_frame, (b'\\x00\\x00\\x00\\xaa\\xaa\\xaa' + b'\\x00\\x00\\x00\\xbb\\xbb\\xbb' + payload, 'b-s1'))
+>>> sim.run(3)
+>>> [(t, intf) for t, frame, intf in a.received + b.received + c.received]
+[(2, 'a-s1'), (1, 'b-s1'), (1.005, 'c-s1')]
+'''
+
+import argparse
+import heapq
+import importlib
+import itertools
+import os
+import socket
+import sys
+import time
+import types
+
+_current = None
+
+class InterfaceInfo(object):
+    def __init__(self, mac_addr, ipv4_addrs, ipv4_prefix_len, vlan=None,
+            trunk=False):
+        self.mac_addr = mac_addr
+        self.ipv4_addrs = ipv4_addrs
+        self.ipv4_prefix_len = ipv4_prefix_len
+        self.mtu = 1500
+        self.vlan = vlan
+        self.trunk = trunk
+
+class _Link(object):
+    __slots__ = ('node', 'intf', 'delay', 'bandwidth', 'busy_until')
+
+    def __init__(self, node, intf, delay, bandwidth):
+        self.node = node
+        self.intf = intf
+        self.delay = delay
+        self.bandwidth = bandwidth
+        self.busy_until = 0
+
+class Node(object):
+    def __init__(self, sim, name, attrs):
+        self.sim = sim
+        self.name = name
+        self.attrs = attrs
+        self.int_to_info = {}
+        # interface -> _Link to the peer interface
+        self.links = {}
+        self.handle_frame = None
+        self.received = []
+
+    def send_frame(self, frame, intf):
+        self.sim.transmit(self, intf, frame)
+
+    def receive(self, frame, intf):
+        if self.handle_frame is not None:
+            self.handle_frame(frame, intf)
+        else:
+            self.received.append((self.sim.now, frame, intf))
+
+class _NativeSwitch(object):
+    '''A learning bridge, for switches that have no `prog`.'''
+
+    def __init__(self, node):
+        self.node = node
+        self.table = {}
+
+    def handle_frame(self, frame, intf):
+        self.table[frame[6:12]] = intf
+        port = self.table.get(frame[:6])
+        if port is not None and not frame[0] & 1:
+            if port != intf:
+                self.node.send_frame(frame, port)
+            return
+        for port in self.node.links:
+            if port != intf:
+                self.node.send_frame(frame, port)
+
+class _BaseFrameHandler(object):
+    '''Stand-in for `cougarnet.rawpkt.BaseFrameHandler`.'''
+
+    def __init__(self):
+        self._sim_node = _current
+        self.hostname = _current.name
+        self.int_to_info = _current.int_to_info
+
+    def send_frame(self, frame, intf):
+        self._sim_node.sim.transmit(self._sim_node, intf, frame)
+
+    def get_first_interface(self):
+        return next(iter(self.int_to_info))
+
+    def log(self, msg):
+        self._sim_node.sim.log(self._sim_node.name, msg)
+
+class _NetworkEventLoop(object):
+    '''Stand-in for `cougarnet.networksched.NetworkEventLoop`.'''
+
+    def __init__(self, handle_frame):
+        self._sim_node = _current
+        _current.handle_frame = handle_frame
+
+    def schedule_event(self, seconds, func, args=()):
+        self._sim_node.sim.schedule(seconds, func, args)
+
+    def run(self):
+        # The simulator runs the events of all nodes.
+        pass
+
+def _mac_str_to_binary(mac):
+    return bytes.fromhex(mac.replace(':', ''))
+
+def _mac_binary_to_str(mac):
+    return ':'.join('%02x' % b for b in mac)
+
+def _ip_str_to_binary(ip):
+    return socket.inet_aton(ip)
+
+def _ip_binary_to_str(ip):
+    return socket.inet_ntoa(ip)
+
+def install_cougarnet_modules():
+    '''
+    Make the simulator's stand-ins importable as the `cougarnet` modules.
+    This must happen before the node scripts are imported.
+    '''
+
+    package = types.ModuleType('cougarnet')
+    package.__path__ = []
+    rawpkt = types.ModuleType('cougarnet.rawpkt')
+    rawpkt.BaseFrameHandler = _BaseFrameHandler
+    networksched = types.ModuleType('cougarnet.networksched')
+    networksched.NetworkEventLoop = _NetworkEventLoop
+    util = types.ModuleType('cougarnet.util')
+    util.mac_str_to_binary = _mac_str_to_binary
+    util.mac_binary_to_str = _mac_binary_to_str
+    util.ip_str_to_binary = _ip_str_to_binary
+    util.ip_binary_to_str = _ip_binary_to_str
+    package.rawpkt = rawpkt
+    package.networksched = networksched
+    package.util = util
+    for module in (package, rawpkt, networksched, util):
+        sys.modules[module.__name__] = module
+
+def _parse_time(value):
+    '''Return the number of seconds in a value such as `10ms` or `1s`.'''
+    for suffix, scale in (('us', 1e-6), ('ms', 1e-3), ('s', 1)):
+        if value.endswith(suffix):
+            return float(value[:-len(suffix)]) * scale
+    return float(value)
+
+def _parse_rate(value):
+    '''Return the number of bits per second in a value such as `10Mbit`.'''
+    lower = value.lower()
+    for suffix, scale in (('gbit', 1e9), ('mbit', 1e6), ('kbit', 1e3),
+            ('bit', 1)):
+        if lower.endswith(suffix):
+            return float(value[:-len(suffix)]) * scale
+    return float(value)
+
+def _parse_attrs(s):
+    attrs = {}
+    for attr in s.split(','):
+        if '=' in attr:
+            name, value = attr.split('=', 1)
+            attrs[name] = value
+    return attrs
+
+class Simulator(object):
+    def __init__(self, config, base_dir='.', delay=0, bandwidth=None,
+            quiet=True):
+        '''
+        Instantiate a simulation of the network configuration in config.
+
+        config: iterable of str (the lines of the configuration file)
+        base_dir: str (directory relative to which `prog` paths are found)
+        delay: int or float (default link delay, in seconds)
+        bandwidth: int or float (default link bandwidth, in bits per second;
+        None for no limit)
+        quiet: bool (if False, print log messages as they are logged)
+        '''
+
+        self.base_dir = base_dir
+        self.delay = delay
+        self.bandwidth = bandwidth
+        self.quiet = quiet
+
+        self.now = 0
+        self.nodes = {}
+        self.logs = []
+
+        self._events = []
+        self._counter = itertools.count()
+        self._macs = itertools.count(1)
+
+        self._parse(config)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path) as fh:
+            return cls(fh.read().splitlines(),
+                    os.path.dirname(os.path.abspath(path)), **kwargs)
+
+    def _parse(self, config):
+        section = None
+        for line in config:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line in ('NODES', 'LINKS'):
+                section = line
+                continue
+            fields = line.split()
+            if section == 'NODES':
+                attrs = _parse_attrs(fields[1]) if len(fields) > 1 else {}
+                self.nodes[fields[0]] = Node(self, fields[0], attrs)
+            elif section == 'LINKS':
+                attrs = {}
+                for field in fields[2:]:
+                    attrs.update(_parse_attrs(field))
+                self._add_link(fields[0], fields[1], attrs)
+
+    def _endpoint(self, s, peer_name, attrs):
+        parts = s.split(',')
+        node = self.nodes[parts[0]]
+        intf = '%s-%s' % (parts[0], peer_name)
+        mac = None
+        ipv4_addrs = []
+        prefix_len = None
+        for part in parts[1:]:
+            if '/' in part:
+                ip, prefix_len = part.split('/')
+                ipv4_addrs.append(ip)
+                prefix_len = int(prefix_len)
+            elif part.count(':') == 5:
+                mac = part
+        if mac is None:
+            i = next(self._macs)
+            mac = '02:00:00:%02x:%02x:%02x' % \
+                    ((i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)
+        vlan = attrs.get('vlan')
+        node.int_to_info[intf] = InterfaceInfo(mac, ipv4_addrs, prefix_len,
+                int(vlan) if vlan is not None else None,
+                attrs.get('trunk', 'false').lower() == 'true')
+        return node, intf
+
+    def _add_link(self, end1, end2, attrs):
+        name1 = end1.split(',')[0]
+        name2 = end2.split(',')[0]
+        node1, intf1 = self._endpoint(end1, name2, attrs)
+        node2, intf2 = self._endpoint(end2, name1, attrs)
+        delay = _parse_time(attrs['delay']) if 'delay' in attrs else self.delay
+        bandwidth = _parse_rate(attrs['bw']) if 'bw' in attrs \
+                else self.bandwidth
+        node1.links[intf1] = _Link(node2, intf2, delay, bandwidth)
+        node2.links[intf2] = _Link(node1, intf1, delay, bandwidth)
+
+    def _start_node(self, node):
+        global _current
+
+        prog = node.attrs.get('prog')
+        if prog is None:
+            if node.attrs.get('type') == 'switch':
+                node.handle_frame = _NativeSwitch(node).handle_frame
+            return
+
+        args = prog.split('|')
+        while args and args[0] in ('sudo', '-E'):
+            args.pop(0)
+        path = os.path.join(self.base_dir, args[0])
+        name = os.path.splitext(os.path.basename(path))[0]
+
+        saved = sys.argv, socket.gethostname
+        _current = node
+        try:
+            sys.argv = [path] + args[1:]
+            socket.gethostname = lambda: node.name
+            importlib.import_module(name).main()
+        finally:
+            _current = None
+            sys.argv, socket.gethostname = saved
+
+    def instantiate(self, name, cls, *args, **kwargs):
+        '''
+        Create a frame handler of class cls (a subclass of BaseFrameHandler)
+        for the named node, e.g., to drive it directly in a benchmark.  The
+        `cougarnet` modules must already be installed (see start() and
+        install_cougarnet_modules()).
+
+        name: str
+        cls: class
+        '''
+
+        global _current
+
+        node = self.nodes[name]
+        _current = node
+        try:
+            handler = cls(*args, **kwargs)
+        finally:
+            _current = None
+        node.handle_frame = handler._handle_frame
+        return handler
+
+    def _virtual_time(self):
+        return self.now
+
+    def start(self):
+        '''Start the program on each node, in the order they are listed.'''
+        install_cougarnet_modules()
+        if self.base_dir not in sys.path:
+            sys.path.insert(0, self.base_dir)
+        saved_time = time.time
+        time.time = self._virtual_time
+        try:
+            for node in self.nodes.values():
+                self._start_node(node)
+        finally:
+            time.time = saved_time
+
+    def schedule(self, seconds, func, args=()):
+        '''
+        Call func(*args) after the given number of (virtual) seconds.
+
+        seconds: int or float
+        func: callable
+        args: tuple
+        '''
+
+        heapq.heappush(self._events,
+                (self.now + seconds, next(self._counter), func, args))
+
+    def transmit(self, node, intf, frame):
+        '''Send frame out intf of node, to the node at the other end of the
+        link.'''
+        link = node.links[intf]
+        start = max(self.now, link.busy_until)
+        if link.bandwidth:
+            link.busy_until = start + len(frame) * 8 / link.bandwidth
+        else:
+            link.busy_until = start
+        heapq.heappush(self._events,
+                (link.busy_until + link.delay, next(self._counter),
+                    link.node.receive, (bytes(frame), link.intf)))
+
+    def log(self, name, msg):
+        self.logs.append((self.now, name, msg))
+        if not self.quiet:
+            print('%8.3f  %s  %s' % (self.now, name, msg))
+
+    def run(self, until):
+        '''
+        Run events in time order until the given virtual time, or until
+        there are none left.  A time is required because nodes schedule
+        recurring events, such as the aging of their ARP caches and MAC
+        address tables, so that there are always events left.
+
+        until: int or float
+        '''
+
+        events = self._events
+        saved_time = time.time
+        time.time = self._virtual_time
+        try:
+            while events and events[0][0] <= until:
+                self.now, i, func, args = heapq.heappop(events)
+                func(*args)
+            self.now = max(self.now, until)
+        finally:
+            time.time = saved_time
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Run a network configuration in one process')
+    parser.add_argument('--time', '-t',
+            type=float, metavar='SECONDS', default=30,
+            help='Virtual time for which to run (default: 30)')
+    parser.add_argument('--delay',
+            type=_parse_time, default=0,
+            help='Default link delay (e.g., 1ms)')
+    parser.add_argument('--bandwidth',
+            type=_parse_rate, default=None,
+            help='Default link bandwidth (e.g., 100Mbit)')
+    parser.add_argument('config_file',
+            help='Network configuration file')
+    args = parser.parse_args(sys.argv[1:])
+
+    sim = Simulator.from_file(args.config_file, delay=args.delay,
+            bandwidth=args.bandwidth, quiet=False)
+    sim.start()
+    sim.run(args.time)
+
+if __name__ == '__main__':
+    main()
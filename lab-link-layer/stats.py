@@ -0,0 +1,222 @@
+'''
+Opt-in instrumentation for frame handlers.  `Stats.instrument()` replaces a
+method of an object (on that instance only) with a wrapper that counts calls,
+optionally per interface, and times one call in every `sample_every` into a
+histogram with power-of-two buckets.  Nothing is wrapped unless
+instrumentation is enabled, so an uninstrumented node runs the same code as
+before.
+
+Counters can also be incremented directly with `count()`, and `gauge()`
+registers a function whose value is read at each snapshot.  Snapshots are
+plain dicts, which can be dumped periodically from the event loop with
+`schedule_dump()`, or fetched over a Unix socket started with `serve()`.
+
+>>> class Node(object):
+...     def handle(self, frame, intf):
+...         return len(frame)
+>>> node = Node()
+>>> stats = Stats(sample_every=2)
+>>> stats.instrument(node, 'handle', intf_arg=1)
+>>> for intf in ('a', 'a', 'b'):
+...     _ = node.handle(b'frame', intf)
+>>> stats.count('drop.no_route')
+>>> stats.gauge('queued', lambda: 7)
+>>> snapshot = stats.snapshot()
+>>> snapshot['counters']
+{'handle': 3, 'handle.a': 2, 'handle.b': 1, 'drop.no_route': 1}
+>>> snapshot['gauges'], snapshot['latency_ns']['handle']['samples']
+({'queued': 7}, 1)
+'''
+
+import collections
+import errno
+import functools
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+import time
+
+class Histogram(object):
+    '''A histogram of non-negative integers, in power-of-two buckets.'''
+
+    __slots__ = ('buckets', 'count', 'total')
+
+    def __init__(self):
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        self.buckets[min(value.bit_length(), 63)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, p):
+        '''Return the upper bound of the bucket holding the p-th
+        percentile.'''
+        if not self.count:
+            return None
+        target = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n:
+                return (1 << i) - 1
+        return None
+
+    def summary(self):
+        return {
+            'samples': self.count,
+            'mean': self.total // self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+class Stats(object):
+    def __init__(self, sample_every=64):
+        '''
+        Instantiate an empty set of counters and histograms.
+
+        sample_every: int (time one call in every sample_every calls of each
+        instrumented method)
+        '''
+
+        self.sample_every = sample_every
+        self.counters = collections.Counter()
+        self.histograms = collections.defaultdict(Histogram)
+        self._gauges = {}
+        self._server = None
+
+    def count(self, name, n=1):
+        '''Add n to the named counter.'''
+        self.counters[name] += n
+
+    def gauge(self, name, func):
+        '''Report the value returned by func() as name in each snapshot.'''
+        self._gauges[name] = func
+
+    def instrument(self, obj, name, label=None, intf_arg=None):
+        '''
+        Wrap the method name of obj so that its calls are counted (as label,
+        by default the method name) and sampled for latency.  If intf_arg is
+        given, calls are also counted per interface, taken from that
+        positional argument, as `label.intf`.
+
+        obj: object
+        name: str
+        label: str
+        intf_arg: int
+        '''
+
+        func = getattr(obj, name)
+        if label is None:
+            label = name
+        counters = self.counters
+        histogram = self.histograms[label]
+        sample_every = self.sample_every
+        perf_counter_ns = time.perf_counter_ns
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            counters[label] += 1
+            if intf_arg is not None:
+                counters['%s.%s' % (label, args[intf_arg])] += 1
+            if counters[label] % sample_every:
+                return func(*args, **kwargs)
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.add(perf_counter_ns() - start)
+
+        setattr(obj, name, wrapper)
+
+    def snapshot(self):
+        '''Return the current counters, gauges and latency summaries.'''
+        while True:
+            try:
+                counters = dict(self.counters)
+                histograms = dict(self.histograms)
+                break
+            except RuntimeError:
+                # changed by the event loop while being copied (serve())
+                continue
+        return {
+            'time': time.time(),
+            'counters': counters,
+            'gauges': {name: func() for name, func in self._gauges.items()},
+            'latency_ns': {name: h.summary()
+                    for name, h in histograms.items() if h.count},
+        }
+
+    def dump(self, fh=None):
+        '''Write a snapshot to fh (by default, standard error) as a line of
+        JSON.'''
+        if fh is None:
+            fh = sys.stderr
+        fh.write(json.dumps(self.snapshot()) + '\n')
+        fh.flush()
+
+    def schedule_dump(self, event_loop, interval, fh=None):
+        '''
+        Dump a snapshot every interval seconds from event_loop.
+
+        event_loop: event loop with a schedule_event() method
+        interval: int or float
+        fh: file object
+        '''
+
+        def dump():
+            self.dump(fh)
+            event_loop.schedule_event(interval, dump, ())
+        event_loop.schedule_event(interval, dump, ())
+
+    def serve(self, path):
+        '''
+        Listen on a Unix socket at path, and reply to each connection with a
+        snapshot, as JSON, from a background thread.  A socket left at path,
+        e.g., by an earlier run, is replaced; anything else raises
+        FileExistsError.
+
+        path: str
+        '''
+
+        try:
+            mode = os.lstat(path).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError(errno.EEXIST,
+                        'Exists and is not a socket', path)
+            os.unlink(path)
+        self._server = sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(8)
+
+        def accept():
+            while True:
+                try:
+                    conn, addr = sock.accept()
+                except OSError:
+                    # closed
+                    break
+                with conn:
+                    conn.sendall(json.dumps(self.snapshot()).encode('utf-8'))
+
+        threading.Thread(target=accept, daemon=True).start()
+
+    def close(self):
+        '''Stop serving snapshots.'''
+        if self._server is not None:
+            # shutdown() wakes up the thread blocked in accept()
+            try:
+                self._server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server.close()
+            self._server = None
@@ -1,20 +1,182 @@
 #!/usr/bin/python3
 
+import argparse
+import socket
+import sys
+import time
+
 from cougarnet.networksched import NetworkEventLoop
 from cougarnet.rawpkt import BaseFrameHandler
 
-class Switch(BaseFrameHandler):
-    def __init__(self):
+from asyncio_loop import AsyncioEventLoop
+from batch_io import BatchedFrameHandler, BatchedEventLoop
+from capture import Capture
+from mac_table import MacTable
+from stats import Stats
+from vlan import VlanPorts
+
+AGING_TIME = 8 # seconds
+MAX_TABLE_SIZE = 8192
+AGING_RESOLUTION = 1 # seconds
+
+class Switch(BatchedFrameHandler, BaseFrameHandler):
+    def __init__(self, aging_time=AGING_TIME, max_table_size=MAX_TABLE_SIZE):
         super(Switch, self).__init__()
 
-        # do any initialization here...
+        self.aging_time = aging_time
+        self.max_table_size = max_table_size
+
+        # the VLAN of each port, and the trunks, read from the interface
+        # attributes; ports with no VLAN are on the native VLAN (None)
+        self.vlans = VlanPorts(self.int_to_info)
+        self._trunks = self.vlans.trunks
+        self._port_vlan = self.vlans.port_vlan
+
+        # one MAC table per VLAN
+        self.mac_tables = {}
+        for vlan in self.vlans.flood_ports:
+            self._add_vlan(vlan)
+
+    def _add_vlan(self, vlan):
+        self.mac_tables[vlan] = MacTable(self.aging_time, self.max_table_size,
+                AGING_RESOLUTION)
+
+    def learn(self, mac, intf, vlan, now):
+        self.mac_tables[vlan].learn(mac, intf, vlan, now)
+
+    def lookup(self, mac, vlan, now):
+        return self.mac_tables[vlan].lookup(mac, now)
 
     def _handle_frame(self, frame, intf):
-        print('Received frame: %s' % repr(frame))
+        if intf in self._trunks:
+            # strip the 802.1Q tag, if any, and use its VLAN ID
+            vlan, frame = self.vlans.receive(frame, intf)
+            if vlan not in self.mac_tables:
+                self._add_vlan(vlan)
+        else:
+            vlan = self._port_vlan[intf]
+
+        dst = frame[:6]
+        now = time.time()
+
+        self.learn(frame[6:12], intf, vlan, now)
+
+        # broadcast and multicast (group) addresses have the low-order bit of
+        # the first byte set
+        if not dst[0] & 1:
+            port = self.lookup(dst, vlan, now)
+            if port is not None:
+                if port == intf:
+                    self.drop(frame, 'same_port')
+                elif port in self._trunks:
+                    self.send_frame(self.vlans.tag(frame, vlan), port)
+                else:
+                    self.send_frame(frame, port)
+                return
+        self.flood(frame, intf, vlan)
+
+    def flood(self, frame, intf, vlan=None):
+        '''
+        Send the (untagged) frame out every port in vlan except intf, the one
+        it arrived on, tagging it for trunk ports, unless vlan is the native
+        VLAN.
+        '''
+
+        tagged = None
+        for port in self.vlans.flood_ports[vlan]:
+            if port == intf:
+                continue
+            if port in self._trunks:
+                if tagged is None:
+                    tagged = self.vlans.tag(frame, vlan)
+                self.send_frame(tagged, port)
+            else:
+                self.send_frame(frame, port)
+
+    def drop(self, frame, reason):
+        '''Called when frame is dropped for the given reason (a str).  This
+        does nothing, unless stats are enabled.'''
+        pass
+
+    def enable_stats(self, stats):
+        '''
+        Instrument this switch's receive, learn, lookup, flood and send steps
+        with stats.  This must be called before the event loop is created,
+        since it wraps _handle_frame().
+
+        stats: Stats instance
+        '''
+
+        stats.instrument(self, '_handle_frame', intf_arg=1)
+        stats.instrument(self, 'flood', intf_arg=1)
+        stats.instrument(self, 'send_frame', intf_arg=1)
+        stats.instrument(self, 'learn')
+        stats.instrument(self, 'lookup')
+        self.drop = lambda frame, reason: stats.count('drop.' + reason)
+        tables = self.mac_tables.values
+        stats.gauge('mac_entries', lambda: sum(len(t) for t in tables()))
+        stats.gauge('mac_evictions', lambda: sum(t.evictions for t in tables()))
+        stats.gauge('mac_expirations',
+                lambda: sum(t.expirations for t in tables()))
+
+    def age_entries(self, event_loop):
+        '''Expire MAC table entries, then schedule the next aging pass.'''
+        now = time.time()
+        for table in self.mac_tables.values():
+            table.expire(now)
+        event_loop.schedule_event(AGING_RESOLUTION,
+                self.age_entries, (event_loop,))
+
+    def schedule_items(self, event_loop):
+        event_loop.schedule_event(AGING_RESOLUTION,
+                self.age_entries, (event_loop,))
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', '-b',
+            type=int, metavar='N', default=0,
+            help='Receive and send frames in batches of up to N frames')
+    parser.add_argument('--asyncio', '-a',
+            action='store_const', const=True, default=False,
+            help='Run on an asyncio event loop')
+    parser.add_argument('--stats', '-s',
+            type=float, metavar='SECONDS', default=0,
+            help='Collect stats and dump them to stderr every SECONDS')
+    parser.add_argument('--stats-socket',
+            metavar='PATH',
+            help='Collect stats and serve them on a Unix socket at PATH')
+    parser.add_argument('--capture', '-c',
+            type=int, metavar='N', default=0,
+            help='Capture the last N frames received and sent')
+    parser.add_argument('--capture-filter',
+            metavar='EXPR', default='',
+            help='Capture only frames matching EXPR (e.g., "icmp")')
+    parser.add_argument('--capture-file',
+            metavar='PATH',
+            help='Write captured frames to PATH on SIGUSR1 and at exit '
+            '(default: HOSTNAME.pcap)')
+    args = parser.parse_args(sys.argv[1:])
+
     switch = Switch()
-    event_loop = NetworkEventLoop(switch._handle_frame)
+    if args.stats or args.stats_socket:
+        stats = Stats()
+        switch.enable_stats(stats)
+        if args.stats_socket:
+            stats.serve(args.stats_socket)
+    if args.capture:
+        capture = Capture(args.capture, filter=args.capture_filter)
+        capture.attach(switch)
+        capture.save_on_signal(args.capture_file or
+                '%s.pcap' % socket.gethostname())
+    if args.asyncio:
+        event_loop = AsyncioEventLoop(switch, batch_size=args.batch or 1)
+    elif args.batch:
+        event_loop = BatchedEventLoop(switch, args.batch)
+    else:
+        event_loop = NetworkEventLoop(switch._handle_frame)
+    if args.stats:
+        stats.schedule_dump(event_loop, args.stats)
+    switch.schedule_items(event_loop)
     event_loop.run()
 
 if __name__ == '__main__':
@@ -0,0 +1,96 @@
+'''
+The VLAN configuration of a switch's ports, read from the `vlan` and `trunk`
+attributes of its interfaces.  Each port is either an access port for one
+VLAN, a trunk, or an access port with no VLAN, which belongs to the native
+VLAN (None).  Frames are tagged with 802.1Q headers on trunks, except those
+of the native VLAN, which are sent untagged; likewise, untagged frames
+received on a trunk belong to the native VLAN.
+
+>>> from types import SimpleNamespace as Info
+>>> ports = VlanPorts({'s1-a': Info(vlan=None), 's1-b': Info(vlan=10),
+...         's1-t': Info(trunk=True)})
+>>> ports.flood_ports[None], ports.flood_ports[10]
+(('s1-a', 's1-t'), ('s1-b', 's1-t'))
+>>> frame = b'\\xff' * 6 + b'\\x00\\x00\\x00\\xaa\\xaa\\xaa' + b'\\x08\\x00' + bytes(46)
+>>> tagged = ports.tag(frame, 10)
+>>> tagged[12:16], ports.tag(frame, None) == frame
+(b'\\x81\\x00\\x00\\n', True)
+>>> ports.receive(tagged, 's1-t') == (10, frame), ports.receive(frame, 's1-t')[0]
+(True, None)
+>>> ports.receive(frame, 's1-b')[0]
+10
+>>> ports.receive(frame[:12] + b'\\x81\\x00\\x00\\x1e' + frame[12:], 's1-t')[0]
+30
+>>> ports.flood_ports[30]
+('s1-t',)
+'''
+
+import struct
+
+#From /usr/include/linux/if_ether.h:
+ETH_P_8021Q = 0x8100 # 802.1Q VLAN Extended Header
+
+class VlanPorts(object):
+    def __init__(self, int_to_info):
+        '''
+        Read the VLAN configuration of the given interfaces.
+
+        int_to_info: dict mapping interface names to objects with optional
+        vlan (int) and trunk (bool) attributes
+        '''
+
+        self.ports = sorted(int_to_info)
+        self.port_vlan = {}
+        self.trunks = set()
+        for port in self.ports:
+            info = int_to_info[port]
+            if getattr(info, 'trunk', False):
+                self.trunks.add(port)
+            else:
+                vlan = getattr(info, 'vlan', None)
+                self.port_vlan[port] = int(vlan) if vlan is not None else None
+
+        # per VLAN, the ports that frames are flooded to and the 802.1Q tag
+        # added when sending on a trunk (empty for the native VLAN)
+        self.flood_ports = {}
+        self._tags = {}
+        for vlan in set(self.port_vlan.values()):
+            self.add_vlan(vlan)
+
+    def add_vlan(self, vlan):
+        '''Add vlan, which only the trunks belong to, unless it is the VLAN
+        of an access port.'''
+        self.flood_ports[vlan] = tuple(port for port in self.ports \
+                if port in self.trunks or self.port_vlan.get(port) == vlan)
+        if vlan is None:
+            self._tags[vlan] = b''
+        else:
+            self._tags[vlan] = struct.pack('!HH', ETH_P_8021Q, vlan)
+
+    def receive(self, frame, port):
+        '''
+        Return the VLAN of frame, received on port, and the frame without
+        its 802.1Q tag, if it has one.  A VLAN first seen on a trunk is
+        added.
+
+        frame: bytes
+        port: str
+        '''
+
+        if port not in self.trunks:
+            return self.port_vlan[port], frame
+        if frame[12] << 8 | frame[13] != ETH_P_8021Q:
+            vlan = None
+        else:
+            vlan = (frame[14] << 8 | frame[15]) & 0x0fff
+            frame = frame[:12] + frame[16:]
+        if vlan not in self.flood_ports:
+            self.add_vlan(vlan)
+        return vlan, frame
+
+    def tag(self, frame, vlan):
+        '''Return the (untagged) frame as it is sent on a trunk for vlan.'''
+        tag = self._tags[vlan]
+        if not tag:
+            return frame
+        return frame[:12] + tag + frame[12:]
@@ -0,0 +1,153 @@
+'''
+Synthetic workloads and measurement helpers for benchmarks: Zipf-distributed
+choices of source and destination for each frame, and frames of a given size.
+All randomness comes from a `random.Random` instance, so a workload is the
+same for the same seed.
+
+>>> import random
+>>> rng = random.Random(1)
+>>> macs = [bytes((2, 0, 0, 0, 0, i)) for i in range(10)]
+>>> choices = list(zip(zipf_choices(10, 1000, 1.1, rng),
+...         zipf_choices(10, 1000, 1.1, rng)))
+>>> frames = build_frames(macs, choices, 128)
+>>> len(frames), len(frames[0])
+(1000, 128)
+>>> result = measure(lambda frame: frame[:6], frames, sample_every=10)
+>>> result['count'], sorted(result['latency_ns'])
+(1000, ['max', 'p50', 'p90', 'p99'])
+'''
+
+import bisect
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+
+from headers import ETH_P_IP, build_ethernet
+
+def zipf_choices(n, count, s, rng):
+    '''
+    Return a list of count indexes in range(n), where index k is chosen with
+    probability proportional to 1 / (k + 1) ** s.  With s = 0, the choice is
+    uniform.
+
+    n: int
+    count: int
+    s: int or float
+    rng: random.Random instance
+    '''
+
+    cum_weights = list(itertools.accumulate(1 / (k + 1) ** s
+            for k in range(n)))
+    total = cum_weights[-1]
+    return [bisect.bisect(cum_weights, rng.random() * total)
+            for i in range(count)]
+
+def build_frames(macs, choices, size):
+    '''
+    Return a list of Ethernet frames of size bytes, one for each (src, dst)
+    pair of indexes into macs in choices.
+
+    macs: list of bytes
+    choices: list of (int, int) tuples
+    size: int (at least 14)
+    '''
+
+    payload = bytes(size - 14)
+    return [build_ethernet(macs[dst], macs[src], ETH_P_IP) + payload
+            for src, dst in choices]
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1,
+            int(len(sorted_values) * p / 100))]
+
+def measure(func, items, sample_every=100):
+    '''
+    Call func(item) for each of items, and return a dict with the count,
+    the elapsed time, the rate (per second), and percentiles of the latency
+    (in nanoseconds) of every sample_every-th call.  Sampling keeps the
+    cost of timing individual calls out of the rate.
+
+    func: callable
+    items: list
+    sample_every: int
+    '''
+
+    samples = []
+    perf_counter_ns = time.perf_counter_ns
+    start = perf_counter_ns()
+    for i in range(0, len(items), sample_every):
+        t = perf_counter_ns()
+        func(items[i])
+        samples.append(perf_counter_ns() - t)
+        for item in items[i + 1:i + sample_every]:
+            func(item)
+    elapsed = (perf_counter_ns() - start) / 1e9
+
+    samples.sort()
+    return {
+        'count': len(items),
+        'seconds': elapsed,
+        'per_second': len(items) / elapsed if elapsed else None,
+        'latency_ns': {
+            'p50': _percentile(samples, 50),
+            'p90': _percentile(samples, 90),
+            'p99': _percentile(samples, 99),
+            'max': samples[-1] if samples else None,
+        },
+    }
+
+def max_rss():
+    '''Return the peak resident set size of this process, in bytes.'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def environment():
+    '''Return a dict describing the code and machine the benchmark ran on.'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+def save_results(path, results):
+    '''
+    Write the results, along with environment(), to path as JSON.
+
+    path: str
+    results: list of dict
+    '''
+
+    with open(path, 'w') as fh:
+        json.dump({'environment': environment(), 'results': results}, fh,
+                indent=2)
+
+def compare_results(path, results):
+    '''
+    Print the change in rate of each of results from the result with the same
+    name in the JSON file at path.
+
+    path: str
+    results: list of dict
+    '''
+
+    with open(path) as fh:
+        baseline = {r['name']: r for r in json.load(fh)['results']}
+    for result in results:
+        old = baseline.get(result['name'])
+        if old is None or not old['per_second']:
+            continue
+        print('%-50s %12.0f/s -> %12.0f/s (%+.1f%%)' % (result['name'],
+                old['per_second'], result['per_second'],
+                100 * (result['per_second'] / old['per_second'] - 1)))
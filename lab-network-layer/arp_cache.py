@@ -0,0 +1,185 @@
+'''
+An ARP cache, mapping each (interface, IPv4 address) pair to a MAC address.
+Entries expire after `timeout` seconds.  Packets sent to a next hop that is
+not yet resolved are held in a bounded queue for that next hop, and are
+returned all at once when the mapping is learned.  Only one ARP request is
+sent per `request_interval` seconds for a given next hop, no matter how many
+packets are queued for it; if no reply comes after `max_requests` requests,
+the queued packets are dropped and the next hop is negatively cached for
+`negative_timeout` seconds, during which packets for it are dropped without
+sending further requests.
+
+Nothing here depends on the address family, so the host also uses an
+`ArpCache`, with the Neighbor Discovery timers, as its IPv6 neighbor cache.
+
+>>> cache = ArpCache(timeout=60, negative_timeout=5, request_interval=1,
+...         max_requests=2, max_pending=2)
+>>> ip, mac = b'\\x0a\\x00\\x00\\x03', b'\\x00\\x00\\x00\\xbb\\xbb\\xbb'
+>>> cache.lookup('a-s1', ip, 0) is None
+True
+>>> cache.enqueue('a-s1', ip, b'pkt1', 0), cache.enqueue('a-s1', ip, b'pkt2', 0)
+(True, False)
+>>> cache.enqueue('a-s1', ip, b'pkt3', 0), cache.dropped
+(False, 1)
+>>> cache.update('a-s1', ip, mac, 0.5)
+[b'pkt1', b'pkt2']
+>>> cache.lookup('a-s1', ip, 30) == mac, cache.lookup('a-s1', ip, 61)
+(True, None)
+
+A next hop that does not answer is retried, then negatively cached:
+>>> ip = b'\\x0a\\x00\\x00\\x04'
+>>> cache.enqueue('a-s1', ip, b'pkt4', 100)
+True
+>>> cache.expire(101)
+[('a-s1', b'\\n\\x00\\x00\\x04')]
+>>> cache.expire(102), cache.enqueue('a-s1', ip, b'pkt5', 103)
+([], False)
+>>> cache.expire(107), cache.enqueue('a-s1', ip, b'pkt6', 107)
+([], True)
+'''
+
+class _Pending(object):
+    __slots__ = ('packets', 'requests', 'last_request')
+
+    def __init__(self, now):
+        self.packets = []
+        self.requests = 1
+        self.last_request = now
+
+class ArpCache(object):
+    def __init__(self, timeout=60, negative_timeout=5, request_interval=1,
+            max_requests=3, max_pending=16):
+        '''
+        Instantiate an empty ARP cache.
+
+        timeout: int or float (seconds after which a mapping expires)
+        negative_timeout: int or float (seconds for which an unresponsive
+        next hop is remembered)
+        request_interval: int or float (minimum seconds between ARP requests
+        for the same next hop)
+        max_requests: int (number of ARP requests sent before giving up)
+        max_pending: int (maximum number of packets queued per next hop)
+        '''
+
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.request_interval = request_interval
+        self.max_requests = max_requests
+        self.max_pending = max_pending
+
+        # (intf, ip) -> (mac, expiration time)
+        self._entries = {}
+        # (intf, ip) -> _Pending
+        self._pending = {}
+        # (intf, ip) -> expiration time
+        self._negative = {}
+
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, intf, ip, now):
+        '''
+        Return the MAC address for ip on intf, or None if there is no
+        unexpired mapping.
+
+        intf: str
+        ip: bytes (packed IPv4 address)
+        now: int or float
+        '''
+
+        entry = self._entries.get((intf, ip))
+        if entry is None or entry[1] <= now:
+            return None
+        return entry[0]
+
+    def update(self, intf, ip, mac, now):
+        '''
+        Map ip on intf to mac, and return the list of packets that were
+        waiting for it, in the order they were queued, for the caller to send.
+
+        intf: str
+        ip: bytes (packed IPv4 address)
+        mac: bytes (packed MAC address)
+        now: int or float
+        '''
+
+        key = (intf, ip)
+        self._entries[key] = (mac, now + self.timeout)
+        self._negative.pop(key, None)
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return []
+        return pending.packets
+
+    def enqueue(self, intf, ip, pkt, now):
+        '''
+        Queue pkt until ip on intf is resolved.  Return True if the caller
+        should send an ARP request for ip now, or False if one has already
+        been sent recently.  If the queue for ip is full, or if ip is
+        negatively cached, pkt is dropped.
+
+        intf: str
+        ip: bytes (packed IPv4 address)
+        pkt: bytes
+        now: int or float
+        '''
+
+        key = (intf, ip)
+        expiration = self._negative.get(key)
+        if expiration is not None:
+            if expiration > now:
+                self.dropped += 1
+                return False
+            del self._negative[key]
+
+        pending = self._pending.get(key)
+        send_request = False
+        if pending is None:
+            pending = self._pending[key] = _Pending(now)
+            send_request = True
+
+        if len(pending.packets) >= self.max_pending:
+            self.dropped += 1
+        else:
+            pending.packets.append(pkt)
+        return send_request
+
+    def remove_intf(self, intf):
+        '''Remove all state for the given interface (e.g., when it goes
+        down).'''
+        for table in (self._entries, self._pending, self._negative):
+            for key in [key for key in table if key[0] == intf]:
+                del table[key]
+
+    def expire(self, now):
+        '''
+        Remove the mappings and negative entries that have expired, and give
+        up on the next hops that have not answered the maximum number of
+        requests.  Return a list of the (intf, ip) pairs for which another
+        ARP request should be sent now.
+
+        now: int or float
+        '''
+
+        for key in [key for key, (mac, expiration) in self._entries.items() \
+                if expiration <= now]:
+            del self._entries[key]
+        for key in [key for key, expiration in self._negative.items() \
+                if expiration <= now]:
+            del self._negative[key]
+
+        retries = []
+        for key, pending in list(self._pending.items()):
+            if pending.last_request + self.request_interval > now:
+                continue
+            if pending.requests >= self.max_requests:
+                del self._pending[key]
+                self.dropped += len(pending.packets)
+                self._negative[key] = now + self.negative_timeout
+            else:
+                pending.requests += 1
+                pending.last_request = now
+                retries.append(key)
+        return retries
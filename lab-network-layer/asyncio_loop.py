@@ -0,0 +1,135 @@
+'''
+An asyncio counterpart of `NetworkEventLoop`.  The interface sockets are
+registered with the asyncio loop's selector, and the frames that are ready on
+an interface are passed to the frame handler directly from the reader
+callback.  `schedule_event()` is built on the loop's timers; if the scheduled
+function is a coroutine function, the coroutine is run as a task, so
+scheduled items can be written with `await asyncio.sleep()`.
+
+Several `AsyncioEventLoop` instances can share one asyncio loop, so that one
+process (and one thread) drives many nodes.
+
+>>> import asyncio, socket
+>>> class Upper(object):
+...     def __init__(self):
+...         self.received = []
+...     def _handle_frame(self, frame, intf):
+...         self.received.append((frame.upper(), intf))
+>>> loop = asyncio.new_event_loop()
+>>> wire, sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+>>> node = Upper()
+>>> event_loop = AsyncioEventLoop(node, int_to_sock={'a-s1': sock}, loop=loop)
+>>> async def send_frames(wire):
+...     for frame in (b'one', b'two'):
+...         _ = wire.send(frame)
+...         await asyncio.sleep(0.01)
+...     event_loop.stop()
+>>> event_loop.schedule_event(0.01, send_frames, (wire,))
+>>> event_loop.run()
+>>> node.received
+[(b'ONE', 'a-s1'), (b'TWO', 'a-s1')]
+>>> event_loop.close()
+>>> loop.close()
+'''
+
+import asyncio
+import socket
+
+from batch_io import drain, ETH_P_ALL, BATCH_SIZE
+
+class AsyncioEventLoop(object):
+    def __init__(self, handler, int_to_sock=None, loop=None,
+            batch_size=BATCH_SIZE):
+        '''
+        Instantiate an event loop that delivers frames to handler from an
+        asyncio loop.
+
+        handler: frame handler (e.g., Host or Switch instance); if it has a
+        handle_frames() method (see batch_io.BatchedFrameHandler), the frames
+        ready on an interface are passed to it as one batch
+        int_to_sock: dict (mapping each interface name to a socket from
+        which to read frames; by default, a raw packet socket is opened for
+        each interface in handler.int_to_info)
+        loop: asyncio event loop (by default, a new one, which is made the
+        current event loop; pass the same loop to drive several nodes)
+        batch_size: int (maximum frames read per readiness event)
+        '''
+
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+        self.loop = loop
+        self.handler = handler
+        self.batch_size = batch_size
+
+        if int_to_sock is None:
+            int_to_sock = {}
+            for intf in handler.int_to_info:
+                sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                        socket.htons(ETH_P_ALL))
+                sock.bind((intf, 0))
+                int_to_sock[intf] = sock
+        self._socks = list(int_to_sock.values())
+        for intf, sock in int_to_sock.items():
+            sock.setblocking(False)
+            loop.add_reader(sock, self._on_readable, sock, intf)
+
+        self._tasks = set()
+
+    def _on_readable(self, sock, intf):
+        frames = drain(sock, self.batch_size)
+        if not frames:
+            return
+        handle_frames = getattr(self.handler, 'handle_frames', None)
+        if handle_frames is not None:
+            handle_frames(frames, intf)
+        else:
+            handle_frame = self.handler._handle_frame
+            for frame in frames:
+                handle_frame(frame, intf)
+
+    def _call(self, func, args):
+        result = func(*args)
+        if asyncio.iscoroutine(result):
+            task = self.loop.create_task(result)
+            # keep a reference until the task is done
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def schedule_event(self, seconds, func, args=()):
+        '''
+        Call func(*args) in the given number of seconds.  If func is a
+        coroutine function, the coroutine is run as a task.
+
+        seconds: int or float
+        func: callable
+        args: tuple
+        '''
+
+        self.loop.call_later(seconds, self._call, func, args)
+
+    def register(self, fileobj, callback):
+        '''
+        Call callback() whenever fileobj becomes readable.
+
+        fileobj: file object or other object with a fileno() method
+        callback: callable
+        '''
+
+        self.loop.add_reader(fileobj, callback)
+        self._socks.append(fileobj)
+
+    def run(self):
+        '''Run the asyncio loop until stop() is called.'''
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.stop()
+
+    def close(self):
+        '''Unregister the interface sockets (and other registered files) from
+        the asyncio loop.'''
+        for sock in self._socks:
+            self.loop.remove_reader(sock)
+        for task in list(self._tasks):
+            task.cancel()
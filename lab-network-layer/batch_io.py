@@ -0,0 +1,196 @@
+'''
+Batched frame I/O.  `BatchedEventLoop` is a drop-in replacement for
+`NetworkEventLoop` that, each time an interface becomes readable, drains all
+of the frames that are ready on it (up to a limit) with non-blocking reads,
+rather than returning to `select()` after every frame, and hands them to the
+frame handler as one batch.  A frame handler that includes the
+`BatchedFrameHandler` mixin queues the frames it sends while handling a batch
+and flushes them, grouped by interface, once the batch is done.
+
+>>> import socket
+>>> class Echo(BatchedFrameHandler):
+...     def __init__(self, sock):
+...         super(Echo, self).__init__()
+...         self.sock = sock
+...         self.sent = []
+...     def _handle_frame(self, frame, intf):
+...         self.send_frame(frame.upper(), intf)
+...     def _send_frame(self, frame, intf):
+...         self.sent.append(frame)
+>>> wire, sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+>>> echo = Echo(sock)
+>>> event_loop = BatchedEventLoop(echo, batch_size=2, int_to_sock={'a-s1': sock})
+>>> for frame in (b'one', b'two', b'three'):
+...     _ = wire.send(frame)
+>>> event_loop.schedule_event(0.1, event_loop.stop)
+>>> event_loop.run()
+>>> echo.sent, echo.batches
+([b'ONE', b'TWO', b'THREE'], 2)
+'''
+
+import heapq
+import itertools
+import selectors
+import socket
+import time
+
+#From /usr/include/linux/if_ether.h:
+ETH_P_ALL = 0x0003 # Every packet
+ETH_FRAME_LEN = 1514 # Max. octets in frame sans FCS
+
+BATCH_SIZE = 64
+
+def drain(sock, limit, bufsize=ETH_FRAME_LEN + 4):
+    '''
+    Read and return up to limit frames from the non-blocking socket sock,
+    stopping early when no more are ready.  Frames that the host itself sent
+    (which packet sockets also see) are skipped.
+
+    sock: socket.socket
+    limit: int
+    bufsize: int
+    '''
+
+    frames = []
+    while len(frames) < limit:
+        try:
+            frame, addr = sock.recvfrom(bufsize)
+        except BlockingIOError:
+            break
+        if isinstance(addr, tuple) and len(addr) > 2 and \
+                addr[2] == socket.PACKET_OUTGOING:
+            continue
+        frames.append(frame)
+    return frames
+
+class BatchedFrameHandler(object):
+    '''
+    A mixin, to be listed before `BaseFrameHandler`, that adds
+    `handle_frames()`.  Frames sent with `send_frame()` while a batch is being
+    handled are queued per interface and sent when the batch is done.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(BatchedFrameHandler, self).__init__(*args, **kwargs)
+        self._outbound = None
+        self.batches = 0
+
+    def handle_frames(self, frames, intf):
+        '''
+        Handle each of the frames received on intf, then flush the frames
+        that were sent in response.
+
+        frames: list of bytes
+        intf: str
+        '''
+
+        self._outbound = {}
+        try:
+            for frame in frames:
+                self._handle_frame(frame, intf)
+        finally:
+            self.batches += 1
+            self.flush_frames()
+
+    def send_frame(self, frame, intf):
+        if self._outbound is None:
+            self._send_frame(frame, intf)
+        else:
+            self._outbound.setdefault(intf, []).append(frame)
+
+    def _send_frame(self, frame, intf):
+        super(BatchedFrameHandler, self).send_frame(frame, intf)
+
+    def flush_frames(self):
+        '''Send all queued frames, one interface at a time, and stop
+        queueing.'''
+        outbound = self._outbound
+        self._outbound = None
+        if not outbound:
+            return
+        send_frame = self._send_frame
+        for intf, frames in outbound.items():
+            for frame in frames:
+                send_frame(frame, intf)
+
+class BatchedEventLoop(object):
+    def __init__(self, handler, batch_size=BATCH_SIZE, int_to_sock=None):
+        '''
+        Instantiate an event loop that delivers frames to handler in
+        batches of up to batch_size frames per interface.
+
+        handler: BatchedFrameHandler instance
+        batch_size: int
+        int_to_sock: dict (mapping each interface name to a socket from
+        which to read frames; by default, a raw packet socket is opened for
+        each interface in handler.int_to_info)
+        '''
+
+        self.handler = handler
+        self.batch_size = batch_size
+
+        if int_to_sock is None:
+            int_to_sock = {}
+            for intf in handler.int_to_info:
+                sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                        socket.htons(ETH_P_ALL))
+                sock.bind((intf, 0))
+                int_to_sock[intf] = sock
+
+        self._selector = selectors.DefaultSelector()
+        for intf, sock in int_to_sock.items():
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, intf)
+
+        self._events = []
+        self._counter = itertools.count()
+        self._stopped = False
+
+    def schedule_event(self, seconds, func, args=()):
+        '''
+        Call func(*args) in the given number of seconds.
+
+        seconds: int or float
+        func: callable
+        args: tuple
+        '''
+
+        heapq.heappush(self._events,
+                (time.time() + seconds, next(self._counter), func, args))
+
+    def register(self, fileobj, callback):
+        '''
+        Call callback() whenever fileobj becomes readable.
+
+        fileobj: file object or other object with a fileno() method
+        callback: callable
+        '''
+
+        self._selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def stop(self):
+        self._stopped = True
+
+    def _run_due_events(self):
+        events = self._events
+        now = time.time()
+        while events and events[0][0] <= now:
+            when, i, func, args = heapq.heappop(events)
+            func(*args)
+
+    def run(self):
+        '''Deliver frames and run scheduled events until stop() is called.'''
+        handler = self.handler
+        while not self._stopped:
+            if self._events:
+                timeout = max(self._events[0][0] - time.time(), 0)
+            else:
+                timeout = None
+            for key, mask in self._selector.select(timeout):
+                if callable(key.data):
+                    key.data()
+                    continue
+                frames = drain(key.fileobj, self.batch_size)
+                if frames:
+                    handler.handle_frames(frames, key.data)
+            self._run_due_events()
@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+'''
+Benchmarks of `ForwardingTable.get_entry()` and `Host.forward_packet()` on
+synthetic workloads (see `workload.py`), reporting lookups or packets per
+second, sampled per-packet latency and memory.  Results can be saved as JSON
+and compared against an earlier run:
+
+    $ python3 benchmark.py --routes 0,1000,100000 --output before.json
+    $ python3 benchmark.py --routes 0,1000,100000 --compare before.json
+
+With `--ipv6`, the routes and packets are IPv6.  With `--workers 1,2,4`, the
+router is also benchmarked forwarding with each number of worker processes
+(see `forwarding_pool.py`), to show how forwarding scales with them.
+
+The router is driven directly, in one process, as a node of the simulator
+(see `simulator.py`), with its frames discarded rather than delivered.
+
+>>> import random
+>>> rng = random.Random(1)
+>>> result = bench_table(random_routes(100, rng), 1000, 10, 1.1, 64, rng)
+>>> result['name'], result['count']
+('table routes=100 flows=10 zipf=1.1', 1000)
+'''
+
+import argparse
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from batch_io import BATCH_SIZE
+from forwarding_table import ForwardingTable
+from headers import build_ethernet, ETH_P_IP
+from workload import random_routes, random_flows, zipf_choices, \
+        build_packets, measure, max_rss, save_results, compare_results
+
+def _table_memory(routes, **kwargs):
+    '''Return a table loaded with routes, and the bytes allocated to build
+    it.'''
+    gc.collect()
+    tracemalloc.start()
+    table = ForwardingTable(**kwargs)
+    table.load_entries(routes)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return table, size
+
+def _is_ipv6(routes):
+    return ':' in routes[0][0]
+
+def _options(routes, compiled, cache_size):
+    options = ''
+    if _is_ipv6(routes):
+        options += ' ipv6'
+    if compiled:
+        options += ' compiled'
+    if cache_size:
+        options += ' cache=%d' % cache_size
+    return options
+
+def bench_table(routes, count, flows, zipf, size, rng, compiled=False,
+        cache_size=0):
+    '''
+    Benchmark ForwardingTable.get_entry() for count packets.
+
+    routes: list of (prefix, intf, next_hop) tuples
+    count: int (number of lookups)
+    flows: int (number of distinct destinations)
+    zipf: int or float (Zipf exponent for choosing among flows)
+    size: int (packet size)
+    rng: random.Random instance
+    compiled, cache_size: as for ForwardingTable()
+    '''
+
+    table, memory = _table_memory(routes, compiled=compiled,
+            cache_size=cache_size)
+    pkts = build_packets(random_flows(flows, routes, rng),
+            zipf_choices(flows, count, zipf, rng), size)
+    if _is_ipv6(routes):
+        dsts = [pkt[24:40] for pkt in pkts]
+    else:
+        dsts = [pkt[16:20] for pkt in pkts]
+
+    result = measure(table.get_entry, dsts)
+    result['name'] = 'table routes=%d flows=%d zipf=%g%s' % \
+            (len(routes), flows, zipf, _options(routes, compiled, cache_size))
+    result['table_bytes'] = memory
+    result['max_rss'] = max_rss()
+    return result
+
+def _router(routes, compiled=False, cache_size=0, workers=0):
+    '''Return a router, run as a node of the simulator, with routes loaded
+    and the next hops in its ARP (or neighbor) cache, and the list to which the
+    lengths of the frames it sends are appended.'''
+
+    from simulator import Simulator, install_cougarnet_modules
+    install_cougarnet_modules()
+    from host import Host
+
+    ipv6 = _is_ipv6(routes)
+    intfs = sorted({intf for prefix, intf, next_hop in routes})
+    if ipv6:
+        addrs = ['2001:db8:ff:%d::2/64' % i for i in range(len(intfs))]
+    else:
+        addrs = ['10.255.%d.2/24' % i for i in range(len(intfs))]
+    config = ['NODES', 'r1 type=router'] + \
+            ['%s' % intf.split('-')[1] for intf in intfs] + \
+            ['LINKS'] + \
+            ['r1,%s %s' % (addr, intf.split('-')[1]) \
+                    for addr, intf in zip(addrs, intfs)]
+    sim = Simulator(config)
+    frames_out = []
+    sim.transmit = lambda node, intf, frame: frames_out.append(len(frame))
+
+    host = sim.instantiate('r1', Host, True, workers)
+    if workers:
+        # the workers follow the changes to the table they were started with
+        host.forwarding_table.load_entries(routes)
+    else:
+        host.forwarding_table = ForwardingTable(compiled=compiled,
+                cache_size=cache_size)
+        host.forwarding_table.load_entries(routes)
+    for i, intf in enumerate(intfs):
+        mac = b'\x02\x00\x00\x00\x00%c' % i
+        if ipv6:
+            host.nd_cache.update(intf, b'\x20\x01\x0d\xb8\x00\xff\x00%c' % i +
+                    bytes(7) + b'\x01', mac, float('inf'))
+        else:
+            host.arp_cache.update(intf, bytes((10, 255, i, 1)), mac,
+                    float('inf'))
+    return host, frames_out
+
+def bench_router(routes, count, flows, zipf, size, rng, compiled=False,
+        cache_size=0):
+    '''
+    Benchmark Host.forward_packet() for count packets, with the ARP cache
+    already holding the next hops.  Arguments are as for bench_table().
+    '''
+
+    host, frames_out = _router(routes, compiled, cache_size)
+    pkts = build_packets(random_flows(flows, routes, rng),
+            zipf_choices(flows, count, zipf, rng), size)
+
+    result = measure(lambda pkt: host.forward_packet(pkt, 'r1-a'), pkts)
+    result['name'] = 'router routes=%d flows=%d zipf=%g size=%d%s' % \
+            (len(routes), flows, zipf, size,
+            _options(routes, compiled, cache_size))
+    result['frames_out'] = len(frames_out)
+    result['max_rss'] = max_rss()
+    return result
+
+def bench_workers(routes, count, flows, zipf, size, rng, workers,
+        batch_size=BATCH_SIZE):
+    '''
+    Benchmark forwarding count IPv4 packets with workers worker processes
+    (see forwarding_pool.py), from frames received in batches of batch_size
+    (see Host.handle_frames()), until the last of them has been sent.  Arguments
+    are otherwise as for bench_table().  The latency reported is the time the
+    router itself spends on a batch, handing it to the workers and sending
+    the results that are ready.
+    '''
+
+    host, frames_out = _router(routes, workers=workers)
+    intf = host.get_first_interface()
+    header = build_ethernet(host._int_to_mac[intf], b'\x02' + bytes(5),
+            ETH_P_IP)
+    frames = [header + pkt for pkt in build_packets(
+            random_flows(flows, routes, rng),
+            zipf_choices(flows, count, zipf, rng), size)]
+    batches = [frames[i:i + batch_size] \
+            for i in range(0, len(frames), batch_size)]
+
+    # warm up, so that the workers have the table loaded
+    host.handle_frames(batches[0], intf)
+    while len(frames_out) < len(batches[0]):
+        host.handle_forwarding_results(timeout=1)
+    del frames_out[:]
+
+    def forward_batch(batch):
+        host.handle_frames(batch, intf)
+        host.handle_forwarding_results()
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    result = measure(forward_batch, batches)
+    while len(frames_out) < count:
+        host.handle_forwarding_results(timeout=1)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    host.forwarding_pool.close()
+
+    result['name'] = 'router workers=%d routes=%d flows=%d zipf=%g size=%d ' \
+            'batch=%d' % (workers, len(routes), flows, zipf, size, batch_size)
+    result['count'] = count
+    result['seconds'] = elapsed
+    result['per_second'] = count / elapsed
+    # the CPU time of the router process itself, which bounds the rate that
+    # any number of workers (on enough cores) can reach
+    result['router_cpu_seconds'] = cpu
+    result['router_bound_per_second'] = count / cpu
+    result['frames_out'] = len(frames_out)
+    result['max_rss'] = max_rss()
+    return result
+
+def _print_result(result):
+    print('%-50s %12.0f/s  p50 %6d ns  p99 %6d ns' % \
+            (result['name'], result['per_second'],
+            result['latency_ns']['p50'], result['latency_ns']['p99']))
+    if 'router_bound_per_second' in result:
+        print('%-50s %12.0f/s  (router process CPU bound)' % \
+                ('', result['router_bound_per_second']))
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Benchmark forwarding table lookups and forwarding')
+    parser.add_argument('--target', choices=('table', 'router', 'all'),
+            default='all',
+            help='What to benchmark (default: all)')
+    parser.add_argument('--routes', default='0,1000,100000',
+            help='Comma-separated route table sizes (default: 0,1000,100000)')
+    parser.add_argument('--packets', type=int, default=100000,
+            help='Packets per benchmark (default: 100000)')
+    parser.add_argument('--flows', type=int, default=1000,
+            help='Number of flows (default: 1000)')
+    parser.add_argument('--zipf', type=float, default=1.1,
+            help='Zipf exponent for choosing flows; 0 for uniform '
+            '(default: 1.1)')
+    parser.add_argument('--size', type=int, default=64,
+            help='IP packet size (default: 64)')
+    parser.add_argument('--compiled', action='store_true',
+            help='Use ForwardingTable(compiled=True)')
+    parser.add_argument('--cache', type=int, default=0, metavar='N',
+            help='Use ForwardingTable(cache_size=N)')
+    parser.add_argument('--ipv6', action='store_true',
+            help='Use IPv6 routes and packets')
+    parser.add_argument('--workers', metavar='N[,N...]',
+            help='Also benchmark the router with each of these numbers of '
+            'forwarding worker processes (IPv4 only)')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE,
+            help='Frames per batch with --workers (default: %d)' % BATCH_SIZE)
+    parser.add_argument('--seed', type=int, default=1,
+            help='Random seed (default: 1)')
+    parser.add_argument('--output', '-o', metavar='FILE',
+            help='Save results to FILE as JSON')
+    parser.add_argument('--compare', '-c', metavar='FILE',
+            help='Compare results with those saved in FILE')
+    args = parser.parse_args(sys.argv[1:])
+
+    benches = []
+    if args.target in ('table', 'all'):
+        benches.append(bench_table)
+    if args.target in ('router', 'all'):
+        benches.append(bench_router)
+
+    results = []
+    for route_count in [int(n) for n in args.routes.split(',')]:
+        # the default route is always included
+        routes = random_routes(max(route_count, 1), random.Random(args.seed),
+                ipv6=args.ipv6)
+        for bench in benches:
+            result = bench(routes, args.packets, args.flows, args.zipf,
+                    args.size, random.Random(args.seed), args.compiled,
+                    args.cache)
+            results.append(result)
+            _print_result(result)
+        if args.target in ('router', 'all') and args.workers:
+            for workers in [int(n) for n in args.workers.split(',')]:
+                result = bench_workers(routes, args.packets, args.flows,
+                        args.zipf, args.size, random.Random(args.seed),
+                        workers, args.batch)
+                results.append(result)
+                _print_result(result)
+
+    if args.output:
+        save_results(args.output, results)
+    if args.compare:
+        compare_results(args.compare, results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+'''
+A DIR-24-8 lookup table for IPv4 longest prefix match.  The table is
+flattened from the routes held in a `PrefixTrie`: a first-level array has one
+slot for each /24, holding the entry for that /24 directly, unless prefixes
+longer than /24 fall within it, in which case the slot refers to a 256-entry
+second-level chunk, indexed by the last byte of the address.  A lookup is
+therefore one array read, or two for addresses within those /24s.
+
+Each first-level slot is 16 bits: if the most significant bit is set, the
+remaining bits are a chunk number; otherwise, they are an index into the list
+of distinct entries, where 0 means no route.  A parallel array records the
+length (plus one) of the prefix that each slot was filled from, so that the
+table can be patched in place when routes are added or removed.  Each index
+counts the routes having its entry, and is reused once there are none, so
+that routes can be replaced and removed indefinitely.
+
+The first level is split into pages of 4096 slots, which, like the chunks,
+are shared with copies of the table (see copy()) until either one changes
+them; only then is the page or chunk copied.  Pages that were never written
+are all the same page of zeros.
+
+>>> from prefix_trie import PrefixTrie
+>>> trie = PrefixTrie(32)
+>>> table = Dir24_8(trie)
+>>> for key, prefix_len, entry in ((0x0a140000, 23, 'c'), (0x0a140000, 30, 'j'),
+...         (0x00000000, 0, 'k')):
+...     trie.insert(key, prefix_len, entry)
+...     table.add(key, prefix_len, entry)
+>>> table.lookup(0x0a140002), table.lookup(0x0a140004), table.lookup(0x0a140301)
+('j', 'c', 'k')
+>>> trie.remove(0x0a140000, 23)
+True
+>>> table.remove(0x0a140000, 23, 'c')
+>>> table.lookup(0x0a140002), table.lookup(0x0a140004)
+('j', 'k')
+>>> table.chunk_count()
+1
+>>> trie.remove(0x0a140000, 30)
+True
+>>> table.remove(0x0a140000, 30, 'j')
+>>> table.lookup(0x0a140002), table.chunk_count()
+('k', 0)
+>>> table.entry_count()
+1
+
+A copy shares the pages and chunks that neither table has changed since:
+
+>>> trie2 = trie.copy()
+>>> table2 = table.copy(trie2)
+>>> trie2.insert(0x0a140100, 25, 'm')
+>>> table2.add(0x0a140100, 25, 'm')
+>>> table.lookup(0x0a140101), table2.lookup(0x0a140101), table2.lookup(0x0b000000)
+('k', 'm', 'k')
+>>> table2.memory_usage() - table.memory_usage() < 1 << 16
+True
+'''
+
+import bisect
+from array import array
+
+CHUNK_FLAG = 0x8000
+MAX_INDEX = 0x7fff
+
+# first-level slots per page
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+# shift giving the page of an address
+PAGE_SHIFT = 8 + PAGE_BITS
+
+_ZERO_PAGE = array('H', bytes(2 * PAGE_SIZE))
+_ZERO_DEPTHS = array('B', bytes(PAGE_SIZE))
+
+class Dir24_8(object):
+    def __init__(self, trie):
+        '''
+        Instantiate a table for the routes in trie, which must be kept in sync
+        with the table by calling add() after each insertion into the trie
+        and remove() after each removal from it.  Note that the first level
+        takes up to 48 MB, once every page of it has been written.
+
+        trie: PrefixTrie instance, with address length 32
+        '''
+
+        assert trie.address_len == 32
+        self._trie = trie
+
+        # the pages of the first level, and the chunks, as lists of arrays,
+        # with the numbers of those that this table may change in place
+        # (i.e., that are not shared with a copy)
+        self._tbl24 = [_ZERO_PAGE] * (1 << (24 - PAGE_BITS))
+        self._depth24 = [_ZERO_DEPTHS] * (1 << (24 - PAGE_BITS))
+        self._tbl8 = []
+        self._depth8 = []
+        self._owned24 = set()
+        self._owned8 = set()
+
+        # sorted first-level slots that refer to a chunk, and chunk numbers
+        # that can be reused
+        self._chunked_slots = []
+        self._free_chunks = []
+
+        # the distinct entries, by index, the number of routes having each
+        # one, and indices that can be reused
+        self._entries = [None]
+        self._entry_index = {}
+        self._refs = [0]
+        self._free_indices = []
+
+        for key, prefix_len, entry in trie.items():
+            self.add(key, prefix_len, entry)
+
+    def copy(self, trie):
+        '''
+        Return a copy of the table, kept in sync with trie, which must hold
+        the same routes as the trie of this table (e.g., a copy of it).  The
+        pages and chunks are shared, and copied by whichever table next
+        changes them, so the copy itself only takes memory for the lists
+        referring to them.
+
+        trie: PrefixTrie instance, with address length 32
+        '''
+
+        table = self.__class__.__new__(self.__class__)
+        table._trie = trie
+        table._tbl24 = list(self._tbl24)
+        table._depth24 = list(self._depth24)
+        table._tbl8 = list(self._tbl8)
+        table._depth8 = list(self._depth8)
+        # everything is now shared, by both tables
+        table._owned24 = set()
+        table._owned8 = set()
+        self._owned24 = set()
+        self._owned8 = set()
+        table._chunked_slots = list(self._chunked_slots)
+        table._free_chunks = list(self._free_chunks)
+        table._entries = list(self._entries)
+        table._entry_index = dict(self._entry_index)
+        table._refs = list(self._refs)
+        table._free_indices = list(self._free_indices)
+        return table
+
+    def _ref(self, entry):
+        '''Return the index of entry, allocating one if it has none, and
+        count one more route having it.'''
+
+        index = self._entry_index.get(entry)
+        if index is None:
+            if self._free_indices:
+                index = self._free_indices.pop()
+                self._entries[index] = entry
+            else:
+                index = len(self._entries)
+                if index > MAX_INDEX:
+                    raise ValueError(
+                            'Too many distinct entries for DIR-24-8 table')
+                self._entries.append(entry)
+                self._refs.append(0)
+            self._entry_index[entry] = index
+        self._refs[index] += 1
+        return index
+
+    def _unref(self, entry):
+        '''Count one less route having entry, freeing its index if none is
+        left.  No slot may refer to the index by then.'''
+
+        index = self._entry_index[entry]
+        self._refs[index] -= 1
+        if not self._refs[index]:
+            del self._entry_index[entry]
+            self._entries[index] = None
+            self._free_indices.append(index)
+
+    def _parent(self, key, prefix_len):
+        '''Return (index, depth) for the longest route strictly containing
+        the given prefix.'''
+
+        if prefix_len == 0:
+            return 0, 0
+        match = self._trie.longest_match(key, prefix_len - 1)
+        if match is None:
+            return 0, 0
+        return self._entry_index[match[1]], match[0] + 1
+
+    def _page24(self, page):
+        '''Return the arrays of the given first-level page, copying them
+        first if they are shared.'''
+
+        if page not in self._owned24:
+            self._tbl24[page] = self._tbl24[page][:]
+            self._depth24[page] = self._depth24[page][:]
+            self._owned24.add(page)
+        return self._tbl24[page], self._depth24[page]
+
+    def _chunk(self, chunk):
+        '''Return the arrays of the given chunk, copying them first if they
+        are shared.'''
+
+        if chunk not in self._owned8:
+            self._tbl8[chunk] = self._tbl8[chunk][:]
+            self._depth8[chunk] = self._depth8[chunk][:]
+            self._owned8.add(chunk)
+        return self._tbl8[chunk], self._depth8[chunk]
+
+    def _slot(self, slot):
+        '''Return the (value, depth) of the given first-level slot.'''
+        page, i = slot >> PAGE_BITS, slot & PAGE_MASK
+        return self._tbl24[page][i], self._depth24[page][i]
+
+    def _set_slot(self, slot, value, depth):
+        tbl24, depth24 = self._page24(slot >> PAGE_BITS)
+        tbl24[slot & PAGE_MASK] = value
+        depth24[slot & PAGE_MASK] = depth
+
+    def _fill_slots(self, lo, hi, index, depth):
+        '''Set first-level slots [lo, hi) to index and depth.'''
+
+        while lo < hi:
+            page = lo >> PAGE_BITS
+            end = min(hi, (page + 1) << PAGE_BITS)
+            if end - lo == PAGE_SIZE:
+                # the whole page, which need not be copied first
+                self._tbl24[page] = array('H', [index]) * PAGE_SIZE
+                self._depth24[page] = array('B', [depth]) * PAGE_SIZE
+                self._owned24.add(page)
+            else:
+                tbl24, depth24 = self._page24(page)
+                i = lo & PAGE_MASK
+                tbl24[i:i + end - lo] = array('H', [index]) * (end - lo)
+                depth24[i:i + end - lo] = array('B', [depth]) * (end - lo)
+            lo = end
+
+    def _paint_chunk(self, chunk, lo, hi, index, depth, min_depth, max_depth):
+        '''Set entries [lo, hi) of chunk whose depth is between min_depth and
+        max_depth to index and depth.'''
+
+        tbl8, depth8 = self._chunk(chunk)
+        for i in range(lo, hi):
+            if min_depth <= depth8[i] <= max_depth:
+                tbl8[i] = index
+                depth8[i] = depth
+
+    def _paint24(self, key, prefix_len, index, depth, min_depth):
+        '''Fill the part of the first level belonging to a prefix of length
+        at most 24, skipping more specific prefixes of length at most 24.
+        Chunk entries are only replaced if their depth is between min_depth
+        and that of the prefix.'''
+
+        lo = key >> 8
+        hi = lo + (1 << (24 - prefix_len))
+
+        # Slot ranges belonging to more specific prefixes, in order; only
+        # those not contained in another one are needed.
+        holes = []
+        covered_until = 0
+        for k, l, _ in self._trie.items(key, prefix_len):
+            if l <= prefix_len or l > 24 or k < covered_until:
+                continue
+            covered_until = k + (1 << (32 - l))
+            holes.append((k >> 8, covered_until >> 8))
+        holes.append((hi, hi))
+
+        start = lo
+        for hole_start, hole_end in holes:
+            self._paint_slots(start, hole_start, index, depth,
+                    min_depth, prefix_len + 1)
+            start = hole_end
+
+    def _paint_slots(self, lo, hi, index, depth, min_depth, max_depth):
+        if lo >= hi:
+            return
+        chunked = self._chunked_slots
+        i = bisect.bisect_left(chunked, lo)
+        while lo < hi:
+            if i < len(chunked) and chunked[i] < hi:
+                end = chunked[i]
+            else:
+                end = hi
+            if end > lo:
+                self._fill_slots(lo, end, index, depth)
+            if end < hi:
+                chunk = self._slot(end)[0] & MAX_INDEX
+                self._paint_chunk(chunk, 0, 256, index, depth,
+                        min_depth, max_depth)
+                i += 1
+            lo = end + 1
+
+    def _add_chunk(self, slot):
+        if self._free_chunks:
+            chunk = self._free_chunks.pop()
+        else:
+            chunk = len(self._tbl8)
+            if chunk > MAX_INDEX:
+                raise ValueError('Too many chunks for DIR-24-8 table')
+            self._tbl8.append(None)
+            self._depth8.append(None)
+        index, depth = self._slot(slot)
+        self._tbl8[chunk] = array('H', [index]) * 256
+        self._depth8[chunk] = array('B', [depth]) * 256
+        self._owned8.add(chunk)
+        self._set_slot(slot, CHUNK_FLAG | chunk, depth)
+        bisect.insort(self._chunked_slots, slot)
+        return chunk
+
+    def _remove_chunk(self, slot):
+        chunk = self._slot(slot)[0] & MAX_INDEX
+        # with no prefixes longer than /24 left, every entry is the same
+        self._set_slot(slot, self._tbl8[chunk][0], self._depth8[chunk][0])
+        del self._chunked_slots[bisect.bisect_left(self._chunked_slots, slot)]
+        self._tbl8[chunk] = self._depth8[chunk] = None
+        self._owned8.discard(chunk)
+        self._free_chunks.append(chunk)
+
+    def add(self, key, prefix_len, entry, replaced=None):
+        '''
+        Add (or replace) the route for the given prefix.  If the route
+        already exists, replaced must be the entry that it had.
+
+        key: int
+        prefix_len: int
+        replaced: the old entry, or None for a new route
+        '''
+
+        key &= ((1 << prefix_len) - 1) << (32 - prefix_len)
+        index = self._ref(entry)
+        depth = prefix_len + 1
+        if prefix_len <= 24:
+            self._paint24(key, prefix_len, index, depth, 0)
+        else:
+            slot = key >> 8
+            value = self._slot(slot)[0]
+            if value & CHUNK_FLAG:
+                chunk = value & MAX_INDEX
+            else:
+                chunk = self._add_chunk(slot)
+            lo = key & 0xff
+            self._paint_chunk(chunk, lo, lo + (1 << (32 - prefix_len)),
+                    index, depth, 0, depth)
+        if replaced is not None:
+            self._unref(replaced)
+
+    def remove(self, key, prefix_len, entry):
+        '''
+        Remove the route for the given prefix, which must already have been
+        removed from the trie.
+
+        key: int
+        prefix_len: int
+        entry: the entry that the route had
+        '''
+
+        key &= ((1 << prefix_len) - 1) << (32 - prefix_len)
+        index, depth = self._parent(key, prefix_len)
+        if prefix_len <= 24:
+            self._paint24(key, prefix_len, index, depth, prefix_len + 1)
+        else:
+            slot = key >> 8
+            value = self._slot(slot)[0]
+            if not value & CHUNK_FLAG:
+                self._unref(entry)
+                return
+            chunk = value & MAX_INDEX
+            lo = key & 0xff
+            self._paint_chunk(chunk, lo, lo + (1 << (32 - prefix_len)),
+                    index, depth, prefix_len + 1, prefix_len + 1)
+            for k, l, _ in self._trie.items(slot << 8, 24):
+                if l > 24:
+                    break
+            else:
+                self._remove_chunk(slot)
+        self._unref(entry)
+
+    def lookup(self, address):
+        '''
+        Return the entry for the longest prefix matching address, or None if
+        no prefix matches.
+
+        address: int
+        '''
+
+        index = self._tbl24[address >> PAGE_SHIFT][(address >> 8) & PAGE_MASK]
+        if index & CHUNK_FLAG:
+            index = self._tbl8[index & MAX_INDEX][address & 0xff]
+        return self._entries[index]
+
+    def entry_count(self):
+        '''Return the number of distinct entries in use.'''
+        return len(self._entry_index)
+
+    def chunk_count(self):
+        '''Return the number of second-level chunks in use.'''
+        return len(self._chunked_slots)
+
+    def memory_usage(self):
+        '''Return the number of bytes allocated for the lookup arrays,
+        including those shared with copies, but counting the pages that
+        were never written only once.'''
+        arrays = {}
+        for a in self._tbl24 + self._depth24 + self._tbl8 + self._depth8:
+            if a is not None:
+                arrays[id(a)] = a
+        return sum(a.itemsize * len(a) for a in arrays.values())
@@ -0,0 +1,309 @@
+'''
+Forwarding across several worker processes, so that a router is not limited
+to one core.  Each frame is assigned to a worker by a hash of the flow of the
+IPv4 packet it carries (source and destination, and, for TCP and UDP, ports),
+so packets of the same flow are handled by the same worker, in order.  The
+workers share the forwarding table read-only, as a snapshot (see
+`snapshot.py`) that each maps from the same file.  The pool follows the
+changes made to the table: after a change, a new snapshot is written before
+the next frames are sent to the workers, which switch to it.
+
+The parent only reads the frame's addresses, to pick the worker and to check
+that the packet is not for itself.  Each worker parses the packet, looks up
+the next hop, and builds the frame to send, with the TTL decremented (and the
+checksum updated) and the source MAC address of the outgoing interface; the
+parent fills in the destination MAC address, from its ARP cache, and sends it.
+Frames are sent to the workers, and results returned, in batches.
+
+The parent and a worker each block while sending to the other, so the batches
+sent to a worker whose results have not been read are bounded (see
+MAX_OUTSTANDING and MAX_OUTSTANDING_BYTES): at the bound, flush() first reads
+the results of that worker, holding them for the next receive().
+
+>>> from forwarding_table import ForwardingTable
+>>> from headers import build_ethernet, build_ipv4, ETH_P_IP
+>>> table = ForwardingTable()
+>>> table.add_entry('10.20.0.0/24', 'r1-c', '10.30.0.2')
+>>> table.add_entry('10.40.0.0/24', 'r1-d', None)
+>>> int_to_mac = {'r1-a': b'\\x02\\x00\\x00\\x00\\x00\\x0a',
+...         'r1-c': b'\\x02\\x00\\x00\\x00\\x00\\x0c',
+...         'r1-d': b'\\x02\\x00\\x00\\x00\\x00\\x0d'}
+>>> header = build_ethernet(int_to_mac['r1-a'], bytes(6), ETH_P_IP)
+>>> pool = ForwardingPool(table, int_to_mac, workers=2)
+>>> src = b'\\x0a\\x00\\x00\\x02'
+>>> for dst, ttl in ((b'\\x0a\\x14\\x00\\x19', 64), (b'\\x0a\\x28\\x00\\x02', 64),
+...         (b'\\x0a\\x32\\x00\\x02', 64), (b'\\x0a\\x14\\x00\\x19', 1)):
+...     pool.submit(header + build_ipv4(src, dst, 17, bytes(8), ttl=ttl), 'r1-a')
+>>> pool.flush()
+>>> results = []
+>>> while len(results) < 4:
+...     results.extend(pool.receive())
+>>> sorted((status, intf, next_hop, frame[6:12] == int_to_mac[intf], frame[22]) \\
+...         for status, frame, intf, next_hop in results)
+[(0, 'r1-c', b'\\n\\x1e\\x00\\x02', True, 63), (0, 'r1-d', b'\\n(\\x00\\x02', True, 63), (1, 'r1-a', None, False, 1), (2, 'r1-a', None, False, 64)]
+
+Changes to the table reach the workers with the next frames sent to them:
+
+>>> table.add_entry('10.50.0.0/16', 'r1-c', '10.30.0.10')
+>>> pool.submit(header + build_ipv4(src, b'\\x0a\\x32\\x00\\x02', 17, bytes(8)), 'r1-a')
+>>> pool.flush()
+>>> results = []
+>>> while not results:
+...     results.extend(pool.receive())
+>>> results[0][0], results[0][2:]
+(0, ('r1-c', b'\\n\\x1e\\x00\\n'))
+>>> pool.close()
+'''
+
+import collections
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import socket
+import tempfile
+import zlib
+
+from headers import decrement_ttl
+from snapshot import ForwardingTableSnapshot, save_snapshot
+
+# result status
+FORWARD = 0
+TTL_EXCEEDED = 1
+NO_ROUTE = 2
+
+# length of the Ethernet header of the frames handled by the workers
+ETH_HLEN = 14
+
+# Bounds on the batches sent to a worker whose results have not been read,
+# and on their size.  The results of the batches already sent fit in the
+# socket buffer, so a worker never blocks sending them while the parent
+# blocks sending it the next batch.
+MAX_OUTSTANDING = 8
+MAX_OUTSTANDING_BYTES = 1 << 16
+
+def flow_hash(pkt, offset=0):
+    '''
+    Return a hash of the flow to which the IPv4 packet at the given offset
+    of pkt belongs.  Ports are only included for TCP and UDP packets that are
+    not fragments, because fragments after the first do not carry them.
+
+    pkt: bytes (or other buffer) containing the IPv4 packet
+    offset: int
+    '''
+
+    protocol = pkt[offset + 9]
+    if (protocol == 6 or protocol == 17) and \
+            not (pkt[offset + 6] & 0x3f or pkt[offset + 7]):
+        ihl = (pkt[offset] & 0x0f) << 2
+        if ihl == 20:
+            # the addresses and ports are contiguous
+            return zlib.crc32(pkt[offset + 12:offset + 24])
+        return zlib.crc32(pkt[offset + ihl:offset + ihl + 4],
+                zlib.crc32(pkt[offset + 12:offset + 20]))
+    return zlib.crc32(pkt[offset + 12:offset + 20])
+
+def forward(table, int_to_mac, frame, intf):
+    '''
+    Return a (status, frame, intf, next_hop) tuple for the Ethernet frame,
+    carrying an IPv4 packet, received on intf.  If the status is FORWARD,
+    then frame is a copy (a bytearray) with the TTL decremented and the
+    source MAC address of the outgoing interface, and intf and next_hop
+    (packed) are those with which to send it, once the destination MAC
+    address is filled in; otherwise, frame and intf are those given, and
+    next_hop is None.
+
+    table: ForwardingTable or ForwardingTableSnapshot instance
+    int_to_mac: dict mapping interface names to packed MAC addresses
+    frame: bytes
+    intf: str
+    '''
+
+    if frame[ETH_HLEN + 8] <= 1:
+        return TTL_EXCEEDED, frame, intf, None
+    dst = frame[ETH_HLEN + 16:ETH_HLEN + 20]
+    out_intf, next_hop = table.get_entry(dst)
+    if out_intf is None:
+        return NO_ROUTE, frame, intf, None
+    if next_hop is None:
+        next_hop = dst
+    else:
+        next_hop = socket.inet_aton(next_hop)
+    frame = bytearray(frame)
+    frame[6:12] = int_to_mac[out_intf]
+    decrement_ttl(memoryview(frame)[ETH_HLEN:])
+    return FORWARD, frame, out_intf, next_hop
+
+def _worker(path, int_to_mac, conn):
+    table = ForwardingTableSnapshot(path)
+    try:
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            if isinstance(msg, str):
+                # the snapshot was replaced
+                table.close()
+                table = ForwardingTableSnapshot(msg)
+                continue
+            conn.send([forward(table, int_to_mac, frame, intf) \
+                    for frame, intf in msg])
+    finally:
+        table.close()
+        conn.close()
+
+class ForwardingPool(object):
+    def __init__(self, table, int_to_mac, workers=None):
+        '''
+        Start worker processes that forward frames using table, following
+        the changes made to it.
+
+        table: ForwardingTable instance
+        int_to_mac: dict mapping interface names to packed MAC addresses
+        workers: int (number of worker processes; by default, one per CPU)
+        '''
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        self._table = table
+        self._dir = tempfile.mkdtemp(prefix='forwarding-pool-')
+        self._path = os.path.join(self._dir, 'table.fts')
+        save_snapshot(table, self._path)
+        self._changed = False
+        table.add_listener(self._table_changed)
+
+        self._conns = []
+        self._processes = []
+        for i in range(workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            p = multiprocessing.Process(target=_worker,
+                    args=(self._path, int_to_mac, child_conn), daemon=True)
+            p.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(p)
+        self._pending = [[] for i in range(workers)]
+
+        # the sizes of the batches sent to each worker whose results have
+        # not been read, and results read by flush(), not yet returned
+        self._worker_of = dict((conn, i) for i, conn in enumerate(self._conns))
+        self._outstanding = [collections.deque() for i in range(workers)]
+        self._outstanding_bytes = [0] * workers
+        self._results = []
+
+    def _table_changed(self, table):
+        # Called by whichever thread changed the table; the snapshot is
+        # written by flush(), once for any number of changes.
+        self._changed = True
+
+    def connections(self):
+        '''Return the connections from which results are read, e.g., to wait
+        for them to become readable.'''
+        return list(self._conns)
+
+    def submit(self, frame, intf):
+        '''
+        Queue the Ethernet frame, carrying an IPv4 packet and received on
+        intf, for the worker that handles its flow.  Frames are sent to the
+        workers by flush().
+
+        frame: bytes
+        intf: str
+        '''
+
+        self._pending[flow_hash(frame, ETH_HLEN) % len(self._pending)].append(
+                (frame, intf))
+
+    def flush(self):
+        '''Send the queued frames to the workers, one message per worker,
+        after a new snapshot if the table has changed.  Results that must be
+        read first (see MAX_OUTSTANDING) are held until the next receive();
+        see has_results().'''
+        if self._changed:
+            self.update()
+        for i, pending in enumerate(self._pending):
+            if pending:
+                self._wait_for(i)
+                self._conns[i].send(pending)
+                self._pending[i] = []
+                size = sum(len(frame) for frame, intf in pending)
+                self._outstanding[i].append(size)
+                self._outstanding_bytes[i] += size
+
+    def _full(self, i):
+        return len(self._outstanding[i]) >= MAX_OUTSTANDING or \
+                self._outstanding_bytes[i] >= MAX_OUTSTANDING_BYTES
+
+    def _wait_for(self, i):
+        '''Read results until another batch can be sent to worker i.'''
+
+        if not self._full(i):
+            return
+        self._results.extend(self._read(
+                multiprocessing.connection.wait(self._conns, 0)))
+        while self._full(i):
+            self._results.extend(self._read([self._conns[i]], block=True))
+
+    def _read(self, conns, block=False):
+        '''Return the results ready on conns, or, if block is True, the next
+        results of the single connection in conns.'''
+
+        results = []
+        for conn in conns:
+            i = self._worker_of[conn]
+            while block or conn.poll():
+                results.extend(conn.recv())
+                self._outstanding_bytes[i] -= self._outstanding[i].popleft()
+                block = False
+        return results
+
+    def has_results(self):
+        '''Return True if flush() has read results that receive() has not
+        returned.'''
+        return bool(self._results)
+
+    def receive(self, conns=None, timeout=None):
+        '''
+        Return the list of (status, frame, intf, next_hop) results (see
+        forward()) that are ready, waiting up to timeout seconds for at least
+        one worker to respond, unless flush() has read some already.  If
+        conns is given, read only from those connections.
+
+        conns: list of connections (from connections())
+        timeout: int or float
+        '''
+
+        results, self._results = self._results, []
+        if conns is None:
+            if results:
+                timeout = 0
+            conns = multiprocessing.connection.wait(self._conns, timeout)
+        results.extend(self._read(conns))
+        return results
+
+    def update(self):
+        '''
+        Give the workers a new snapshot of the table now, rather than with
+        the next frames.  Frames already sent to a worker are forwarded with
+        the old one.
+        '''
+
+        self._changed = False
+        # Replace the file, rather than writing over it, so that workers
+        # still using the old snapshot keep their mapping of it.
+        path = self._path + '.new'
+        save_snapshot(self._table, path)
+        os.replace(path, self._path)
+        for conn in self._conns:
+            conn.send(self._path)
+
+    def close(self):
+        '''Stop the workers and remove the snapshot.'''
+        for conn in self._conns:
+            conn.send(None)
+        for p in self._processes:
+            p.join()
+        for conn in self._conns:
+            conn.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
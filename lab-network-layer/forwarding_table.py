@@ -13,56 +13,511 @@
 
 Test the ForwardingTable.get_entry() method
 >>> table.get_entry('10.20.0.25')
-('someintf', 'someip')
+('r1-g', '10.30.0.18')
 >>> table.get_entry('10.20.0.34')
-('someintf', 'someip')
+('r1-f', '10.30.0.14')
 >>> table.get_entry('10.20.1.20')
-('someintf', 'someip')
+('r1-c', '10.30.0.2')
 >>> table.get_entry('10.20.3.1')
-('someintf', 'someip')
+('r1-k', '10.30.0.34')
 >>> table.get_entry('10.20.0.2')
-('someintf', 'someip')
+('r1-j', '10.30.0.30')
 >>> table.get_entry('10.20.0.11')
-('someintf', 'someip')
+('r1-h', '10.30.0.22')
 >>> table.get_entry('10.20.0.150')
-('someintf', 'someip')
+('r1-d', '10.30.0.6')
 >>> table.get_entry('10.20.0.7')
-('someintf', 'someip')
+('r1-i', '10.30.0.26')
 >>> table.get_entry('10.20.0.75')
-('someintf', 'someip')
+('r1-e', '10.30.0.10')
+>>> table.get_entry(b'\\x0a\\x14\\x00\\x4b')
+('r1-e', '10.30.0.10')
+
+Test the ForwardingTable.load_entries() method
+>>> from route_loader import parse_routes_str
+>>> table2 = ForwardingTable()
+>>> table2.load_entries(parse_routes_str('10.20.0.0/23|r1-c|10.30.0.2;'
+...         '10.20.0.0/30|r1-j|10.30.0.30;10.40.0.0/24|r2|'))
+>>> table2.get_entry('10.20.0.2'), table2.get_entry('10.20.1.20')
+(('r1-j', '10.30.0.30'), ('r1-c', '10.30.0.2'))
+>>> table2.get_entry('10.40.0.2'), table2.get_entry('10.20.3.1')
+(('r2', None), (None, None))
+
+Test the ForwardingTable.aggregate() method
+>>> table2.add_entry('10.20.0.4/30', 'r1-j', '10.30.0.30')
+>>> table2.add_entry('10.20.0.8/29', 'r1-c', '10.30.0.2')
+>>> table2.aggregate()
+(5, 3)
+>>> sorted(str(p) for p in table2.entries)
+['10.20.0.0/23', '10.20.0.0/29', '10.40.0.0/24']
+>>> table2.get_entry('10.20.0.6'), table2.get_entry('10.20.0.9')
+(('r1-j', '10.30.0.30'), ('r1-c', '10.30.0.2'))
+
+Test the ForwardingTable.get_entries() method
+>>> table.get_entries([IPAddress('10.20.0.25').address, IPAddress('10.20.3.1').address])
+[('r1-g', '10.30.0.18'), ('r1-k', '10.30.0.34')]
+>>> table.remove_entry('0.0.0.0/0')
+>>> table.get_entries([IPAddress('10.20.0.25').address, IPAddress('10.20.3.1').address])
+[('r1-g', '10.30.0.18'), (None, None)]
+
+Test IPv6 entries
+>>> table6 = ForwardingTable()
+>>> table6.add_entry('2001:db8::/32', 'r1-c', 'fe80::2')
+>>> table6.add_entry('2001:db8:1::/48', 'r1-d', None)
+>>> table6.get_entry('2001:db8:1::5'), table6.get_entry('2001:db8:2::5')
+(('r1-d', None), ('r1-c', 'fe80::2'))
+>>> table6.remove_entry('2001:db8::/32')
+>>> table6.get_entry('2001:db8:2::5')
+(None, None)
+
+Test default routes for both address families in one table
+>>> table46 = ForwardingTable()
+>>> table46.add_entry('0.0.0.0/0', 'r-a', '10.0.0.1')
+>>> table46.add_entry('::/0', 'r-b', 'fe80::1')
+>>> table46.get_entry('1.2.3.4'), table46.get_entry('2001:db8::1')
+(('r-a', '10.0.0.1'), ('r-b', 'fe80::1'))
+>>> table46.remove_entry('::/0')
+>>> table46.get_entry('1.2.3.4'), table46.get_entry('2001:db8::1')
+(('r-a', '10.0.0.1'), (None, None))
+
+Test a compiled (DIR-24-8) table
+>>> table = ForwardingTable(compiled=True)
+>>> table.add_entry('10.20.0.0/23', 'r1-c', '10.30.0.2')
+>>> table.add_entry('10.20.0.0/30', 'r1-j', '10.30.0.30')
+>>> table.get_entry('10.20.0.2'), table.get_entry('10.20.1.20')
+(('r1-j', '10.30.0.30'), ('r1-c', '10.30.0.2'))
+>>> table.remove_entry('10.20.0.0/30')
+>>> table.get_entry('10.20.0.2'), table.get_entry('10.20.3.1')
+(('r1-c', '10.30.0.2'), (None, None))
+>>> table.memory_usage() < 1 << 20
+True
+
+Test a table with a lookup cache
+>>> table = ForwardingTable(cache_size=2)
+>>> table.add_entry('10.20.0.0/23', 'r1-c', '10.30.0.2')
+>>> table.get_entry('10.20.0.2'), table.get_entry('10.20.0.2')
+(('r1-c', '10.30.0.2'), ('r1-c', '10.30.0.2'))
+>>> table.add_entry('10.20.0.0/30', 'r1-j', '10.30.0.30')
+>>> table.get_entry('10.20.0.2')
+('r1-j', '10.30.0.30')
+>>> table.cache.stats()
+{'hits': 1, 'misses': 2, 'evictions': 0, 'invalidations': 1}
+
+Results that a change does not affect stay cached:
+>>> table.add_entry('10.40.0.0/24', 'r1-d', '10.30.0.6')
+>>> table.get_entry('10.20.0.2')
+('r1-j', '10.30.0.30')
+>>> table.cache.stats()
+{'hits': 2, 'misses': 2, 'evictions': 0, 'invalidations': 1}
+
+Test the ForwardingTable.transaction() method
+>>> table = ForwardingTable(compiled=True)
+>>> table.load_entries(parse_routes_str('10.20.0.0/23|r1-c|10.30.0.2;'
+...         '10.20.0.0/30|r1-j|10.30.0.30;2001:db8::/32|r1-k|'))
+>>> with table.transaction() as transaction:
+...     transaction.remove_entry('10.20.0.0/23')
+...     transaction.add_entry('10.20.0.0/22', 'r1-d', '10.30.0.6')
+...     table.get_entry('10.20.1.20')
+('r1-c', '10.30.0.2')
+>>> table.get_entry('10.20.1.20'), table.get_entry('10.20.3.1')
+(('r1-d', '10.30.0.6'), ('r1-d', '10.30.0.6'))
+>>> try:
+...     with table.transaction() as transaction:
+...         transaction.remove_entry('10.20.0.0/22')
+...         raise ValueError('abort')
+... except ValueError:
+...     pass
+>>> table.get_entry('10.20.3.1'), table.get_entry('2001:db8::1')
+(('r1-d', '10.30.0.6'), ('r1-k', None))
 '''
 
+import bisect
+import socket
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from dir24_8 import Dir24_8
+from prefix_hash import PrefixHash
+from prefix_trie import PrefixTrie
+from route_cache import RouteCache
 from subnet import IPAddress, Subnet
 
-class ForwardingTable(object):
-    def __init__(self):
-        self.entries = {}
+class _Tables(object):
+    '''The entries of one version of a forwarding table, and the lookup
+    structures built from them.  A version is never changed once it has been
+    published.'''
+
+    __slots__ = ('entries', 'tries', 'prefix_hash', 'dir24_8', 'intervals',
+            'cache', 'generation')
+
+class Transaction(object):
+    def __init__(self, table):
+        '''
+        Instantiate an empty set of changes to table, to be applied together
+        by commit().
+
+        table: ForwardingTable instance
+        '''
+
+        self._table = table
+        self._changes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+    def __len__(self):
+        return len(self._changes)
 
     def add_entry(self, prefix, intf, next_hop):
         '''
         Add forwarding entry mapping prefix to interface and next hop IP
-        address.
+        address, when the transaction is committed.
 
         prefix: str or Subnet instance
         '''
 
         if isinstance(prefix, str):
             prefix = Subnet(prefix)
-
-        self.entries[prefix] = (intf, next_hop)
+        self._changes[prefix] = (intf, next_hop)
 
     def remove_entry(self, prefix):
         '''
-        Remove the forwarding entry matching prefix.
+        Remove the forwarding entry matching prefix, if any, when the
+        transaction is committed.
 
         prefix: str or Subnet instance
         '''
 
         if isinstance(prefix, str):
             prefix = Subnet(prefix)
+        self._changes[prefix] = None
 
-        if prefix in self.entries:
-            del self.entries[prefix]
+    def commit(self):
+        '''Apply the changes to the table, all at once, and start a new set
+        of changes.'''
+        self._table._commit(self._changes)
+        self._changes = {}
+
+    def abort(self):
+        '''Discard the changes.'''
+        self._changes = {}
+
+class ForwardingTable(object):
+    # a transaction changing more than this fraction of the entries, and more
+    # than this number of them, rebuilds the lookup structures, rather than
+    # patching a copy of them
+    REBUILD_FRACTION = 0.125
+    REBUILD_MIN_CHANGES = 64
+
+    def __init__(self, compiled=False, cache_size=0):
+        '''
+        Instantiate an empty forwarding table.  If compiled is True, IPv4
+        lookups are answered from a DIR-24-8 table, which is patched as
+        entries are added and removed, at a memory cost of up to roughly 48 MB
+        (see memory_usage()).  If cache_size is non-zero, the results of up to
+        cache_size get_entry() lookups are cached (see the `cache` instance
+        var for its counters).
+
+        Lookups never wait for updates, nor see them half-applied: the
+        entries and lookup structures form a version that is never changed
+        once published.  Each update (see transaction()) builds a new version,
+        sharing what it does not change with the current one, and publishes
+        it by replacing the reference to the current one.  A lookup reads that
+        reference once, so it uses one version throughout.  Updates from
+        several threads are applied one at a time.
+
+        compiled: bool
+        cache_size: int
+        '''
+
+        self._compiled = compiled
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._tables = self._build({}, None)
+
+    @property
+    def entries(self):
+        '''The current entries, as a dict mapping each Subnet to an (intf,
+        next_hop) tuple.  It must not be changed.'''
+        return self._tables.entries
+
+    @property
+    def cache(self):
+        return self._tables.cache
+
+    @property
+    def _tries(self):
+        # one longest-prefix-match index per address family
+        return self._tables.tries
+
+    def _build(self, entries, cache):
+        '''Return a new version holding entries, with all lookup structures
+        built from them, and cache (if any), emptied, in a new generation.'''
+
+        tables = _Tables()
+        tables.entries = entries
+        tables.tries = {}
+        for family, address_len in ((socket.AF_INET, 32),
+                (socket.AF_INET6, 128)):
+            tables.tries[family] = PrefixTrie.build(address_len,
+                    ((p.prefix.address, p.prefix_len, entry) \
+                    for p, entry in entries.items() \
+                    if p.prefix.address_family == family))
+
+        # IPv6 lookups search the prefix lengths, rather than walking the trie
+        tables.prefix_hash = PrefixHash(tables.tries[socket.AF_INET6])
+
+        # flattened IPv4 table used by get_entries(); built lazily, once per
+        # version
+        tables.intervals = None
+
+        if self._compiled:
+            tables.dir24_8 = Dir24_8(tables.tries[socket.AF_INET])
+        else:
+            tables.dir24_8 = None
+
+        if cache is not None:
+            cache.advance()
+            cache.clear()
+        elif self._cache_size:
+            cache = RouteCache(self._cache_size)
+        tables.cache = cache
+        if cache is not None:
+            tables.generation = cache.generation
+        return tables
+
+    def _patch(self, old, changes):
+        '''Return a new version holding the entries of old with changes
+        applied, patching copies of the lookup structures of old that the
+        changes affect, and sharing the others.'''
+
+        tables = _Tables()
+        tables.entries = dict(old.entries)
+        tables.tries = dict(old.tries)
+        tables.prefix_hash = old.prefix_hash
+        tables.dir24_8 = old.dir24_8
+        tables.intervals = old.intervals
+        tables.cache = old.cache
+
+        families = set(prefix.prefix.address_family for prefix in changes)
+        for family in families:
+            tables.tries[family] = old.tries[family].copy()
+        if socket.AF_INET in families:
+            tables.intervals = None
+            if tables.dir24_8 is not None:
+                tables.dir24_8 = old.dir24_8.copy(tables.tries[socket.AF_INET])
+        if socket.AF_INET6 in families:
+            tables.prefix_hash = old.prefix_hash.copy(
+                    tables.tries[socket.AF_INET6])
+
+        for prefix, entry in changes.items():
+            family = prefix.prefix.address_family
+            address, prefix_len = prefix.prefix.address, prefix.prefix_len
+            old_entry = tables.entries.get(prefix)
+            if entry is None:
+                if old_entry is None:
+                    continue
+                del tables.entries[prefix]
+                tables.tries[family].remove(address, prefix_len)
+            else:
+                tables.entries[prefix] = entry
+                tables.tries[family].insert(address, prefix_len, entry)
+
+            if family == socket.AF_INET6:
+                if entry is None:
+                    tables.prefix_hash.remove(address, prefix_len)
+                else:
+                    tables.prefix_hash.add(address, prefix_len, entry)
+            elif tables.dir24_8 is not None:
+                if entry is None:
+                    tables.dir24_8.remove(address, prefix_len, old_entry)
+                else:
+                    tables.dir24_8.add(address, prefix_len, entry, old_entry)
+
+        # The cache is shared by the versions.  Once the new one is complete,
+        # the results that the changes affect are discarded, in a new
+        # generation, so that lookups in the old one cannot put them back.
+        if tables.cache is not None:
+            tables.generation = tables.cache.advance()
+            for prefix in changes:
+                tables.cache.invalidate(prefix.prefix.address_family,
+                        prefix.prefix.address, prefix.prefix_len)
+        return tables
+
+    def _commit(self, changes):
+        '''Publish a new version with changes applied, a dict mapping Subnet
+        instances to (intf, next_hop) tuples, or to None for removal.'''
+
+        if not changes:
+            return
+        with self._lock:
+            old = self._tables
+            if len(changes) > max(len(old.entries) * self.REBUILD_FRACTION,
+                    self.REBUILD_MIN_CHANGES):
+                entries = dict(old.entries)
+                for prefix, entry in changes.items():
+                    if entry is None:
+                        entries.pop(prefix, None)
+                    else:
+                        entries[prefix] = entry
+                tables = self._build(entries, old.cache)
+            else:
+                tables = self._patch(old, changes)
+            self._publish(tables)
+
+    def _publish(self, tables):
+        # called with the lock held, so listeners see versions in order
+        self._tables = tables
+        for callback in self._listeners:
+            callback(self)
+
+    def add_listener(self, callback):
+        '''
+        Call callback(table) each time a new version of the table is
+        published, e.g., to pass the changes on to another copy of the table.
+        It is called by the thread making the change, before the change
+        returns, so it should be quick.
+
+        callback: callable
+        '''
+
+        self._listeners.append(callback)
+
+    def transaction(self):
+        '''
+        Return a Transaction, with which any number of entries can be added
+        and removed, and then applied to the table together, so that no
+        lookup sees some of the changes but not the others.  Used as a
+        context manager, the transaction is committed at the end of the with
+        block, unless it raises an exception.
+        '''
+        return Transaction(self)
+
+    def add_entry(self, prefix, intf, next_hop):
+        '''
+        Add forwarding entry mapping prefix to interface and next hop IP
+        address.
+
+        prefix: str or Subnet instance
+        '''
+
+        with self.transaction() as transaction:
+            transaction.add_entry(prefix, intf, next_hop)
+
+    def load_entries(self, routes):
+        '''
+        Add forwarding entries for all the given routes, as with add_entry(),
+        but in one transaction, so that the lookup structures are built once,
+        from the full set of entries, rather than updated for each entry
+        (unless the routes are few compared to the entries already in the
+        table).  routes may be a generator, such as those in route_loader.py.
+
+        routes: iterable of (prefix, intf, next_hop) tuples, where prefix is a
+        str or Subnet instance
+        '''
+
+        with self.transaction() as transaction:
+            for prefix, intf, next_hop in routes:
+                transaction.add_entry(prefix, intf, next_hop)
+
+    def aggregate(self):
+        '''
+        Reduce the number of entries in the table without changing the entry
+        returned for any address, by repeating the following until neither
+        applies:
+
+         - Remove each entry whose longest strictly containing prefix has the
+           same entry (interface and next hop).
+         - Replace each pair of sibling prefixes (i.e., the two halves of a
+           prefix one bit shorter) that have the same entry with an entry for
+           their parent prefix.
+
+        Return a tuple consisting of the number of entries before and after.
+        '''
+
+        with self._lock:
+            old = self._tables
+            before = len(old.entries)
+            entries = {}
+            for family, trie in old.tries.items():
+                address_len = trie.address_len
+                routes = dict(((key, prefix_len), entry) \
+                        for key, prefix_len, entry in trie.items())
+                while True:
+                    count = len(routes)
+                    self._remove_redundant(routes, address_len)
+                    self._merge_siblings(routes, address_len)
+                    if len(routes) == count:
+                        break
+                for (key, prefix_len), entry in routes.items():
+                    entries[Subnet(IPAddress(key, family), prefix_len)] = entry
+
+            self._publish(self._build(entries, old.cache))
+        return before, len(entries)
+
+    @classmethod
+    def _remove_redundant(cls, routes, address_len):
+        '''Remove routes whose longest strictly containing route has the
+        same entry.'''
+
+        # Sorted (key, prefix_len) pairs visit containing prefixes before
+        # the prefixes they contain, so a stack of (end, entry) for the kept
+        # routes containing the current one gives the entry it would inherit.
+        stack = [(1 << address_len, None)]
+        for key, prefix_len in sorted(routes):
+            while stack[-1][0] <= key:
+                stack.pop()
+            entry = routes[(key, prefix_len)]
+            if entry == stack[-1][1]:
+                del routes[(key, prefix_len)]
+            else:
+                stack.append((key + (1 << (address_len - prefix_len)), entry))
+
+    @classmethod
+    def _merge_siblings(cls, routes, address_len):
+        '''Replace sibling routes having the same entry with a route for
+        their parent, from the longest prefixes to the shortest.'''
+
+        by_len = {}
+        for key, prefix_len in routes:
+            by_len.setdefault(prefix_len, []).append(key)
+
+        for prefix_len in range(address_len, 0, -1):
+            bit = 1 << (address_len - prefix_len)
+            for key in by_len.get(prefix_len, []):
+                if key & bit:
+                    continue
+                entry = routes.get((key, prefix_len))
+                if entry is None or routes.get((key | bit, prefix_len)) != entry:
+                    continue
+                # The two halves cover the whole parent, so any existing
+                # entry for the parent is never used.
+                del routes[(key, prefix_len)]
+                del routes[(key | bit, prefix_len)]
+                if (key, prefix_len - 1) not in routes:
+                    by_len.setdefault(prefix_len - 1, []).append(key)
+                routes[(key, prefix_len - 1)] = entry
+
+    def remove_entry(self, prefix):
+        '''
+        Remove the forwarding entry matching prefix.
+
+        prefix: str or Subnet instance
+        '''
+
+        with self.transaction() as transaction:
+            transaction.remove_entry(prefix)
 
     def get_entry(self, ip_address):
         '''
@@ -70,11 +525,97 @@ class ForwardingTable(object):
         The entry is a tuple consisting of interface and next-hop IP address.
         If there is no match, return None, None.
 
-        ip_address: str or IPAddress instance
+        ip_address: str, bytes (packed address) or IPAddress instance
         '''
 
-        if isinstance(ip_address, str):
-            ip_address = IPAddress(ip_address)
-        
-        #FIXME - complete the rest of the method
-        return None, None
+        if isinstance(ip_address, IPAddress):
+            address, family = ip_address.address, ip_address.address_family
+        else:
+            address, family = IPAddress._parse(ip_address)
+
+        # the one read of the current version
+        tables = self._tables
+
+        cache = tables.cache
+        if cache is not None:
+            entry = cache.get(family, address)
+            if entry is not None:
+                return entry
+
+        if family == socket.AF_INET6:
+            entry = tables.prefix_hash.lookup(address)
+        elif tables.dir24_8 is not None:
+            entry = tables.dir24_8.lookup(address)
+        else:
+            entry = tables.tries[family].lookup(address)
+        if entry is None:
+            entry = (None, None)
+
+        if cache is not None:
+            cache.put(family, address, entry, tables.generation)
+        return entry
+
+    def memory_usage(self):
+        '''
+        Return the number of bytes allocated for the compiled IPv4 lookup
+        table, or 0 if the table is not compiled.
+        '''
+
+        dir24_8 = self._tables.dir24_8
+        if dir24_8 is None:
+            return 0
+        return dir24_8.memory_usage()
+
+    @classmethod
+    def _build_intervals(cls, trie):
+        '''
+        Flatten the IPv4 entries of trie into a sorted list of interval start
+        addresses and a parallel list of indexes into a list of entries, such
+        that the entry for an address is the one belonging to the last
+        interval starting at or before it.  Entry index 0 is (None, None).
+        '''
+
+        entries = [(None, None)]
+        entry_index = {None: 0}
+        starts = []
+        values = []
+        for start, entry in trie.intervals():
+            if entry not in entry_index:
+                entry_index[entry] = len(entries)
+                entries.append(entry)
+            starts.append(start)
+            values.append(entry_index[entry])
+
+        if numpy is not None:
+            starts = numpy.array(starts, dtype=numpy.uint32)
+            values = numpy.array(values, dtype=numpy.intp)
+            obj_entries = numpy.empty(len(entries), dtype=object)
+            obj_entries[:] = entries
+            entries = obj_entries
+        return starts, values, entries
+
+    def get_entries(self, addresses):
+        '''
+        Return a list containing, for each IPv4 address in addresses, the
+        entry having the longest prefix match of that address, as would be
+        returned by get_entry().  The lookups are resolved together against
+        a flattened copy of the table, using NumPy, if it is available.
+
+        addresses: sequence or NumPy array of int (i.e., IPAddress.address
+        values of IPv4 addresses)
+        '''
+
+        tables = self._tables
+        if tables.intervals is None:
+            tables.intervals = self._build_intervals(
+                    tables.tries[socket.AF_INET])
+        starts, values, entries = tables.intervals
+
+        if numpy is not None:
+            addresses = numpy.asarray(addresses, dtype=numpy.uint32)
+            i = numpy.searchsorted(starts, addresses, side='right') - 1
+            return entries[values[i]].tolist()
+
+        bisect_right = bisect.bisect_right
+        return [entries[values[bisect_right(starts, address) - 1]] \
+                for address in addresses]
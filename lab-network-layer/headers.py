@@ -0,0 +1,353 @@
+'''
+Lightweight views of Ethernet (including 802.1Q), ARP, IPv4 and IPv6 headers.
+The header fields are unpacked with `struct.unpack_from()` directly from the
+frame or packet, and the payload is exposed as a `memoryview` slice, so
+nothing beyond the header is copied.  Addresses are left in their packed
+(`bytes`) form.
+
+>>> frame = build_ethernet(b'\\xff' * 6, b'\\x00\\x00\\x00\\xaa\\xaa\\xaa', ETH_P_ARP) + \\
+...         build_arp(ARPOP_REQUEST, b'\\x00\\x00\\x00\\xaa\\xaa\\xaa',
+...                 b'\\x0a\\x00\\x00\\x02', b'\\x00' * 6, b'\\x0a\\x00\\x00\\x01')
+>>> eth = EthernetHeader(frame)
+>>> eth.ethertype == ETH_P_ARP, eth.vlan, eth.is_broadcast()
+(True, None, True)
+>>> arp = ArpHeader(eth.payload())
+>>> arp.op == ARPOP_REQUEST, arp.spa, arp.tpa
+(True, b'\\n\\x00\\x00\\x02', b'\\n\\x00\\x00\\x01')
+
+>>> pkt = bytes.fromhex('450000260001000040013a9f0a0000020a140019') + b'payload'
+>>> ip = IPv4Header(pkt)
+>>> ip.ttl, ip.protocol, ip.src, ip.dst, ip.header_len
+(64, 1, b'\\n\\x00\\x00\\x02', b'\\n\\x14\\x00\\x19', 20)
+>>> bytes(ip.payload())
+b'payload'
+
+Decrementing the TTL in place updates the checksum incrementally:
+>>> pkt = build_ipv4(b'\\x0a\\x00\\x00\\x02', b'\\x0a\\x14\\x00\\x19', 1, b'payload')
+>>> buf = bytearray(pkt)
+>>> decrement_ttl(buf)
+63
+>>> buf[10:12] == build_ipv4(b'\\x0a\\x00\\x00\\x02', b'\\x0a\\x14\\x00\\x19', 1, b'payload',
+...         ttl=63)[10:12]
+True
+>>> internet_checksum(buf[:20])
+0
+
+ICMP errors are recognized, so that no error is sent about one:
+>>> is_icmp_error(build_ipv4(b'\\x0a\\x00\\x00\\x02', b'\\x0a\\x14\\x00\\x19', IPPROTO_ICMP,
+...         build_icmp(ICMP_TIME_EXCEEDED, ICMP_EXC_TTL, bytes(4), pkt[:28])))
+True
+>>> is_icmp_error(build_ipv4(b'\\x0a\\x00\\x00\\x02', b'\\x0a\\x14\\x00\\x19', IPPROTO_ICMP,
+...         build_icmp(ICMP_ECHO, 0, bytes(4), b'')))
+False
+
+>>> src = bytes.fromhex('fe80' + '00' * 13 + '02')
+>>> dst = bytes.fromhex('20010db8' + '00' * 11 + '19')
+>>> icmp = build_icmpv6(src, dst, ICMP6_TIME_EXCEEDED, 0, bytes(4))
+>>> ip6 = IPv6Header(build_ipv6(src, dst, IPPROTO_ICMPV6, icmp, hop_limit=255))
+>>> ip6.version, ip6.payload_len, ip6.next_header, ip6.hop_limit, ip6.src == src
+(6, 8, 58, 255, True)
+>>> solicited_node(dst).hex(), ipv6_multicast_mac(solicited_node(dst)).hex()
+('ff0200000000000000000001ff000019', '3333ff000019')
+>>> is_icmp_error(ip6.pkt)
+True
+'''
+
+import struct
+
+#From /usr/include/linux/if_ether.h:
+ETH_P_IP = 0x0800 # Internet Protocol packet
+ETH_P_ARP = 0x0806 # Address Resolution packet
+ETH_P_8021Q = 0x8100 # 802.1Q VLAN Extended Header
+ETH_P_IPV6 = 0x86DD # IPv6 over bluebook
+
+#From /usr/include/linux/in.h:
+IPPROTO_ICMP = 1 # Internet Control Message Protocol
+
+#From /usr/include/linux/icmp.h:
+ICMP_ECHOREPLY = 0 # Echo Reply
+ICMP_DEST_UNREACH = 3 # Destination Unreachable
+ICMP_SOURCE_QUENCH = 4 # Source Quench
+ICMP_REDIRECT = 5 # Redirect (change route)
+ICMP_ECHO = 8 # Echo Request
+ICMP_TIME_EXCEEDED = 11 # Time Exceeded
+ICMP_PARAMETERPROB = 12 # Parameter Problem
+ICMP_EXC_TTL = 0 # TTL count exceeded
+
+#From /usr/include/netinet/icmp6.h:
+ICMP6_INFOMSG_MASK = 0x80 # all informational messages
+ICMP6_TIME_EXCEEDED = 3
+ICMP6_TIME_EXCEED_TRANSIT = 0 # Hop Limit == 0 in transit
+ND_NEIGHBOR_SOLICIT = 135
+ND_NEIGHBOR_ADVERT = 136
+ND_OPT_SOURCE_LINKADDR = 1
+ND_OPT_TARGET_LINKADDR = 2
+ND_NA_FLAG_ROUTER = 0x80000000
+ND_NA_FLAG_SOLICITED = 0x40000000
+ND_NA_FLAG_OVERRIDE = 0x20000000
+
+#From /usr/include/linux/in6.h:
+IPPROTO_ICMPV6 = 58 # ICMPv6
+
+#From /usr/include/net/if_arp.h:
+ARPHRD_ETHER = 1 # Ethernet 10Mbps
+ARPOP_REQUEST = 1 # ARP request
+ARPOP_REPLY = 2 # ARP reply
+
+ETH_HLEN = 14
+VLAN_HLEN = 4
+BROADCAST_MAC = b'\xff\xff\xff\xff\xff\xff'
+
+_eth = struct.Struct('!6s6sH')
+_vlan = struct.Struct('!HH')
+_arp = struct.Struct('!HHBBH6s4s6s4s')
+_ipv4 = struct.Struct('!BBHHHBBH4s4s')
+_icmp = struct.Struct('!BBH')
+_ipv6 = struct.Struct('!IHBB16s16s')
+_ipv6_pseudo = struct.Struct('!16s16sI3xB')
+
+class EthernetHeader(object):
+    '''
+    An Ethernet frame header.  If the frame has an 802.1Q tag, then `vlan` is
+    the VLAN ID, `ethertype` is the type of the encapsulated payload, and
+    `header_len` includes the tag; otherwise, `vlan` is None.
+    '''
+
+    __slots__ = ('frame', 'dst', 'src', 'ethertype', 'vlan', 'header_len')
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.dst, self.src, self.ethertype = _eth.unpack_from(frame, 0)
+        if self.ethertype == ETH_P_8021Q:
+            tci, self.ethertype = _vlan.unpack_from(frame, ETH_HLEN)
+            self.vlan = tci & 0x0fff
+            self.header_len = ETH_HLEN + VLAN_HLEN
+        else:
+            self.vlan = None
+            self.header_len = ETH_HLEN
+
+    def is_broadcast(self):
+        return self.dst == BROADCAST_MAC
+
+    def is_multicast(self):
+        '''Return True for group (including broadcast) destinations.'''
+        return self.dst[0] & 1 == 1
+
+    def payload(self):
+        '''Return the payload, as a memoryview of the frame.'''
+        return memoryview(self.frame)[self.header_len:]
+
+class ArpHeader(object):
+    '''An ARP packet for IPv4 over Ethernet.'''
+
+    __slots__ = ('htype', 'ptype', 'hlen', 'plen', 'op',
+            'sha', 'spa', 'tha', 'tpa')
+
+    def __init__(self, pkt):
+        self.htype, self.ptype, self.hlen, self.plen, self.op, \
+                self.sha, self.spa, self.tha, self.tpa = _arp.unpack_from(pkt, 0)
+
+class IPv4Header(object):
+    '''An IPv4 packet header.  Options, if any, are not parsed.'''
+
+    __slots__ = ('pkt', 'version', 'header_len', 'tos', 'total_length',
+            'id', 'flags_offset', 'ttl', 'protocol', 'checksum', 'src', 'dst')
+
+    def __init__(self, pkt):
+        self.pkt = pkt
+        version_ihl, self.tos, self.total_length, self.id, \
+                self.flags_offset, self.ttl, self.protocol, self.checksum, \
+                self.src, self.dst = _ipv4.unpack_from(pkt, 0)
+        self.version = version_ihl >> 4
+        self.header_len = (version_ihl & 0x0f) << 2
+
+    def payload(self):
+        '''Return the payload, as a memoryview of the packet.'''
+        return memoryview(self.pkt)[self.header_len:self.total_length]
+
+class IPv6Header(object):
+    '''An IPv6 packet header.  Extension headers, if any, are not parsed.'''
+
+    __slots__ = ('pkt', 'version', 'traffic_class', 'flow_label',
+            'payload_len', 'next_header', 'hop_limit', 'src', 'dst')
+
+    header_len = 40
+
+    def __init__(self, pkt):
+        self.pkt = pkt
+        version_class_flow, self.payload_len, self.next_header, \
+                self.hop_limit, self.src, self.dst = _ipv6.unpack_from(pkt, 0)
+        self.version = version_class_flow >> 28
+        self.traffic_class = (version_class_flow >> 20) & 0xff
+        self.flow_label = version_class_flow & 0xfffff
+
+    def payload(self):
+        '''Return the payload, as a memoryview of the packet.'''
+        return memoryview(self.pkt)[40:40 + self.payload_len]
+
+def build_ethernet(dst, src, ethertype, vlan=None):
+    '''
+    Return an Ethernet frame header, with an 802.1Q tag if vlan is not None.
+
+    dst: bytes
+    src: bytes
+    ethertype: int
+    vlan: int
+    '''
+
+    if vlan is None:
+        return _eth.pack(dst, src, ethertype)
+    return _eth.pack(dst, src, ETH_P_8021Q) + _vlan.pack(vlan, ethertype)
+
+def build_arp(op, sha, spa, tha, tpa):
+    '''
+    Return an ARP packet for IPv4 over Ethernet.
+
+    op: int (ARPOP_REQUEST or ARPOP_REPLY)
+    sha, tha: bytes (6-byte MAC addresses)
+    spa, tpa: bytes (4-byte IPv4 addresses)
+    '''
+
+    return _arp.pack(ARPHRD_ETHER, ETH_P_IP, 6, 4, op, sha, spa, tha, tpa)
+
+def internet_checksum(data):
+    '''
+    Return the Internet checksum (RFC 1071) of data.
+
+    data: bytes, bytearray, or memoryview
+    '''
+
+    if len(data) & 1:
+        data = bytes(data) + b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data) >> 1), data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+def decrement_ttl(pkt):
+    '''
+    Decrement the TTL of the IPv4 packet in place and update its header
+    checksum incrementally (RFC 1624), rather than recomputing it over the
+    whole header.  Return the new TTL.  The TTL must be at least 1.
+
+    pkt: bytearray
+    '''
+
+    # The TTL is the high-order byte of the 16-bit word at offset 8, so the
+    # word decreases by 0x100:  HC' = ~(~HC + ~m + m')
+    old = (pkt[8] << 8) | pkt[9]
+    new = old - 0x100
+    total = (~((pkt[10] << 8) | pkt[11]) & 0xffff) + (~old & 0xffff) + new
+    total = (total & 0xffff) + (total >> 16)
+    total = (total & 0xffff) + (total >> 16)
+    checksum = ~total & 0xffff
+    pkt[8] -= 1
+    pkt[10] = checksum >> 8
+    pkt[11] = checksum & 0xff
+    return pkt[8]
+
+def is_icmp_error(pkt):
+    '''
+    Return True if the IPv4 or IPv6 packet is an ICMP (or ICMPv6) error
+    message, about which no ICMP error may be sent (RFC 1812, Section
+    4.3.2.7; RFC 4443, Section 2.4).  IPv4 fragments other than the first,
+    which do not carry the ICMP header, and IPv6 extension headers are not
+    looked into.
+
+    pkt: bytes (or other buffer) containing the packet
+    '''
+
+    if pkt[0] >> 4 == 6:
+        return len(pkt) > 40 and pkt[6] == IPPROTO_ICMPV6 and \
+                not pkt[40] & ICMP6_INFOMSG_MASK
+    ihl = (pkt[0] & 0x0f) << 2
+    return pkt[9] == IPPROTO_ICMP and not (pkt[6] & 0x1f or pkt[7]) and \
+            len(pkt) > ihl and pkt[ihl] in (ICMP_DEST_UNREACH,
+            ICMP_SOURCE_QUENCH, ICMP_REDIRECT, ICMP_TIME_EXCEEDED,
+            ICMP_PARAMETERPROB)
+
+def build_ipv4(src, dst, protocol, payload, ttl=64, id=0):
+    '''
+    Return an IPv4 packet (with no options), including its header checksum.
+
+    src, dst: bytes (4-byte IPv4 addresses)
+    protocol: int
+    payload: bytes
+    '''
+
+    header = bytearray(_ipv4.pack(0x45, 0, 20 + len(payload), id, 0,
+            ttl, protocol, 0, src, dst))
+    checksum = internet_checksum(header)
+    header[10] = checksum >> 8
+    header[11] = checksum & 0xff
+    return bytes(header) + payload
+
+def build_icmp(icmp_type, code, rest, data):
+    '''
+    Return an ICMP message, including its checksum.
+
+    icmp_type: int
+    code: int
+    rest: bytes (the 4 bytes following the checksum, e.g., identifier and
+    sequence number)
+    data: bytes
+    '''
+
+    msg = bytearray(_icmp.pack(icmp_type, code, 0))
+    msg += rest
+    msg += data
+    checksum = internet_checksum(msg)
+    msg[2] = checksum >> 8
+    msg[3] = checksum & 0xff
+    return bytes(msg)
+
+def build_ipv6(src, dst, next_header, payload, hop_limit=64):
+    '''
+    Return an IPv6 packet (with no extension headers).
+
+    src, dst: bytes (16-byte IPv6 addresses)
+    next_header: int
+    payload: bytes
+    '''
+
+    return _ipv6.pack(6 << 28, len(payload), next_header, hop_limit,
+            src, dst) + payload
+
+def build_icmpv6(src, dst, icmp_type, code, body):
+    '''
+    Return an ICMPv6 message, including its checksum, which covers the IPv6
+    pseudo-header of src and dst.
+
+    src, dst: bytes (16-byte IPv6 addresses)
+    icmp_type: int
+    code: int
+    body: bytes (everything following the checksum)
+    '''
+
+    msg = bytearray(_icmp.pack(icmp_type, code, 0))
+    msg += body
+    checksum = internet_checksum(_ipv6_pseudo.pack(src, dst, len(msg),
+            IPPROTO_ICMPV6) + msg)
+    msg[2] = checksum >> 8
+    msg[3] = checksum & 0xff
+    return bytes(msg)
+
+def solicited_node(ip):
+    '''
+    Return the solicited-node multicast address (RFC 4291) for the IPv6
+    address ip.
+
+    ip: bytes (16-byte IPv6 address)
+    '''
+
+    return b'\xff\x02' + bytes(9) + b'\x01\xff' + bytes(ip[13:16])
+
+def ipv6_multicast_mac(ip):
+    '''
+    Return the Ethernet address to which packets for the IPv6 multicast
+    address ip are sent (RFC 2464).
+
+    ip: bytes (16-byte IPv6 address)
+    '''
+
+    return b'\x33\x33' + bytes(ip[12:16])
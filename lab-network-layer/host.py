@@ -1,39 +1,173 @@
 #!/usr/bin/python3
 
+import json
 import os
 import socket
+import struct
+import time
 
 from cougarnet.rawpkt import BaseFrameHandler
 from cougarnet.util import \
         mac_str_to_binary, mac_binary_to_str, \
         ip_str_to_binary, ip_binary_to_str
 
-#From /usr/include/linux/if_ether.h:
-ETH_P_IP = 0x0800 # Internet Protocol packet
-ETH_P_ARP = 0x0806 # Address Resolution packet
-
-#From /usr/include/net/if_arp.h:
-ARPHRD_ETHER = 1 # Ethernet 10Mbps
-ARPOP_REQUEST = 1 # ARP request
-ARPOP_REPLY = 2 # ARP reply
+from arp_cache import ArpCache
+from batch_io import BatchedFrameHandler
+from forwarding_pool import ForwardingPool, FORWARD, TTL_EXCEEDED, ETH_HLEN
+from forwarding_table import ForwardingTable
+from headers import EthernetHeader, ArpHeader, IPv4Header, IPv6Header, \
+        ETH_P_IP, ETH_P_ARP, ETH_P_IPV6, ARPHRD_ETHER, ARPOP_REQUEST, \
+        ARPOP_REPLY, BROADCAST_MAC, ICMP_TIME_EXCEEDED, ICMP_EXC_TTL, \
+        ICMP6_TIME_EXCEEDED, ICMP6_TIME_EXCEED_TRANSIT, IPPROTO_ICMPV6, \
+        ND_NEIGHBOR_SOLICIT, ND_NEIGHBOR_ADVERT, ND_OPT_SOURCE_LINKADDR, \
+        ND_OPT_TARGET_LINKADDR, ND_NA_FLAG_ROUTER, ND_NA_FLAG_SOLICITED, \
+        ND_NA_FLAG_OVERRIDE, build_ethernet, build_arp, build_ipv4, \
+        build_icmp, build_ipv6, build_icmpv6, decrement_ttl, is_icmp_error, \
+        solicited_node, ipv6_multicast_mac
 
 #From /usr/include/linux/in.h:
+IPPROTO_ICMP = 1 # Internet Control Message Protocol
 IPPROTO_TCP = 6 # Transmission Control Protocol
 IPPROTO_UDP = 17 # User Datagram Protocol
 
-class Host(BaseFrameHandler):
-    def __init__(self, ip_forward):
+IP_BROADCAST = b'\xff\xff\xff\xff'
+IPV6_ALL_NODES = b'\xff\x02' + bytes(13) + b'\x01'
+ZERO_MAC = b'\x00\x00\x00\x00\x00\x00'
+
+# Neighbor Discovery constants (RFC 4861, section 10)
+ND_REACHABLE_TIME = 30 # seconds
+ND_RETRANS_TIMER = 1 # seconds
+ND_MAX_MULTICAST_SOLICIT = 3
+ND_HOP_LIMIT = 255
+
+# the most of an offending packet quoted in an ICMPv6 error message, so that
+# the message fits in the minimum IPv6 MTU (RFC 4443)
+ICMP6_MAX_QUOTE = 1280 - 40 - 8
+
+ARP_AGING_INTERVAL = 1 # seconds
+
+class Host(BatchedFrameHandler, BaseFrameHandler):
+    def __init__(self, ip_forward, workers=0):
         super(Host, self).__init__()
 
         self._ip_forward = ip_forward
 
-        # do any additional initialization here
+        # packed MAC address of each interface, and packed IPv4 and IPv6
+        # addresses of all interfaces, for matching incoming frames and
+        # packets.  The IPv6 addresses of an interface include its link-local
+        # address, last.
+        self._int_to_mac = {}
+        self._int_to_ips = {}
+        self._int_to_ipv6s = {}
+        self._my_ips = set()
+        self._my_ipv6s = set()
+        for intf, info in self.int_to_info.items():
+            self._int_to_mac[intf] = mac_str_to_binary(info.mac_addr)
+            self._int_to_ips[intf] = [ip_str_to_binary(ip) \
+                    for ip in info.ipv4_addrs]
+            self._my_ips.update(self._int_to_ips[intf])
+            ipv6s = list(getattr(info, 'ipv6_addrs', None) or [])
+            if getattr(info, 'ipv6_addr_link_local', None):
+                ipv6s.append(info.ipv6_addr_link_local)
+            self._int_to_ipv6s[intf] = [ip_str_to_binary(ip) for ip in ipv6s]
+            self._my_ipv6s.update(self._int_to_ipv6s[intf])
+
+        # IPv6 multicast groups joined (all-nodes, and the solicited-node
+        # group of each address), and the MAC addresses they map to
+        self._ipv6_groups = {IPV6_ALL_NODES}
+        self._ipv6_groups.update(solicited_node(ip) for ip in self._my_ipv6s)
+        self._multicast_macs = {ipv6_multicast_mac(group) \
+                for group in self._ipv6_groups}
+
+        self.arp_cache = ArpCache()
+        self.nd_cache = ArpCache(timeout=ND_REACHABLE_TIME,
+                request_interval=ND_RETRANS_TIMER,
+                max_requests=ND_MAX_MULTICAST_SOLICIT)
+
+        # Populate the forwarding table with the routes from the
+        # configuration file and with the directly-connected prefixes of each
+        # interface, whose next hop is the destination itself (None).
+        routes = [tuple(route) for route in \
+                json.loads(os.environ.get('COUGARNET_ROUTES', '[]'))]
+        for intf, info in self.int_to_info.items():
+            for ip in info.ipv4_addrs:
+                routes.append((f'{ip}/{info.ipv4_prefix_len}', intf, None))
+            for ip in getattr(info, 'ipv6_addrs', None) or []:
+                routes.append((f'{ip}/{info.ipv6_prefix_len}', intf, None))
+        self.forwarding_table = ForwardingTable()
+        self.forwarding_table.load_entries(routes)
+
+        # With workers, forwarding (route lookup, TTL decrement and framing)
+        # is spread across that many processes, which follow the changes to
+        # the forwarding table.  Their results are handled when they are
+        # ready, so the event loop must support register() (see
+        # schedule_items()).
+        if ip_forward and workers:
+            self.forwarding_pool = ForwardingPool(self.forwarding_table,
+                    self._int_to_mac, workers)
+        else:
+            self.forwarding_pool = None
 
     def _handle_frame(self, frame, intf):
-        pass
+        if self.forwarding_pool is not None and len(frame) >= 34 and \
+                frame[12] << 8 | frame[13] == ETH_P_IP and \
+                frame[:6] == self._int_to_mac.get(intf) and \
+                frame[30:34] not in self._my_ips and \
+                frame[30:34] != IP_BROADCAST:
+            # an IPv4 packet to forward, which the workers parse
+            self.forwarding_pool.submit(frame, intf)
+            if self._outbound is None:
+                # not handling a batch, which would flush when done
+                self.forwarding_pool.flush()
+                if self.forwarding_pool.has_results():
+                    self.handle_forwarding_results([])
+            return
+
+        eth = EthernetHeader(frame)
+        if eth.dst == self._int_to_mac.get(intf) or eth.dst == BROADCAST_MAC \
+                or eth.dst in self._multicast_macs:
+            if eth.ethertype == ETH_P_IP:
+                self.handle_ip(eth.payload(), intf)
+            elif eth.ethertype == ETH_P_IPV6:
+                self.handle_ipv6(eth.payload(), intf)
+            elif eth.ethertype == ETH_P_ARP:
+                self.handle_arp(eth.payload(), intf)
+        else:
+            self.not_my_frame(frame, intf)
 
     def handle_ip(self, pkt, intf):
-        pass
+        ip = IPv4Header(pkt)
+        if ip.dst in self._my_ips or ip.dst == IP_BROADCAST:
+            if ip.protocol == IPPROTO_TCP:
+                self.handle_tcp(pkt)
+            elif ip.protocol == IPPROTO_UDP:
+                self.handle_udp(pkt)
+        else:
+            self.not_my_packet(pkt, intf)
+
+    def handle_ipv6(self, pkt, intf):
+        ip = IPv6Header(pkt)
+        if ip.dst in self._my_ipv6s or ip.dst in self._ipv6_groups:
+            if ip.next_header == IPPROTO_ICMPV6:
+                self.handle_icmpv6(pkt, intf)
+            elif ip.next_header == IPPROTO_TCP:
+                self.handle_tcp(pkt)
+            elif ip.next_header == IPPROTO_UDP:
+                self.handle_udp(pkt)
+        else:
+            self.not_my_packet(pkt, intf)
+
+    def handle_icmpv6(self, pkt, intf):
+        ip = IPv6Header(pkt)
+        msg = ip.payload()
+        if msg[0] in (ND_NEIGHBOR_SOLICIT, ND_NEIGHBOR_ADVERT) and \
+                ip.hop_limit != ND_HOP_LIMIT:
+            # not from a neighbor (RFC 4861, section 7.1)
+            return
+        if msg[0] == ND_NEIGHBOR_SOLICIT:
+            self.handle_neighbor_solicit(pkt, intf)
+        elif msg[0] == ND_NEIGHBOR_ADVERT:
+            self.handle_neighbor_advert(pkt, intf)
 
     def handle_tcp(self, pkt):
         pass
@@ -42,25 +176,352 @@ class Host(BaseFrameHandler):
         pass
 
     def handle_arp(self, pkt, intf):
-        pass
+        arp = ArpHeader(pkt)
+        if arp.op == ARPOP_REQUEST:
+            self.handle_arp_request(pkt, intf)
+        elif arp.op == ARPOP_REPLY:
+            self.handle_arp_response(pkt, intf)
 
     def handle_arp_response(self, pkt, intf):
-        pass
+        arp = ArpHeader(pkt)
+        self.learn_arp(arp.spa, arp.sha, intf)
 
     def handle_arp_request(self, pkt, intf):
-        pass
+        arp = ArpHeader(pkt)
+        self.learn_arp(arp.spa, arp.sha, intf)
+        if arp.tpa in self._int_to_ips[intf]:
+            mac = self._int_to_mac[intf]
+            reply = build_arp(ARPOP_REPLY, mac, arp.tpa, arp.sha, arp.spa)
+            self.send_frame(build_ethernet(arp.sha, mac, ETH_P_ARP) + reply,
+                    intf)
+
+    def learn_arp(self, ip, mac, intf):
+        '''
+        Map ip to mac in the ARP cache of intf, then send, in one batch, the
+        packets that were waiting for the mapping.
+
+        ip: bytes (packed IPv4 address)
+        mac: bytes (packed MAC address)
+        intf: str
+        '''
+
+        pending = self.arp_cache.update(intf, ip, mac, time.time())
+        if pending:
+            header = build_ethernet(mac, self._int_to_mac[intf], ETH_P_IP)
+            for pkt in pending:
+                self.send_frame(header + pkt, intf)
+
+    @classmethod
+    def _nd_option(cls, msg, opt_type):
+        '''Return the link-layer address in the option of type opt_type of
+        the Neighbor Discovery message msg, or None if there is none.'''
+
+        i = 24
+        while i + 8 <= len(msg):
+            length = msg[i + 1] << 3
+            if not length:
+                break
+            if msg[i] == opt_type:
+                return bytes(msg[i + 2:i + 8])
+            i += length
+        return None
+
+    def handle_neighbor_solicit(self, pkt, intf):
+        ip = IPv6Header(pkt)
+        msg = ip.payload()
+        target = bytes(msg[8:24])
+        if target not in self._int_to_ipv6s[intf] or not any(ip.src):
+            # not for us, or duplicate address detection, which is not
+            # supported
+            return
+        mac = self._nd_option(msg, ND_OPT_SOURCE_LINKADDR)
+        if mac is not None:
+            self.learn_neighbor(ip.src, mac, intf)
+
+        flags = ND_NA_FLAG_SOLICITED | ND_NA_FLAG_OVERRIDE
+        if self._ip_forward:
+            flags |= ND_NA_FLAG_ROUTER
+        body = struct.pack('!I', flags) + target + \
+                bytes((ND_OPT_TARGET_LINKADDR, 1)) + self._int_to_mac[intf]
+        advert = build_icmpv6(target, ip.src, ND_NEIGHBOR_ADVERT, 0, body)
+        self.send_packet_on_int(build_ipv6(target, ip.src, IPPROTO_ICMPV6,
+                advert, ND_HOP_LIMIT), intf, ip_binary_to_str(ip.src))
+
+    def handle_neighbor_advert(self, pkt, intf):
+        msg = IPv6Header(pkt).payload()
+        mac = self._nd_option(msg, ND_OPT_TARGET_LINKADDR)
+        if mac is not None:
+            self.learn_neighbor(bytes(msg[8:24]), mac, intf)
+
+    def learn_neighbor(self, ip, mac, intf):
+        '''
+        Map ip to mac in the neighbor cache of intf, then send, in one batch,
+        the packets that were waiting for the mapping.
+
+        ip: bytes (packed IPv6 address)
+        mac: bytes (packed MAC address)
+        intf: str
+        '''
+
+        pending = self.nd_cache.update(intf, ip, mac, time.time())
+        if pending:
+            header = build_ethernet(mac, self._int_to_mac[intf], ETH_P_IPV6)
+            for pkt in pending:
+                self.send_frame(header + pkt, intf)
+
+    def send_neighbor_solicit(self, intf, ip):
+        '''
+        Send a Neighbor Solicitation for ip on intf, to its solicited-node
+        multicast address.
+
+        intf: str
+        ip: bytes (packed IPv6 address)
+        '''
+
+        ips = self._int_to_ipv6s[intf]
+        if not ips:
+            return
+        mac = self._int_to_mac[intf]
+        dst = solicited_node(ip)
+        body = bytes(4) + ip + bytes((ND_OPT_SOURCE_LINKADDR, 1)) + mac
+        solicit = build_icmpv6(ips[0], dst, ND_NEIGHBOR_SOLICIT, 0, body)
+        self.send_frame(build_ethernet(ipv6_multicast_mac(dst), mac,
+                ETH_P_IPV6) + build_ipv6(ips[0], dst, IPPROTO_ICMPV6, solicit,
+                ND_HOP_LIMIT), intf)
+
+    def send_arp_request(self, intf, ip):
+        '''
+        Broadcast an ARP request for ip on intf.
+
+        intf: str
+        ip: bytes (packed IPv4 address)
+        '''
+
+        mac = self._int_to_mac[intf]
+        ips = self._int_to_ips[intf]
+        request = build_arp(ARPOP_REQUEST, mac, ips[0] if ips else bytes(4),
+                ZERO_MAC, ip)
+        self.send_frame(build_ethernet(BROADCAST_MAC, mac, ETH_P_ARP) + request,
+                intf)
 
     def send_packet_on_int(self, pkt, intf, next_hop):
-        print(f'Attempting to send packet on {intf} with next hop {next_hop}:\n{repr(pkt)}')
+        next_hop = ip_str_to_binary(next_hop)
+        now = time.time()
+        if len(next_hop) == 16:
+            cache, ethertype = self.nd_cache, ETH_P_IPV6
+        else:
+            cache, ethertype = self.arp_cache, ETH_P_IP
+        mac = cache.lookup(intf, next_hop, now)
+        if mac is not None:
+            self.send_frame(build_ethernet(mac, self._int_to_mac[intf],
+                    ethertype) + pkt, intf)
+        elif cache.enqueue(intf, next_hop, bytes(pkt), now):
+            if ethertype == ETH_P_IPV6:
+                self.send_neighbor_solicit(intf, next_hop)
+            else:
+                self.send_arp_request(intf, next_hop)
 
     def send_packet(self, pkt):
-        print(f'Attempting to send packet:\n{repr(pkt)}')
+        if pkt[0] >> 4 == 6:
+            dst = pkt[24:40]
+        else:
+            dst = pkt[16:20]
+        intf, next_hop = self.forwarding_table.get_entry(dst)
+        if intf is None:
+            self.drop(pkt, 'no_route')
+            return
+        if next_hop is None:
+            next_hop = ip_binary_to_str(dst)
+        self.send_packet_on_int(pkt, intf, next_hop)
 
-    def forward_packet(self, pkt):
-        pass
+    def forward_packet(self, pkt, intf=None):
+        '''
+        Forward an IPv4 packet that is not destined for this host.  The TTL
+        and header checksum are updated in place in a single copy of the
+        packet; if the TTL would reach 0, the packet is dropped and an ICMP
+        Time Exceeded message is sent back to its source instead.  IPv6
+        packets are handed to forward_ipv6_packet().
+
+        pkt: bytes (or other buffer) containing the IPv4 packet
+        intf: str (the interface on which the packet arrived)
+        '''
+
+        if pkt[0] >> 4 == 6:
+            self.forward_ipv6_packet(pkt, intf)
+            return
+
+        if pkt[8] <= 1:
+            self.drop(pkt, 'ttl_exceeded')
+            self.send_time_exceeded(pkt, intf)
+            return
+        pkt = bytearray(pkt)
+        decrement_ttl(pkt)
+        self.send_packet(pkt)
+
+    def forward_ipv6_packet(self, pkt, intf=None):
+        '''
+        Forward an IPv6 packet that is not destined for this host, as with
+        forward_packet().  IPv6 has no header checksum, so only the hop limit
+        is decremented.  Packets to multicast addresses, or to or from
+        link-local addresses, are not forwarded.
+
+        pkt: bytes (or other buffer) containing the IPv6 packet
+        intf: str (the interface on which the packet arrived)
+        '''
+
+        if pkt[24] == 0xff or (pkt[24] == 0xfe and pkt[25] & 0xc0 == 0x80) \
+                or (pkt[8] == 0xfe and pkt[9] & 0xc0 == 0x80):
+            self.drop(pkt, 'link_local')
+            return
+        if pkt[7] <= 1:
+            self.drop(pkt, 'ttl_exceeded')
+            self.send_time_exceeded(pkt, intf)
+            return
+        pkt = bytearray(pkt)
+        pkt[7] -= 1
+        self.send_packet(pkt)
+
+    def send_time_exceeded(self, pkt, intf):
+        '''
+        Send an ICMP Time Exceeded message to the source of pkt, quoting its
+        header and the first 8 bytes of its payload, unless pkt is itself an
+        ICMP error, or a fragment other than the first (RFC 1812, Section
+        4.3.2.7).
+
+        pkt: bytes (or other buffer) containing the IPv4 packet
+        intf: str (the interface on which the packet arrived)
+        '''
+
+        if is_icmp_error(pkt):
+            return
+        if pkt[0] >> 4 == 6:
+            self.send_time_exceeded_ipv6(pkt, intf)
+            return
+        if pkt[6] & 0x1f or pkt[7]:
+            return
+
+        if intf is None or not self.int_to_info[intf].ipv4_addrs:
+            intf = self.get_first_interface()
+        src = ip_str_to_binary(self.int_to_info[intf].ipv4_addrs[0])
+        ip = IPv4Header(pkt)
+        quoted = bytes(pkt[:ip.header_len + 8])
+        icmp = build_icmp(ICMP_TIME_EXCEEDED, ICMP_EXC_TTL, bytes(4), quoted)
+        self.send_packet(build_ipv4(src, ip.src, IPPROTO_ICMP, icmp))
+
+    def send_time_exceeded_ipv6(self, pkt, intf):
+        '''
+        Send an ICMPv6 Time Exceeded message to the source of pkt, quoting as
+        much of it as fits in the minimum IPv6 MTU.
+
+        pkt: bytes (or other buffer) containing the IPv6 packet
+        intf: str (the interface on which the packet arrived)
+        '''
+
+        if intf is None or not self._int_to_ipv6s[intf]:
+            intf = next((i for i in self._int_to_ipv6s \
+                    if self._int_to_ipv6s[i]), None)
+            if intf is None:
+                return
+        src = self._int_to_ipv6s[intf][0]
+        dst = bytes(pkt[8:24])
+        quoted = bytes(pkt[:ICMP6_MAX_QUOTE])
+        icmp = build_icmpv6(src, dst, ICMP6_TIME_EXCEEDED,
+                ICMP6_TIME_EXCEED_TRANSIT, bytes(4) + quoted)
+        self.send_packet(build_ipv6(src, dst, IPPROTO_ICMPV6, icmp))
+
+    def flush_frames(self):
+        if self.forwarding_pool is not None:
+            self.forwarding_pool.flush()
+            if self.forwarding_pool.has_results():
+                # read by flush(), rather than when a connection was readable
+                self.handle_forwarding_results([])
+        super(Host, self).flush_frames()
+
+    def handle_forwarding_results(self, conns=None, timeout=0):
+        '''
+        Send the frames that the forwarding workers are done with.
+
+        conns: list of connections from which to read results (by default,
+        those that are ready within timeout)
+        timeout: int or float
+        '''
+
+        now = time.time()
+        lookup = self.arp_cache.lookup
+        for status, frame, intf, next_hop in \
+                self.forwarding_pool.receive(conns, timeout):
+            if status == FORWARD:
+                mac = lookup(intf, next_hop, now)
+                if mac is None:
+                    self.send_packet_on_int(frame[ETH_HLEN:], intf,
+                            ip_binary_to_str(next_hop))
+                else:
+                    frame[:6] = mac
+                    self.send_frame(frame, intf)
+            elif status == TTL_EXCEEDED:
+                pkt = memoryview(frame)[ETH_HLEN:]
+                self.drop(pkt, 'ttl_exceeded')
+                self.send_time_exceeded(pkt, intf)
+            else:
+                self.drop(memoryview(frame)[ETH_HLEN:], 'no_route')
 
     def not_my_frame(self, frame, intf):
         pass
 
     def not_my_packet(self, pkt, intf):
+        if not self._ip_forward:
+            self.drop(pkt, 'not_forwarding')
+            return
+        self.forward_packet(pkt, intf)
+
+    def drop(self, pkt, reason):
+        '''Called when pkt is dropped for the given reason (a str).  This
+        does nothing, unless stats are enabled.'''
         pass
+
+    def enable_stats(self, stats):
+        '''
+        Instrument this host's receive, forwarding, ARP and send paths with
+        stats.  This must be called before the event loop is created, since
+        it wraps _handle_frame().
+
+        stats: Stats instance
+        '''
+
+        for name, intf_arg in (('_handle_frame', 1), ('handle_ip', 1),
+                ('handle_ipv6', 1), ('handle_arp', 1), ('not_my_frame', 1),
+                ('forward_packet', None), ('send_time_exceeded', None),
+                ('send_packet_on_int', 1), ('send_arp_request', 0),
+                ('send_neighbor_solicit', 0), ('send_frame', 1)):
+            stats.instrument(self, name, intf_arg=intf_arg)
+        stats.instrument(self.arp_cache, 'enqueue', label='arp_miss')
+        stats.instrument(self.nd_cache, 'enqueue', label='nd_miss')
+        self.drop = lambda pkt, reason: stats.count('drop.' + reason)
+        stats.gauge('arp_entries', lambda: len(self.arp_cache))
+        stats.gauge('arp_queue_drops', lambda: self.arp_cache.dropped)
+        stats.gauge('nd_entries', lambda: len(self.nd_cache))
+        stats.gauge('nd_queue_drops', lambda: self.nd_cache.dropped)
+
+    def age_arp_cache(self, event_loop):
+        '''Expire ARP and neighbor cache entries, resend the ARP requests
+        and Neighbor Solicitations that are due, then schedule the next aging
+        pass.'''
+        now = time.time()
+        for intf, ip in self.arp_cache.expire(now):
+            self.send_arp_request(intf, ip)
+        for intf, ip in self.nd_cache.expire(now):
+            self.send_neighbor_solicit(intf, ip)
+        event_loop.schedule_event(ARP_AGING_INTERVAL,
+                self.age_arp_cache, (event_loop,))
+
+    def schedule_items(self, event_loop):
+        event_loop.schedule_event(ARP_AGING_INTERVAL,
+                self.age_arp_cache, (event_loop,))
+
+        if self.forwarding_pool is None:
+            return
+        # Results are handled as soon as a worker's connection is readable,
+        # which requires BatchedEventLoop or AsyncioEventLoop.
+        for conn in self.forwarding_pool.connections():
+            event_loop.register(conn,
+                    lambda conn=conn: self.handle_forwarding_results([conn]))
@@ -0,0 +1,120 @@
+'''
+Pre-serialized packets for traffic generators.  An `EchoTemplate` builds an
+ICMP echo request (optionally in an Ethernet frame) once, and each call to
+`build()` patches only the fields that change from one probe to the next --
+destination address and MAC address, identifier, sequence number and TTL --
+into the same buffer.  The IPv4 header and ICMP checksums are completed from
+partial sums over the fields that never change, so the rest of the packet is
+neither rebuilt nor summed again.
+
+>>> from headers import internet_checksum
+>>> template = EchoTemplate(b'\\x0a\\x00\\x00\\x02', b'0123456789')
+>>> pkt = template.build(b'\\x0a\\x14\\x00\\x19', 1, 2, ttl=3)
+>>> pkt == build_ipv4(b'\\x0a\\x00\\x00\\x02', b'\\x0a\\x14\\x00\\x19', IPPROTO_ICMP,
+...         build_icmp(ICMP_ECHO, 0, b'\\x00\\x01\\x00\\x02', b'0123456789'), ttl=3)
+True
+>>> internet_checksum(pkt[:20]), internet_checksum(pkt[20:])
+(0, 0)
+
+>>> template = EchoTemplate(b'\\x0a\\x00\\x00\\x02', b'', src_mac=b'\\x00\\x00\\x00\\xaa\\xaa\\xaa')
+>>> frame = template.build(b'\\x0a\\x00\\x00\\x03', 7, 65535, dst_mac=b'\\xff' * 6)
+>>> len(frame), frame[:6], frame[12:14]
+(42, b'\\xff\\xff\\xff\\xff\\xff\\xff', b'\\x08\\x00')
+>>> internet_checksum(frame[14:34]), internet_checksum(frame[34:])
+(0, 0)
+'''
+
+import struct
+
+from headers import ETH_P_IP, ICMP_ECHO, build_ethernet, build_icmp, \
+        build_ipv4
+
+#From /usr/include/linux/in.h:
+IPPROTO_ICMP = 1 # Internet Control Message Protocol
+
+def _sum(data):
+    '''Return the one's complement sum of the 16-bit words of data, without
+    folding the carries.'''
+    if len(data) & 1:
+        data = bytes(data) + b'\x00'
+    return sum(struct.unpack('!%dH' % (len(data) >> 1), data))
+
+def _checksum(total):
+    total = (total & 0xffff) + (total >> 16)
+    total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+class EchoTemplate(object):
+    def __init__(self, src, data=b'', src_mac=None, ttl=64):
+        '''
+        Serialize an ICMP echo request from src with payload data.  If
+        src_mac is given, the packet is built in an Ethernet frame from
+        src_mac, and build() requires the destination MAC address.
+
+        src: bytes (4-byte IPv4 address)
+        data: bytes
+        src_mac: bytes
+        ttl: int (default TTL)
+        '''
+
+        icmp = build_icmp(ICMP_ECHO, 0, bytes(4), data)
+        pkt = build_ipv4(src, bytes(4), IPPROTO_ICMP, icmp, ttl)
+        if src_mac is None:
+            self._ip = 0
+            buf = bytearray(pkt)
+        else:
+            self._ip = 14
+            buf = bytearray(build_ethernet(bytes(6), src_mac, ETH_P_IP) + pkt)
+        self._icmp = self._ip + 20
+        self._buf = buf
+        self.ttl = ttl
+
+        # partial sums over the fields that build() does not change; the
+        # variable fields (TTL, checksums, destination, identifier and
+        # sequence number) are zero in the buffer at this point
+        ip = self._ip
+        buf[ip + 8] = 0
+        buf[ip + 10:ip + 12] = b'\x00\x00'
+        self._ip_sum = _sum(buf[ip:ip + 20])
+        icmp = self._icmp
+        buf[icmp + 2:icmp + 4] = b'\x00\x00'
+        self._icmp_sum = _sum(buf[icmp:])
+
+    def build(self, dst, id, seq, ttl=None, dst_mac=None):
+        '''
+        Return the echo request to dst with the given identifier and sequence
+        number.
+
+        dst: bytes (4-byte IPv4 address)
+        id: int
+        seq: int
+        ttl: int (by default, the TTL given to the constructor)
+        dst_mac: bytes (required if the template is a frame)
+        '''
+
+        buf = self._buf
+        ip = self._ip
+        icmp = self._icmp
+        if ttl is None:
+            ttl = self.ttl
+
+        if ip:
+            buf[:6] = dst_mac
+        buf[ip + 8] = ttl
+        buf[ip + 16:ip + 20] = dst
+        checksum = _checksum(self._ip_sum + (ttl << 8) +
+                (dst[0] << 8 | dst[1]) + (dst[2] << 8 | dst[3]))
+        buf[ip + 10] = checksum >> 8
+        buf[ip + 11] = checksum & 0xff
+
+        buf[icmp + 4] = id >> 8
+        buf[icmp + 5] = id & 0xff
+        buf[icmp + 6] = seq >> 8
+        buf[icmp + 7] = seq & 0xff
+        checksum = _checksum(self._icmp_sum + id + seq)
+        buf[icmp + 2] = checksum >> 8
+        buf[icmp + 3] = checksum & 0xff
+
+        # a copy, since the frame might be queued (see batch_io) while the
+        # buffer is patched for the next one
+        return bytes(buf)
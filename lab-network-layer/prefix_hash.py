@@ -0,0 +1,275 @@
+'''
+Longest prefix match by binary search on prefix lengths (Waldvogel et al.,
+"Scalable High Speed IP Routing Lookups"), for IPv6.  There is one hash table
+(dict) per distinct prefix length, keyed by the prefix bits.  A lookup does a
+binary search over the lengths: a hit at a length means that the match is at
+least that long, so the search continues among the longer lengths;
+otherwise, it continues among the shorter ones.  A lookup therefore probes
+about log2(number of distinct lengths) tables, rather than following a trie
+path of up to 128 bits.
+
+For the search to find longer prefixes, each prefix leaves a marker at every
+shorter length where the search moves on to longer lengths on the way to it.
+Every table slot, marker or prefix, stores the entry of the longest prefix
+matching its bits (its "best matching prefix"), so the last hit of the search
+gives the result, even if the markers followed lead to no longer match.
+
+The table is built from the routes held in a `PrefixTrie`, and is patched as
+routes are added and removed, unless the set of distinct lengths changes, in
+which case it is rebuilt.  The tables of each length are shared with copies
+of the table (see copy()) until either one changes them.
+
+>>> from prefix_trie import PrefixTrie
+>>> trie = PrefixTrie(128)
+>>> table = PrefixHash(trie)
+>>> for key, prefix_len, entry in ((0x20010db8 << 96, 32, 'a'),
+...         (0x20010db8000100 << 72, 56, 'b'), (0x20010db80001 << 80, 48, 'c'),
+...         (0, 0, 'k')):
+...     trie.insert(key, prefix_len, entry)
+...     table.add(key, prefix_len, entry)
+>>> table.lookup(0x20010db8000100ff << 64), table.lookup(0x20010db80001ff << 72)
+('b', 'c')
+>>> table.lookup(0x20010db80002 << 80), table.lookup(0x20010db9 << 96)
+('a', 'k')
+>>> trie.remove(0x20010db80001 << 80, 48)
+True
+>>> table.remove(0x20010db80001 << 80, 48)
+>>> table.lookup(0x20010db8000100ff << 64), table.lookup(0x20010db80001ff << 72)
+('b', 'a')
+>>> table.lengths()
+[0, 32, 56]
+
+A copy shares the tables of the lengths that neither has changed since:
+>>> trie2 = trie.copy()
+>>> table2 = table.copy(trie2)
+>>> trie2.insert(0x20010db80002 << 80 | 1 << 72, 56, 'd')
+>>> table2.add(0x20010db80002 << 80 | 1 << 72, 56, 'd')
+>>> table.lookup(0x20010db8000201 << 72), table2.lookup(0x20010db8000201 << 72)
+('a', 'd')
+>>> [t1 is t2 for t1, t2 in zip(table._tables, table2._tables)]
+[True, False, False]
+'''
+
+_MISSING = object()
+
+class PrefixHash(object):
+    def __init__(self, trie):
+        '''
+        Instantiate a table for the routes in trie, which must be kept in sync
+        with the table by calling add() after each insertion into the trie
+        and remove() after each removal from it.  The values in the trie must
+        not be None.
+
+        trie: PrefixTrie instance
+        '''
+
+        self._trie = trie
+        self._rebuild()
+
+    def _rebuild(self):
+        '''Rebuild the tables from the routes in the trie.'''
+
+        address_len = self._trie.address_len
+        items = list(self._trie.items())
+        self._lengths = sorted({prefix_len for key, prefix_len, v in items})
+        self._level = dict((prefix_len, i) \
+                for i, prefix_len in enumerate(self._lengths))
+        self._shifts = [address_len - prefix_len \
+                for prefix_len in self._lengths]
+        self._markers = [self._marker_levels(i) \
+                for i in range(len(self._lengths))]
+
+        # per level: the table, the bits of the routes, and, for each bits
+        # that is a marker, the number of routes that need it, along with the
+        # token of the only table that may change them in place
+        self._owner = object()
+        self._tables = [{} for prefix_len in self._lengths]
+        self._routes = [set() for prefix_len in self._lengths]
+        self._refs = [{} for prefix_len in self._lengths]
+        self._owners = [self._owner] * len(self._lengths)
+        for key, prefix_len, value in items:
+            level = self._level[prefix_len]
+            bits = key >> self._shifts[level]
+            self._tables[level][bits] = value
+            self._routes[level].add(bits)
+        for key, prefix_len, value in items:
+            for level in self._markers[self._level[prefix_len]]:
+                self._add_marker(level, key)
+
+    def copy(self, trie):
+        '''
+        Return a copy of the table, kept in sync with trie, which must hold
+        the same routes as the trie of this table (e.g., a copy of it).  The
+        tables of each length are shared, and copied by whichever table next
+        changes them, so the copy takes time in the number of distinct
+        lengths, rather than of routes.
+
+        trie: PrefixTrie instance
+        '''
+
+        table = self.__class__.__new__(self.__class__)
+        table._trie = trie
+        # the search shape is only ever replaced, not changed, so it can be
+        # shared
+        table._lengths = self._lengths
+        table._level = self._level
+        table._shifts = self._shifts
+        table._markers = self._markers
+        table._owner = object()
+        table._tables = list(self._tables)
+        table._routes = list(self._routes)
+        table._refs = list(self._refs)
+        table._owners = list(self._owners)
+        # the levels that exist now are shared by both tables
+        self._owner = object()
+        return table
+
+    def _own(self, level):
+        '''Copy the tables of level first if they are shared with another
+        table, so that this one may change them.'''
+
+        if self._owners[level] is not self._owner:
+            self._tables[level] = self._tables[level].copy()
+            self._routes[level] = set(self._routes[level])
+            self._refs[level] = dict(self._refs[level])
+            self._owners[level] = self._owner
+
+    def _marker_levels(self, level):
+        '''Return the levels at which the search for a prefix at level
+        moves on to longer lengths, and so needs a marker.'''
+
+        levels = []
+        lo, hi = 0, len(self._lengths) - 1
+        while lo <= hi:
+            mid = (lo + hi) >> 1
+            if mid == level:
+                break
+            if mid < level:
+                levels.append(mid)
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        return levels
+
+    def _best_match(self, level, key):
+        '''Return the entry for the longest prefix, no longer than the
+        length at level, matching key.'''
+        return self._trie.lookup(key, self._lengths[level])
+
+    def _add_marker(self, level, key):
+        self._own(level)
+        bits = key >> self._shifts[level]
+        refs = self._refs[level]
+        refs[bits] = refs.get(bits, 0) + 1
+        if bits not in self._tables[level]:
+            self._tables[level][bits] = self._best_match(level, key)
+
+    def _remove_marker(self, level, key):
+        self._own(level)
+        bits = key >> self._shifts[level]
+        refs = self._refs[level]
+        refs[bits] -= 1
+        if not refs[bits]:
+            del refs[bits]
+            if bits not in self._routes[level]:
+                del self._tables[level][bits]
+
+    def _update_markers(self, key, prefix_len):
+        '''Refresh the best matching prefix of the markers, longer than
+        prefix_len, left by the routes within the given prefix.'''
+
+        for k, l, value in self._trie.items(key, prefix_len):
+            if l == prefix_len:
+                continue
+            for level in self._markers[self._level[l]]:
+                if self._lengths[level] <= prefix_len:
+                    continue
+                bits = k >> self._shifts[level]
+                if bits in self._routes[level]:
+                    continue
+                best = self._best_match(level, k)
+                if self._tables[level].get(bits, _MISSING) is not best:
+                    self._own(level)
+                    self._tables[level][bits] = best
+
+    def add(self, key, prefix_len, value):
+        '''
+        Add (or replace) the route for the given prefix.
+
+        key: int
+        prefix_len: int
+        '''
+
+        key &= ((1 << prefix_len) - 1) << (self._trie.address_len - prefix_len)
+        level = self._level.get(prefix_len)
+        if level is None:
+            # a new length changes the shape of the search
+            self._rebuild()
+            return
+
+        self._own(level)
+        bits = key >> self._shifts[level]
+        self._tables[level][bits] = value
+        if bits not in self._routes[level]:
+            self._routes[level].add(bits)
+            for marker_level in self._markers[level]:
+                self._add_marker(marker_level, key)
+        self._update_markers(key, prefix_len)
+
+    def remove(self, key, prefix_len):
+        '''
+        Remove the route for the given prefix, which must already have been
+        removed from the trie.
+
+        key: int
+        prefix_len: int
+        '''
+
+        key &= ((1 << prefix_len) - 1) << (self._trie.address_len - prefix_len)
+        level = self._level.get(prefix_len)
+        if level is None:
+            return
+        bits = key >> self._shifts[level]
+        if bits not in self._routes[level]:
+            return
+        if len(self._routes[level]) == 1:
+            # the last route of this length
+            self._rebuild()
+            return
+
+        self._own(level)
+        self._routes[level].remove(bits)
+        if bits in self._refs[level]:
+            # still needed as a marker
+            self._tables[level][bits] = self._best_match(level, key)
+        else:
+            del self._tables[level][bits]
+        for marker_level in self._markers[level]:
+            self._remove_marker(marker_level, key)
+        self._update_markers(key, prefix_len)
+
+    def lookup(self, address):
+        '''
+        Return the entry for the longest prefix matching address, or None if
+        no prefix matches.
+
+        address: int
+        '''
+
+        tables = self._tables
+        shifts = self._shifts
+        best = None
+        lo, hi = 0, len(tables) - 1
+        while lo <= hi:
+            mid = (lo + hi) >> 1
+            value = tables[mid].get(address >> shifts[mid], _MISSING)
+            if value is _MISSING:
+                hi = mid - 1
+            else:
+                best = value
+                lo = mid + 1
+        return best
+
+    def lengths(self):
+        '''Return the distinct prefix lengths of the routes, in order.'''
+        return list(self._lengths)
@@ -0,0 +1,393 @@
+'''
+A path-compressed binary (Patricia) trie mapping IP prefixes to values.
+Prefixes and addresses are represented as ints, as with `IPAddress.address`,
+and the trie is created for a fixed address length (32 for IPv4, 128 for
+IPv6).  Lookups visit at most one node per distinct prefix length on the path
+to the address, so their cost is bounded by the address length rather than by
+the number of prefixes in the trie.
+
+>>> trie = PrefixTrie(32)
+>>> trie.insert(0x0a140000, 23, 'c')
+>>> trie.insert(0x0a140000, 24, 'd')
+>>> trie.insert(0x00000000, 0, 'k')
+>>> trie.lookup(0x0a140019)
+'d'
+>>> trie.lookup(0x0a140114)
+'c'
+>>> trie.lookup(0x0a140301)
+'k'
+>>> trie.remove(0x0a140000, 24)
+True
+>>> trie.lookup(0x0a140019)
+'c'
+>>> trie.remove(0x0a140000, 24)
+False
+>>> len(trie)
+2
+>>> [(hex(key), prefix_len, value) for key, prefix_len, value in trie.items()]
+[('0x0', 0, 'k'), ('0xa140000', 23, 'c')]
+
+A copy shares its nodes with the original until either is changed:
+>>> trie2 = trie.copy()
+>>> trie2.insert(0x0a140000, 24, 'd')
+>>> trie2.remove(0x00000000, 0)
+True
+>>> trie.lookup(0x0a140019), trie2.lookup(0x0a140019), trie2.lookup(0x0a140301)
+('c', 'd', None)
+'''
+
+import bisect
+
+class _Node(object):
+    __slots__ = ('key', 'prefix_len', 'value', 'is_route', 'children',
+            'owner')
+
+    def __init__(self, key, prefix_len, owner=None):
+        self.key = key
+        self.prefix_len = prefix_len
+        self.value = None
+        self.is_route = False
+        self.children = [None, None]
+        # the token of the only trie that may change this node in place
+        self.owner = owner
+
+class PrefixTrie(object):
+    def __init__(self, address_len):
+        '''
+        Instantiate an empty trie for addresses of the given length.
+
+        address_len: int (32 or 128)
+        '''
+        self.address_len = address_len
+        self._owner = object()
+        self._root = _Node(0, 0, self._owner)
+        self._count = 0
+
+    @classmethod
+    def build(cls, address_len, items):
+        '''
+        Return a new trie holding the given prefixes, built in one pass over
+        them in sorted order, rather than by inserting them one at a time.
+        If a prefix is given more than once, the last value given is used.
+
+        address_len: int (32 or 128)
+        items: iterable of (key, prefix_len, value) tuples
+        '''
+
+        trie = cls(address_len)
+        routes = {}
+        for key, prefix_len, value in items:
+            routes[(key & trie._mask(prefix_len), prefix_len)] = value
+        if not routes:
+            return trie
+        keys = sorted(routes)
+        # (key, prefix_len) pairs sort into the same order that items()
+        # generates them, so every subtrie is a contiguous run of keys
+        node = trie._build(keys, routes, 0, len(keys))
+        if node.prefix_len == 0:
+            trie._root = node
+        else:
+            trie._root.children[trie._bit(node.key, 0)] = node
+        trie._count = len(keys)
+        return trie
+
+    def _build(self, keys, routes, lo, hi):
+        '''Return the root of a subtrie holding the prefixes keys[lo:hi].'''
+
+        first_key, first_len = keys[lo]
+        last_key, last_len = keys[hi - 1]
+        common = self._common_len(first_key, first_len, last_key, last_len)
+
+        node = _Node(first_key & self._mask(common), common, self._owner)
+        if first_len == common:
+            node.is_route = True
+            node.value = routes[keys[lo]]
+            lo += 1
+        if lo < hi:
+            # prefixes with a 1 at bit position `common` follow those with a 0
+            split = bisect.bisect_left(keys,
+                    (node.key | (1 << (self.address_len - 1 - common)), 0),
+                    lo, hi)
+            if split > lo:
+                node.children[0] = self._build(keys, routes, lo, split)
+            if split < hi:
+                node.children[1] = self._build(keys, routes, split, hi)
+        return node
+
+    def __len__(self):
+        return self._count
+
+    def copy(self):
+        '''
+        Return a copy of the trie, in constant time.  The two tries share
+        their nodes, and each copies a node (and the path to it) the first
+        time it changes it, so that changes to either are not seen by the
+        other, and lookups in either are never affected by changes to the
+        other.
+        '''
+
+        trie = self.__class__(self.address_len)
+        trie._root = self._root
+        trie._count = self._count
+        # the nodes that exist now are shared by both tries
+        self._owner = object()
+        return trie
+
+    def _own(self, node):
+        '''Return node, or a copy of it that this trie may change, if it is
+        shared with another trie.'''
+
+        if node.owner is self._owner:
+            return node
+        new = _Node(node.key, node.prefix_len, self._owner)
+        new.value = node.value
+        new.is_route = node.is_route
+        new.children = list(node.children)
+        return new
+
+    def _bit(self, key, i):
+        '''Return bit i of key, where bit 0 is the most significant bit.'''
+        return (key >> (self.address_len - 1 - i)) & 1
+
+    def _mask(self, prefix_len):
+        return ((1 << prefix_len) - 1) << (self.address_len - prefix_len)
+
+    def _common_len(self, key1, len1, key2, len2):
+        '''Return the length of the common prefix of two prefixes.'''
+        limit = min(len1, len2)
+        diff = key1 ^ key2
+        if diff == 0:
+            return limit
+        return min(limit, self.address_len - diff.bit_length())
+
+    def insert(self, key, prefix_len, value):
+        '''
+        Map the prefix having the most significant prefix_len bits of key to
+        value, replacing any value previously associated with the prefix.
+
+        key: int
+        prefix_len: int
+        '''
+
+        key &= self._mask(prefix_len)
+        node = self._root = self._own(self._root)
+        while True:
+            if node.prefix_len == prefix_len:
+                if not node.is_route:
+                    node.is_route = True
+                    self._count += 1
+                node.value = value
+                return
+
+            b = self._bit(key, node.prefix_len)
+            child = node.children[b]
+            if child is None:
+                new = _Node(key, prefix_len, self._owner)
+                new.value = value
+                new.is_route = True
+                node.children[b] = new
+                self._count += 1
+                return
+
+            common = self._common_len(key, prefix_len,
+                    child.key, child.prefix_len)
+            if common == child.prefix_len:
+                # child is a prefix of the new prefix; keep descending
+                child = node.children[b] = self._own(child)
+                node = child
+                continue
+
+            new = _Node(key, prefix_len, self._owner)
+            new.value = value
+            new.is_route = True
+            self._count += 1
+            if common == prefix_len:
+                # the new prefix is a prefix of child; insert it in between
+                new.children[self._bit(child.key, prefix_len)] = child
+                node.children[b] = new
+            else:
+                # the prefixes diverge; join them under a glue node
+                glue = _Node(key & self._mask(common), common, self._owner)
+                glue.children[self._bit(key, common)] = new
+                glue.children[self._bit(child.key, common)] = child
+                node.children[b] = glue
+            return
+
+    def _find(self, key, prefix_len):
+        '''Return the path of nodes from the root to the node matching the
+        prefix exactly, or None if there is no such node.'''
+
+        path = [self._root]
+        node = self._root
+        while node.prefix_len < prefix_len:
+            node = node.children[self._bit(key, node.prefix_len)]
+            if node is None or node.prefix_len > prefix_len or \
+                    (key ^ node.key) & self._mask(node.prefix_len):
+                return None
+            path.append(node)
+        if node.prefix_len != prefix_len:
+            return None
+        return path
+
+    def get(self, key, prefix_len):
+        '''
+        Return the value associated with exactly the given prefix, or None if
+        there is no such prefix.
+
+        key: int
+        prefix_len: int
+        '''
+
+        path = self._find(key & self._mask(prefix_len), prefix_len)
+        if path is None or not path[-1].is_route:
+            return None
+        return path[-1].value
+
+    def remove(self, key, prefix_len):
+        '''
+        Remove the prefix having the most significant prefix_len bits of key.
+        Return True if the prefix was found, False otherwise.
+
+        key: int
+        prefix_len: int
+        '''
+
+        path = self._find(key & self._mask(prefix_len), prefix_len)
+        if path is None or not path[-1].is_route:
+            return False
+
+        path[0] = self._root = self._own(self._root)
+        for i in range(1, len(path)):
+            node = self._own(path[i])
+            if node is not path[i]:
+                parent = path[i - 1]
+                parent.children[parent.children.index(path[i])] = node
+                path[i] = node
+
+        node = path[-1]
+        node.is_route = False
+        node.value = None
+        self._count -= 1
+
+        # Collapse nodes that no longer hold a route and no longer join two
+        # subtries, working back towards the root (which is never removed).
+        while len(path) > 1:
+            node = path.pop()
+            if node.is_route:
+                break
+            children = [c for c in node.children if c is not None]
+            if len(children) == 2:
+                break
+            parent = path[-1]
+            i = parent.children.index(node)
+            parent.children[i] = children[0] if children else None
+        return True
+
+    def lookup(self, address, max_len=None):
+        '''
+        Return the value associated with the longest prefix matching address,
+        or None if no prefix matches.  If max_len is specified, only prefixes
+        having length at most max_len are considered.
+
+        address: int
+        max_len: int
+        '''
+
+        match = self.longest_match(address, max_len)
+        if match is None:
+            return None
+        return match[1]
+
+    def longest_match(self, address, max_len=None):
+        '''
+        Return a (prefix_len, value) tuple for the longest prefix matching
+        address, or None if no prefix matches.  If max_len is specified, only
+        prefixes having length at most max_len are considered.
+
+        address: int
+        max_len: int
+        '''
+
+        address_len = self.address_len
+        if max_len is None:
+            max_len = address_len
+        best = None
+        node = self._root
+        while node is not None:
+            prefix_len = node.prefix_len
+            if prefix_len > max_len or \
+                    (address ^ node.key) >> (address_len - prefix_len):
+                break
+            if node.is_route:
+                best = node
+            if prefix_len == address_len:
+                break
+            node = node.children[(address >> (address_len - 1 - prefix_len)) & 1]
+        if best is None:
+            return None
+        return best.prefix_len, best.value
+
+    def items(self, key=0, prefix_len=0):
+        '''
+        Generate a (key, prefix_len, value) tuple for every prefix in the trie
+        that is contained in (or equal to) the prefix having the most
+        significant prefix_len bits of key -- by default, every prefix.
+        Prefixes are generated in address order, with shorter prefixes
+        preceding longer ones that they contain.
+
+        key: int
+        prefix_len: int
+        '''
+
+        key &= self._mask(prefix_len)
+        node = self._root
+        while node is not None and node.prefix_len < prefix_len:
+            node = node.children[self._bit(key, node.prefix_len)]
+        if node is None or (key ^ node.key) & self._mask(prefix_len):
+            return
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.is_route:
+                yield node.key, node.prefix_len, node.value
+            for child in reversed(node.children):
+                if child is not None:
+                    stack.append(child)
+
+    def intervals(self):
+        '''
+        Return a list of (start, value) tuples that divides the address space
+        into runs of consecutive addresses having the same longest prefix
+        match, in order, with the value of the longest matching prefix (or
+        None, if no prefix matches) for every address from start up to the
+        start of the next run.  The first run starts at 0.
+        '''
+
+        end_of_space = 1 << self.address_len
+        runs = [(0, None)]
+
+        def emit(start, value):
+            if start >= end_of_space:
+                return
+            if start == runs[-1][0]:
+                runs[-1] = (start, value)
+                if len(runs) > 1 and runs[-2][1] == value:
+                    runs.pop()
+            elif runs[-1][1] != value:
+                runs.append((start, value))
+
+        # Prefixes are visited in address order, with covering prefixes
+        # before the prefixes they contain, so a stack of the prefixes that
+        # contain the current one tells which value resumes after each ends.
+        stack = [(end_of_space, None)]
+        for key, prefix_len, value in self.items():
+            while stack[-1][0] <= key:
+                end, _ = stack.pop()
+                emit(end, stack[-1][1])
+            emit(key, value)
+            stack.append((key + (1 << (self.address_len - prefix_len)), value))
+        while len(stack) > 1:
+            end, _ = stack.pop()
+            emit(end, stack[-1][1])
+        return runs
@@ -0,0 +1,170 @@
+'''
+A bounded least-recently-used cache of forwarding table lookups, keyed by
+destination address.  Like the lookups of a forwarding table, the cache may be
+used by several threads at once, without a lock: a result evicted by another
+thread just as it is found counts as a miss, and the counters are
+approximate.
+
+A cache can outlive the versions of a forwarding table that fill it.  When a
+new version is built, advance() starts a new generation, and the results that
+the changes affect are invalidated; from then on, put() drops results looked
+up in an older version (see its generation argument), so that a lookup still
+in progress in one cannot put back a result just invalidated.
+
+>>> cache = RouteCache(2)
+>>> cache.put(socket.AF_INET, 0x0a140019, ('r1-g', '10.30.0.18'))
+>>> cache.put(socket.AF_INET, 0x0a140022, ('r1-f', '10.30.0.14'))
+>>> cache.get(socket.AF_INET, 0x0a140019)
+('r1-g', '10.30.0.18')
+>>> cache.put(socket.AF_INET, 0x0a140114, ('r1-c', '10.30.0.2'))
+>>> cache.get(socket.AF_INET, 0x0a140022) is None
+True
+>>> cache.invalidate(socket.AF_INET, 0x0a140000, 24)
+>>> len(cache), cache.stats()
+(1, {'hits': 1, 'misses': 1, 'evictions': 1, 'invalidations': 1})
+
+A large prefix empties a cache holding too many results to check each:
+>>> cache = RouteCache(1000)
+>>> for i in range(300):
+...     cache.put(socket.AF_INET, 0x0a000000 + i * 0x100, ('r1-c', '10.30.0.2'))
+>>> cache.invalidate(socket.AF_INET, 0x0a140000, 16)
+>>> len(cache), cache.invalidations
+(0, 300)
+
+Results of an older generation are dropped:
+>>> generation = cache.generation
+>>> cache.advance()
+1
+>>> cache.put(socket.AF_INET, 0x0a140019, ('r1-g', '10.30.0.18'), generation)
+>>> cache.put(socket.AF_INET, 0x0a140022, ('r1-f', '10.30.0.14'), generation + 1)
+>>> cache.get(socket.AF_INET, 0x0a140019), cache.get(socket.AF_INET, 0x0a140022)
+(None, ('r1-f', '10.30.0.14'))
+'''
+
+import collections
+import socket
+import threading
+
+class RouteCache(object):
+    # invalidate() checks each address of a prefix holding at most this many
+    # addresses, and clears the whole cache for a larger prefix
+    INVALIDATE_MAX_ADDRESSES = 256
+
+    def __init__(self, size):
+        '''
+        Instantiate an empty cache holding at most size lookup results.
+
+        size: int
+        '''
+
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self.generation = 0
+        # serializes put() with a given generation and advance()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, family, address):
+        '''
+        Return the cached lookup result for address, or None if there is none.
+
+        family: int (socket.AF_INET or socket.AF_INET6)
+        address: int
+        '''
+
+        key = (address, family)
+        try:
+            entry = self._entries[key]
+            # another thread may evict key in between
+            self._entries.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, family, address, entry, generation=None):
+        '''
+        Cache the lookup result for address, evicting the least recently used
+        result if the cache is full.  If generation is given, the result is
+        only cached if it is still the current generation.
+
+        family: int (socket.AF_INET or socket.AF_INET6)
+        address: int
+        entry: tuple (intf, next_hop)
+        generation: int (that of the lookup)
+        '''
+
+        if generation is not None:
+            with self._lock:
+                if generation != self.generation:
+                    return
+                self._entries[(address, family)] = entry
+        else:
+            self._entries[(address, family)] = entry
+        if len(self._entries) > self.size:
+            try:
+                self._entries.popitem(last=False)
+            except KeyError:
+                # emptied by other threads in between
+                return
+            self.evictions += 1
+
+    def invalidate(self, family, prefix, prefix_len):
+        '''
+        Discard the cached results for every address within the given
+        prefix, i.e., those whose lookup result might change when a route for
+        the prefix is added or removed.  The cost is bounded by
+        INVALIDATE_MAX_ADDRESSES, rather than by the size of the cache: the
+        addresses of a prefix no larger than that are looked up one by one,
+        as are the cached results if there are no more than that, and
+        otherwise the cache is cleared, as most of it might be stale.
+
+        family: int (socket.AF_INET or socket.AF_INET6)
+        prefix: int
+        prefix_len: int
+        '''
+
+        if family == socket.AF_INET6:
+            shift = 128 - prefix_len
+        else:
+            shift = 32 - prefix_len
+        prefix >>= shift
+        if 1 << shift <= self.INVALIDATE_MAX_ADDRESSES:
+            stale = [(address, family) for address in \
+                    range(prefix << shift, (prefix + 1) << shift)]
+        elif len(self._entries) <= self.INVALIDATE_MAX_ADDRESSES:
+            stale = [key for key in list(self._entries) \
+                    if key[1] == family and key[0] >> shift == prefix]
+        else:
+            self.clear()
+            return
+        for key in stale:
+            # another thread may evict key in between
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def advance(self):
+        '''Start a new generation, and return it.  Results put with an
+        older generation are no longer cached.'''
+        with self._lock:
+            self.generation += 1
+            return self.generation
+
+    def clear(self):
+        '''Discard all cached results.'''
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self):
+        '''Return a dict of the hit, miss, eviction, and invalidation counts.'''
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations}
@@ -0,0 +1,69 @@
+'''
+Parsers for routes given in bulk, each generating (prefix, intf, next_hop)
+tuples suitable for `ForwardingTable.load_entries()`.  A next hop that is
+empty is given as None.
+
+Routes in the syntax of the `routes` attribute of a cougarnet configuration
+file:
+>>> list(parse_routes_str('10.20.0.0/23|c|10.30.0.2;0.0.0.0/0|k|10.30.0.34'))
+[('10.20.0.0/23', 'c', '10.30.0.2'), ('0.0.0.0/0', 'k', '10.30.0.34')]
+
+Routes in CSV form, one per line:
+>>> list(parse_routes_file(['# prefix,intf,next_hop', '10.20.0.0/24,d,10.30.0.6',
+...         '', '10.40.0.0/24,r2,']))
+[('10.20.0.0/24', 'd', '10.30.0.6'), ('10.40.0.0/24', 'r2', None)]
+
+Routes from an MRT RIB dump, as printed one per line by `bgpdump -m`:
+>>> list(parse_routes_file(['TABLE_DUMP2|1633046400|B|192.0.2.1|64496|'
+...         '198.51.100.0/24|64496 64511|IGP|192.0.2.1|0|0||NAG||'], intf='r1-k'))
+[('198.51.100.0/24', 'r1-k', '192.0.2.1')]
+'''
+
+def _route(prefix, intf, next_hop):
+    prefix = prefix.strip()
+    intf = intf.strip()
+    next_hop = next_hop.strip()
+    if not next_hop:
+        next_hop = None
+    return prefix, intf, next_hop
+
+def parse_routes_str(routes):
+    '''
+    Generate a route for each entry in a str of the form
+    `prefix|intf|next_hop;prefix|intf|next_hop;...`, as used by the `routes`
+    attribute in cougarnet configuration files.
+
+    routes: str
+    '''
+
+    for route in routes.split(';'):
+        if not route.strip():
+            continue
+        prefix, intf, next_hop = route.split('|')
+        yield _route(prefix, intf, next_hop)
+
+def parse_routes_file(lines, intf=None):
+    '''
+    Generate a route for each line of a route dump, reading lazily, so that
+    a large dump need not be held in memory.  Blank lines and lines starting
+    with `#` are skipped.  Each line is either:
+
+     - a CSV line of the form `prefix,intf,next_hop`; or
+     - an MRT RIB entry in the one-line format of `bgpdump -m`
+       (`TABLE_DUMP|...` or `TABLE_DUMP2|...`), in which case the outgoing
+       interface is not part of the entry, so intf is used.
+
+    lines: file object or other iterable of str
+    intf: str (used for MRT entries)
+    '''
+
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('TABLE_DUMP'):
+            fields = line.split('|')
+            yield fields[5], intf, fields[8] or None
+        else:
+            prefix, route_intf, next_hop = line.split(',')
+            yield _route(prefix, route_intf, next_hop)
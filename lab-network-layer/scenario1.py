@@ -6,55 +6,67 @@ import socket
 import sys
 import traceback
 
-from scapy.all import Ether, IP, ICMP, ARP
-from scapy.data import IP_PROTOS 
-
 from cougarnet.networksched import NetworkEventLoop
+from cougarnet.util import mac_binary_to_str, ip_binary_to_str, \
+        ip_str_to_binary
 
-from host import Host, ETH_P_ARP, ARPOP_REQUEST, ARPOP_REPLY
+from asyncio_loop import AsyncioEventLoop
+from batch_io import BatchedEventLoop
+from capture import Capture
+from headers import EthernetHeader, ArpHeader, IPv4Header
+from host import Host, ETH_P_ARP, ARPOP_REQUEST, ARPOP_REPLY, IPPROTO_ICMP
+from packet_template import EchoTemplate
+from stats import Stats
 
 class SimHost(Host):
     def __init__(self, *args, **kwargs):
         super(SimHost, self).__init__(*args, **kwargs)
 
+        # src -> EchoTemplate
+        self._echo_templates = {}
+
+    def _echo_template(self, src):
+        template = self._echo_templates.get(src)
+        if template is None:
+            template = EchoTemplate(ip_str_to_binary(src), b'0123456789')
+            self._echo_templates[src] = template
+        return template
+
     def _handle_frame(self, frame, intf):
         try:
-            eth = Ether(frame)
-            if eth.type == ETH_P_ARP:
-                arp = eth.getlayer(ARP)
+            eth = EthernetHeader(frame)
+            if eth.ethertype == ETH_P_ARP:
+                arp = ArpHeader(eth.payload())
                 if arp.op == ARPOP_REQUEST:
                     op = 'REQUEST'
                 elif arp.op == ARPOP_REPLY:
                     op = 'REPLY'
                 else:
                     op = 'UNKNOWN'
-                self.log(f'Received ARP {op} from {arp.psrc}/{arp.hwsrc} for {arp.pdst} on {intf}.')
+                self.log(f'Received ARP {op} from {ip_binary_to_str(arp.spa)}/{mac_binary_to_str(arp.sha)} for {ip_binary_to_str(arp.tpa)} on {intf}.')
         except:
             traceback.print_exc()
         super(SimHost, self)._handle_frame(frame, intf)
 
     def handle_ip(self, pkt, intf):
         try:
-            ip = IP(pkt)
-            if ip.proto == IP_PROTOS.icmp:
-                self.log(f'Received ICMP packet from {ip.src} on {intf}.')
+            ip = IPv4Header(pkt)
+            if ip.protocol == IPPROTO_ICMP:
+                self.log(f'Received ICMP packet from {ip_binary_to_str(ip.src)} on {intf}.')
         except:
             traceback.print_exc()
         super(SimHost, self).handle_ip(pkt, intf)
 
     def send_icmp_echo(self, src, dst, next_hop, id, seq):
-        ip = IP(src=src, dst=dst, proto=IP_PROTOS.icmp)
-        icmp = ICMP(type=8, id=id, seq=seq)
-        pkt = ip / icmp / b'0123456789'
+        pkt = self._echo_template(src).build(ip_str_to_binary(dst), id, seq)
 
         intf = self.get_first_interface()
-        self.send_packet_on_int(bytes(pkt), intf, next_hop)
-
-    def schedule_items(self, event_loop):
-        pass
+        self.send_packet_on_int(pkt, intf, next_hop)
 
 class SimHostA(SimHost):
     def schedule_items(self, event_loop):
+        super(SimHostA, self).schedule_items(event_loop)
+
         a_to_b = ('10.0.0.2', '10.0.0.3', '10.0.0.3', 1, 1)
         a_to_c = ('10.0.0.2', '10.0.1.2', '10.0.0.1', 1, 1)
 
@@ -64,6 +76,8 @@ class SimHostA(SimHost):
 
 class SimHostB(SimHost):
     def schedule_items(self, event_loop):
+        super(SimHostB, self).schedule_items(event_loop)
+
         b_to_a = ('10.0.0.3', '10.0.0.2', '10.0.0.2', 1, 1)
 
         event_loop.schedule_event(8, self.send_icmp_echo, b_to_a)
@@ -73,6 +87,28 @@ def main():
     parser.add_argument('--router', '-r',
             action='store_const', const=True, default=False,
             help='Act as a router by forwarding IP packets')
+    parser.add_argument('--batch', '-b',
+            type=int, metavar='N', default=0,
+            help='Receive and send frames in batches of up to N frames')
+    parser.add_argument('--asyncio', '-a',
+            action='store_const', const=True, default=False,
+            help='Run on an asyncio event loop')
+    parser.add_argument('--stats', '-s',
+            type=float, metavar='SECONDS', default=0,
+            help='Collect stats and dump them to stderr every SECONDS')
+    parser.add_argument('--stats-socket',
+            metavar='PATH',
+            help='Collect stats and serve them on a Unix socket at PATH')
+    parser.add_argument('--capture', '-c',
+            type=int, metavar='N', default=0,
+            help='Capture the last N frames received and sent')
+    parser.add_argument('--capture-filter',
+            metavar='EXPR', default='',
+            help='Capture only frames matching EXPR (e.g., "icmp")')
+    parser.add_argument('--capture-file',
+            metavar='PATH',
+            help='Write captured frames to PATH on SIGUSR1 and at exit '
+            '(default: HOSTNAME.pcap)')
     args = parser.parse_args(sys.argv[1:])
 
     hostname = socket.gethostname()
@@ -84,7 +120,24 @@ def main():
         cls = SimHost
 
     host = cls(args.router)
-    event_loop = NetworkEventLoop(host._handle_frame)
+    if args.stats or args.stats_socket:
+        stats = Stats()
+        host.enable_stats(stats)
+        if args.stats_socket:
+            stats.serve(args.stats_socket)
+    if args.capture:
+        capture = Capture(args.capture, filter=args.capture_filter)
+        capture.attach(host)
+        capture.save_on_signal(args.capture_file or
+                '%s.pcap' % socket.gethostname())
+    if args.asyncio:
+        event_loop = AsyncioEventLoop(host, batch_size=args.batch or 1)
+    elif args.batch:
+        event_loop = BatchedEventLoop(host, args.batch)
+    else:
+        event_loop = NetworkEventLoop(host._handle_frame)
+    if args.stats:
+        stats.schedule_dump(event_loop, args.stats)
     host.schedule_items(event_loop)
     event_loop.run()
 
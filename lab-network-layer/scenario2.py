@@ -6,40 +6,50 @@ import socket
 import sys
 import traceback
 
-from scapy.all import IP, ICMP
-from scapy.data import IP_PROTOS 
-
 from cougarnet.networksched import NetworkEventLoop
+from cougarnet.util import ip_binary_to_str, ip_str_to_binary
 
-from host import Host
+from asyncio_loop import AsyncioEventLoop
+from batch_io import BatchedEventLoop, BATCH_SIZE
+from capture import Capture
+from headers import IPv4Header
+from host import Host, IPPROTO_ICMP
+from packet_template import EchoTemplate
+from stats import Stats
 
 class SimHost(Host):
     def __init__(self, *args, **kwargs):
         super(SimHost, self).__init__(*args, **kwargs)
 
+        # src -> EchoTemplate
+        self._echo_templates = {}
+
+    def _echo_template(self, src):
+        template = self._echo_templates.get(src)
+        if template is None:
+            template = EchoTemplate(ip_str_to_binary(src), b'0123456789')
+            self._echo_templates[src] = template
+        return template
+
     def handle_ip(self, pkt, intf):
         try:
-            ip = IP(pkt)
-            if ip.proto == IP_PROTOS.icmp:
-                self.log(f'Received ICMP packet from {ip.src} on {intf}.')
+            ip = IPv4Header(pkt)
+            if ip.protocol == IPPROTO_ICMP:
+                self.log(f'Received ICMP packet from {ip_binary_to_str(ip.src)} on {intf}.')
         except:
             traceback.print_exc()
         super(SimHost, self).handle_ip(pkt, intf)
 
     def send_icmp_echo(self, src, dst, id, seq, ttl=None):
-        ip = IP(src=src, dst=dst, proto=IP_PROTOS.icmp)
-        if ttl is not None:
-            ip.ttl = ttl
-        icmp = ICMP(type=8, id=id, seq=seq)
-        pkt = ip / icmp / b'0123456789'
-
-        self.send_packet(bytes(pkt))
+        pkt = self._echo_template(src).build(ip_str_to_binary(dst), id, seq,
+                ttl)
 
-    def schedule_items(self, event_loop):
-        pass
+        self.send_packet(pkt)
 
 class SimHostA(SimHost):
     def schedule_items(self, event_loop):
+        super(SimHostA, self).schedule_items(event_loop)
+
         dsts_for_a = ('10.0.0.3', '10.20.0.25',
                 '10.20.0.34', '10.20.1.20',
                 '10.20.3.1', '10.20.0.2',
@@ -63,6 +73,31 @@ def main():
     parser.add_argument('--router', '-r',
             action='store_const', const=True, default=False,
             help='Act as a router by forwarding IP packets')
+    parser.add_argument('--batch', '-b',
+            type=int, metavar='N', default=0,
+            help='Receive and send frames in batches of up to N frames')
+    parser.add_argument('--asyncio', '-a',
+            action='store_const', const=True, default=False,
+            help='Run on an asyncio event loop')
+    parser.add_argument('--stats', '-s',
+            type=float, metavar='SECONDS', default=0,
+            help='Collect stats and dump them to stderr every SECONDS')
+    parser.add_argument('--stats-socket',
+            metavar='PATH',
+            help='Collect stats and serve them on a Unix socket at PATH')
+    parser.add_argument('--workers', '-w',
+            type=int, metavar='N', default=0,
+            help='Forward packets with N worker processes (implies --batch)')
+    parser.add_argument('--capture', '-c',
+            type=int, metavar='N', default=0,
+            help='Capture the last N frames received and sent')
+    parser.add_argument('--capture-filter',
+            metavar='EXPR', default='',
+            help='Capture only frames matching EXPR (e.g., "icmp")')
+    parser.add_argument('--capture-file',
+            metavar='PATH',
+            help='Write captured frames to PATH on SIGUSR1 and at exit '
+            '(default: HOSTNAME.pcap)')
     args = parser.parse_args(sys.argv[1:])
 
     hostname = socket.gethostname()
@@ -71,8 +106,27 @@ def main():
     else:
         cls = SimHost
 
-    host = cls(args.router)
-    event_loop = NetworkEventLoop(host._handle_frame)
+    host = cls(args.router, args.workers)
+    if args.stats or args.stats_socket:
+        stats = Stats()
+        host.enable_stats(stats)
+        if args.stats_socket:
+            stats.serve(args.stats_socket)
+    if args.capture:
+        capture = Capture(args.capture, filter=args.capture_filter)
+        capture.attach(host)
+        capture.save_on_signal(args.capture_file or
+                '%s.pcap' % socket.gethostname())
+    if args.asyncio:
+        event_loop = AsyncioEventLoop(host, batch_size=args.batch or 1)
+    elif args.batch or args.workers:
+        # the forwarding workers' results are read when they are ready, which
+        # NetworkEventLoop does not support
+        event_loop = BatchedEventLoop(host, args.batch or BATCH_SIZE)
+    else:
+        event_loop = NetworkEventLoop(host._handle_frame)
+    if args.stats:
+        stats.schedule_dump(event_loop, args.stats)
     host.schedule_items(event_loop)
     event_loop.run()
 
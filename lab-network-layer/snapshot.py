@@ -0,0 +1,151 @@
+'''
+A compact binary snapshot of a forwarding table, which can be reopened with
+`mmap` and searched in place, without rebuilding the table.  Processes that
+open the same snapshot file share its pages.
+
+The table is stored in flattened form (see `PrefixTrie.intervals()`): for
+each address family, a sorted array of the addresses at which the longest
+prefix match changes, and a parallel array of indexes into the list of
+distinct entries, which is stored as JSON at the end of the file.  Entry index
+0 is (None, None).
+
+>>> import os, tempfile
+>>> from forwarding_table import ForwardingTable
+>>> table = ForwardingTable()
+>>> table.add_entry('10.20.0.0/23', 'r1-c', '10.30.0.2')
+>>> table.add_entry('10.20.0.0/30', 'r1-j', '10.30.0.30')
+>>> table.add_entry('2001:db8::/32', 'r1-k', None)
+>>> path = os.path.join(tempfile.mkdtemp(), 'r1.fts')
+>>> save_snapshot(table, path)
+>>> snapshot = ForwardingTableSnapshot(path)
+>>> snapshot.get_entry('10.20.0.2'), snapshot.get_entry('10.20.1.20')
+(('r1-j', '10.30.0.30'), ('r1-c', '10.30.0.2'))
+>>> snapshot.get_entry('10.20.3.1'), snapshot.get_entry('2001:db8::1')
+((None, None), ('r1-k', None))
+>>> snapshot.close()
+'''
+
+import bisect
+import json
+import mmap
+import socket
+import struct
+import sys
+from array import array
+
+from subnet import IPAddress
+
+MAGIC = b'FTSNAP01'
+
+# magic, byte order of the arrays ('l' or 'b'), IPv4 run count, IPv6 run
+# count, length of the JSON entry list
+HEADER = struct.Struct('8sc3xIII')
+
+def save_snapshot(table, path):
+    '''
+    Write a snapshot of the given forwarding table to the file at path.
+
+    table: ForwardingTable instance
+    path: str
+    '''
+
+    entries = [(None, None)]
+    entry_index = {None: 0}
+
+    def flatten(family):
+        starts = []
+        values = array('I')
+        for start, entry in table._tries[family].intervals():
+            if entry not in entry_index:
+                entry_index[entry] = len(entries)
+                entries.append(entry)
+            starts.append(start)
+            values.append(entry_index[entry])
+        return starts, values
+
+    starts4, values4 = flatten(socket.AF_INET)
+    starts6, values6 = flatten(socket.AF_INET6)
+    entries_json = json.dumps(entries).encode('utf-8')
+
+    with open(path, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, sys.byteorder[0].encode('ascii'),
+                len(starts4), len(starts6), len(entries_json)))
+        fh.write(array('I', starts4).tobytes())
+        fh.write(values4.tobytes())
+        fh.write(values6.tobytes())
+        # IPv6 addresses are stored big-endian, so that comparing their bytes
+        # compares their values
+        fh.write(b''.join(start.to_bytes(16, 'big') for start in starts6))
+        fh.write(entries_json)
+
+class ForwardingTableSnapshot(object):
+    def __init__(self, path):
+        '''
+        Open the snapshot at path, mapping it into memory read-only.
+
+        path: str
+        '''
+
+        with open(path, 'rb') as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, byteorder, n4, n6, entries_len = \
+                HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a forwarding table snapshot' % path)
+        if byteorder != sys.byteorder[0].encode('ascii'):
+            raise ValueError('%s was written with a different byte order' % path)
+
+        self._view = view = memoryview(self._mm)
+        offset = HEADER.size
+        self._starts4 = view[offset:offset + 4 * n4].cast('I')
+        offset += 4 * n4
+        self._values4 = view[offset:offset + 4 * n4].cast('I')
+        offset += 4 * n4
+        self._values6 = view[offset:offset + 4 * n6].cast('I')
+        offset += 4 * n6
+        self._starts6_offset = offset
+        self._n6 = n6
+        offset += 16 * n6
+        self._entries = [tuple(entry) for entry in \
+                json.loads(bytes(view[offset:offset + entries_len]))]
+
+    def _find6(self, address):
+        '''Return the index of the last IPv6 run starting at or before
+        address.'''
+
+        key = address.to_bytes(16, 'big')
+        mm = self._mm
+        base = self._starts6_offset
+        lo, hi = 0, self._n6
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if key < mm[base + 16 * mid:base + 16 * mid + 16]:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo - 1
+
+    def get_entry(self, ip_address):
+        '''
+        Return the entry having the longest prefix match of ip_address, as
+        with ForwardingTable.get_entry().
+
+        ip_address: str, bytes (packed address) or IPAddress instance
+        '''
+
+        if isinstance(ip_address, IPAddress):
+            address, family = ip_address.address, ip_address.address_family
+        else:
+            address, family = IPAddress._parse(ip_address)
+
+        if family == socket.AF_INET6:
+            return self._entries[self._values6[self._find6(address)]]
+        i = bisect.bisect_right(self._starts4, address) - 1
+        return self._entries[self._values4[i]]
+
+    def close(self):
+        '''Unmap the snapshot.'''
+        for view in (self._starts4, self._values4, self._values6, self._view):
+            view.release()
+        self._mm.close()
@@ -1,46 +1,63 @@
 '''
 Test the Subnet.__contains__() method
 >>> '10.20.0.1' in Subnet('10.20.0.0/23')
-None
+True
 >>> '10.20.1.0' in Subnet('10.20.0.0/23')
-None
+True
 >>> '10.20.1.255' in Subnet('10.20.0.0/23')
-None
+True
 >>> '10.20.2.0' in Subnet('10.20.0.0/23')
-None
+False
 >>> '10.20.0.1' in Subnet('10.20.0.0/24')
-None
+True
 >>> '10.20.0.255' in Subnet('10.20.0.0/24')
-None
+True
 >>> '10.20.1.0' in Subnet('10.20.0.0/24')
-None
+False
 >>> '10.20.0.1' in Subnet('10.20.0.0/25')
-None
+True
 >>> '10.20.0.127' in Subnet('10.20.0.0/25')
-None
+True
 >>> '10.20.0.128' in Subnet('10.20.0.0/25')
-None
+False
 >>> '10.20.0.1' in Subnet('10.20.0.0/26')
-None
+True
 >>> '10.20.0.63' in Subnet('10.20.0.0/26')
-None
+True
 >>> '10.20.0.64' in Subnet('10.20.0.0/26')
-None
+False
 >>> '10.20.0.1' in Subnet('10.20.0.0/27')
-None
+True
 >>> '10.20.0.31' in Subnet('10.20.0.0/27')
-None
+True
 >>> '10.20.0.32' in Subnet('10.20.0.0/27')
-None
+False
 >>> '2001:db8:f00d::1' in Subnet('2001:db8::/32')
-None
+True
 >>> '2001:db8:f00d::1' in Subnet('2001:db8::/64')
-None
+False
 >>> '2001:db8::feed:1' in Subnet('2001:db8::/96')
-None
+True
+
+Without a cache, intern() returns new instances:
+>>> ip = IPAddress.intern('10.20.0.1')
+>>> str(ip), ip is IPAddress.intern('10.20.0.1')
+('10.20.0.1', False)
+>>> IPAddress.set_intern_cache_size(16)
+>>> IPAddress.intern('10.20.0.1') is IPAddress.intern('10.20.0.1')
+True
+>>> IPAddress.set_intern_cache_size(0)
+
+Packed addresses must be 4 or 16 bytes long:
+>>> str(IPAddress(b'\\x0a\\x14\\x00\\x01')), str(IPAddress(bytes(16)))
+('10.20.0.1', '::')
+>>> IPAddress(b'\\x0a\\x14\\x00')
+Traceback (most recent call last):
+...
+ValueError: Packed address must be 4 or 16 bytes
 '''
 
-import binascii
+import collections
 import socket
 
 int_type_int = type(0xff)
@@ -53,6 +70,14 @@ class IPAddress(object):
     address, and its length is 32 bits.  This length is contained in the
     `address_len` instance var.
     '''
+
+    __slots__ = ('address', 'address_family', 'address_len')
+
+    # bounded cache of instances, keyed by the value they were created from;
+    # see set_intern_cache_size()
+    _intern_cache = None
+    _intern_cache_size = 0
+
     def __init__(self, address, family=None):
         if isinstance(address, (int_type_int, int_type_long)):
             assert family is not None, 'Address family must be specified'
@@ -62,14 +87,29 @@ class IPAddress(object):
             else:
                 self.address_len = 32
             self.address = address
-        else: # str
-            if ':' in address:
+        else: # str or bytes
+            self.address, self.address_family = \
+                    self.__class__._parse(address)
+            if self.address_family == socket.AF_INET6:
                 self.address_len = 128
-                self.address_family = socket.AF_INET6
             else:
                 self.address_len = 32
-                self.address_family = socket.AF_INET
-            self.address = self.__class__._str_to_int(address, self.address_family)
+
+    @classmethod
+    def _parse(cls, address):
+        '''Convert an IP address string, in presentation format, or a packed
+        IP address to an (int, address family) tuple.'''
+        if isinstance(address, str):
+            if ':' in address:
+                family = socket.AF_INET6
+            else:
+                family = socket.AF_INET
+            return cls._str_to_int(address, family), family
+        if len(address) == 16:
+            return int.from_bytes(address, 'big'), socket.AF_INET6
+        if len(address) != 4:
+            raise ValueError('Packed address must be 4 or 16 bytes')
+        return int.from_bytes(address, 'big'), socket.AF_INET
 
     @classmethod
     def _int_to_str(cls, address, family):
@@ -78,29 +118,74 @@ class IPAddress(object):
             address_len = 128
         else:
             address_len = 32
-        return socket.inet_ntop(family, binascii.unhexlify(('%x' % address).zfill(address_len >> 2)))
+        return socket.inet_ntop(family, address.to_bytes(address_len >> 3, 'big'))
 
     @classmethod
     def _str_to_int(cls, address, family):
         '''Convert an IP address string, in presentation format, to an integer.'''
-        return int_type_long(binascii.hexlify(socket.inet_pton(family, address)), 16)
+        return int.from_bytes(socket.inet_pton(family, address), 'big')
+
+    @classmethod
+    def set_intern_cache_size(cls, size):
+        '''
+        Enable the cache used by intern(), holding at most size instances, or
+        disable (and empty) it if size is 0.
+
+        size: int
+        '''
+        cls._intern_cache_size = size
+        if size > 0:
+            cls._intern_cache = collections.OrderedDict()
+        else:
+            cls._intern_cache = None
+
+    @classmethod
+    def intern(cls, address, family=None):
+        '''
+        Return an IPAddress for the given address, as with the constructor,
+        reusing a previously created instance if the cache is enabled and
+        holds one.  The least recently used instance is discarded when the
+        cache is full.  Instances returned by this method are shared, so they
+        must not be modified.
+
+        address: str, bytes, or int (in which case family is required)
+        '''
+        cache = cls._intern_cache
+        if cache is None:
+            return cls(address, family)
+        if isinstance(address, (bytearray, memoryview)):
+            address = bytes(address)
+        key = (address, family)
+        try:
+            ip = cache[key]
+        except KeyError:
+            ip = cls(address, family)
+            cache[key] = ip
+            if len(cache) > cls._intern_cache_size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return ip
 
     @classmethod
     def _all_ones(cls, n_bits):
         '''Return an int that is n_bits bits long and whose value is all ones.'''
-        return 2**n_bits - 1
+        return (1 << n_bits) - 1
 
     def __hash__(self):
-        return hash(self.address)
+        return hash((self.address, self.address_family))
 
     def __str__(self):
         return self.__class__._int_to_str(self.address, self.address_family)
 
     def __eq__(self, other):
-        return self.address == other.address
+        # 0.0.0.0 and :: are different addresses
+        return self.address == other.address and \
+                self.address_family == other.address_family
 
     def __lt__(self, other):
-        return self.address < other.address
+        return (self.address_family, self.address) < \
+                (other.address_family, other.address)
 
     def __add__(self, other):
         assert isinstance(other, (int_type_int, int_type_long))
@@ -119,15 +204,16 @@ class IPAddress(object):
 
         prefix_len: int
         '''
-        #FIXME
-        return 0
+        return self._all_ones(prefix_len) << (self.address_len - prefix_len)
 
 class Subnet(object):
+    __slots__ = ('prefix', 'prefix_len', '_mask')
+
     def __init__(self, prefix, prefix_len=None):
         '''
         Instantiate a Subnet from a prefix.
 
-        prefix: str or IPAddress instance
+        prefix: str (<ip_address>/<prefix_len>) or IPAddress instance
         prefix_len: int (only used if prefix is IPAddress instance)
         '''
         if isinstance(prefix, str):
@@ -144,8 +230,8 @@ class Subnet(object):
         # no host bits), not just an IP address that we convert to a prefix.
         #
         # For now, convert it to a true prefix.
-        self.prefix = IPAddress( \
-                self.prefix.address & self.prefix.mask(self.prefix_len), \
+        self._mask = self.prefix.mask(self.prefix_len)
+        self.prefix = IPAddress(self.prefix.address & self._mask, \
                 self.prefix.address_family)
 
     def __repr__(self):
@@ -159,14 +245,16 @@ class Subnet(object):
         Return True if the address corresponding to this IP address is within
         this subnet, False otherwise.
 
-        ip: str or IPAddress instance
+        ip: str, bytes (packed address) or IPAddress instance
         '''
 
-        if isinstance(ip, str):
-            ip = IPAddress(ip)
+        if isinstance(ip, IPAddress):
+            address, family = ip.address, ip.address_family
+        else:
+            address, family = IPAddress._parse(ip)
 
-        #FIXME
-        return None
+        return family == self.prefix.address_family and \
+                address & self._mask == self.prefix.address
 
     def __hash__(self):
         return hash((self.prefix, self.prefix_len))
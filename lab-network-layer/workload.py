@@ -0,0 +1,268 @@
+'''
+Synthetic workloads and measurement helpers for benchmarks: random route
+sets, flows whose destinations fall within those routes, Zipf-distributed
+choices of flow for each packet, and packets or frames of a given size.  All
+randomness comes from a `random.Random` instance, so a workload is the same
+for the same seed.
+
+>>> import random
+>>> rng = random.Random(1)
+>>> routes = random_routes(100, rng)
+>>> len(routes), routes[0][0]
+(100, '0.0.0.0/0')
+>>> flows = random_flows(10, routes, rng)
+>>> pkts = build_packets(flows, zipf_choices(10, 1000, 1.1, rng), 128)
+>>> len(pkts), len(pkts[0])
+(1000, 128)
+>>> result = measure(lambda pkt: pkt[16:20], pkts, sample_every=10)
+>>> result['count'], sorted(result['latency_ns'])
+(1000, ['max', 'p50', 'p90', 'p99'])
+'''
+
+import bisect
+import itertools
+import json
+import os
+import platform
+import resource
+import socket
+import struct
+import subprocess
+import time
+
+from headers import ETH_P_IP, build_ethernet, build_ipv4, build_ipv6
+
+#From /usr/include/linux/in.h:
+IPPROTO_UDP = 17 # User Datagram Protocol
+
+# approximate distribution of prefix lengths in a BGP table
+PREFIX_LEN_WEIGHTS = ((24, 60), (23, 8), (22, 10), (21, 5), (20, 5), (19, 4),
+        (18, 2), (17, 1), (16, 3), (12, 1), (8, 1))
+# and in an IPv6 BGP table
+PREFIX6_LEN_WEIGHTS = ((48, 45), (32, 10), (44, 8), (40, 6), (36, 4), (29, 3),
+        (47, 3), (46, 3), (28, 2), (33, 2), (42, 2), (56, 2), (64, 1), (24, 1),
+        (20, 1))
+
+_udp = struct.Struct('!HHHH')
+
+def random_routes(count, rng, intfs=('r1-b', 'r1-c', 'r1-d', 'r1-e'),
+        ipv6=False):
+    '''
+    Return a list of count distinct (prefix, intf, next_hop) routes, with
+    prefix lengths distributed as in PREFIX_LEN_WEIGHTS (or
+    PREFIX6_LEN_WEIGHTS, for IPv6).  The first route is always the default
+    route, 0.0.0.0/0 (or ::/0).
+
+    count: int
+    rng: random.Random instance
+    intfs: sequence of str (interfaces among which routes are spread)
+    ipv6: bool (generate IPv6 routes, within 2000::/3)
+    '''
+
+    if ipv6:
+        lens, weights = zip(*PREFIX6_LEN_WEIGHTS)
+        routes = [('::/0', intfs[0], '2001:db8:ff::1')]
+    else:
+        lens, weights = zip(*PREFIX_LEN_WEIGHTS)
+        routes = [('0.0.0.0/0', intfs[0], '10.255.0.1')]
+    cum_weights = list(itertools.accumulate(weights))
+    prefixes = {(0, 0)}
+    while len(routes) < count:
+        prefix_len = rng.choices(lens, cum_weights=cum_weights)[0]
+        i = len(routes) % len(intfs)
+        if ipv6:
+            address = rng.randrange(1 << 125, 1 << 126) & \
+                    ~((1 << (128 - prefix_len)) - 1)
+            prefix = socket.inet_ntop(socket.AF_INET6,
+                    address.to_bytes(16, 'big'))
+            next_hop = '2001:db8:ff:%d::1' % i
+        else:
+            # avoid 0.0.0.0/8, 127.0.0.0/8 and multicast
+            address = rng.randrange(1 << 24, 224 << 24) & \
+                    ~((1 << (32 - prefix_len)) - 1)
+            if address >> 24 == 127:
+                continue
+            prefix = socket.inet_ntoa(address.to_bytes(4, 'big'))
+            next_hop = '10.255.%d.1' % i
+        if (address, prefix_len) in prefixes:
+            continue
+        prefixes.add((address, prefix_len))
+        routes.append(('%s/%d' % (prefix, prefix_len), intfs[i], next_hop))
+    return routes
+
+def random_flows(count, routes, rng):
+    '''
+    Return a list of count (src, dst, sport, dport) flows, with addresses
+    packed.  Each destination is a random address within a random route, so
+    that lookups are spread over the routes.  The flows are IPv6 if the
+    routes are.
+
+    count: int
+    routes: list of (prefix, intf, next_hop) tuples
+    rng: random.Random instance
+    '''
+
+    flows = []
+    for i in range(count):
+        prefix, prefix_len = routes[rng.randrange(len(routes))][0].split('/')
+        if ':' in prefix:
+            network = int.from_bytes(socket.inet_pton(socket.AF_INET6,
+                    prefix), 'big')
+            address_len = 128
+            src_prefix = 0x20010db8 << 96
+        else:
+            network = int.from_bytes(socket.inet_aton(prefix), 'big')
+            address_len = 32
+            src_prefix = 10 << 24
+        host_bits = address_len - int(prefix_len)
+        dst = network | rng.getrandbits(host_bits) if host_bits else network
+        src = src_prefix | rng.getrandbits(16)
+        flows.append((src.to_bytes(address_len >> 3, 'big'),
+                dst.to_bytes(address_len >> 3, 'big'),
+                rng.randrange(1024, 65536), rng.choice((53, 80, 443))))
+    return flows
+
+def zipf_choices(n, count, s, rng):
+    '''
+    Return a list of count indexes in range(n), where index k is chosen with
+    probability proportional to 1 / (k + 1) ** s.  With s = 0, the choice is
+    uniform.
+
+    n: int
+    count: int
+    s: int or float
+    rng: random.Random instance
+    '''
+
+    cum_weights = list(itertools.accumulate(1 / (k + 1) ** s
+            for k in range(n)))
+    total = cum_weights[-1]
+    return [bisect.bisect(cum_weights, rng.random() * total)
+            for i in range(count)]
+
+def build_packets(flows, choices, size):
+    '''
+    Return a list of IPv4 (or, for IPv6 flows, IPv6) UDP packets of size
+    bytes, one for each index in choices, sent on the corresponding flow.
+    Packets of the same flow are the same object.
+
+    flows: list of (src, dst, sport, dport) tuples
+    choices: list of int
+    size: int (at least 28, or 48 for IPv6)
+    '''
+
+    by_flow = []
+    for src, dst, sport, dport in flows:
+        if len(src) == 16:
+            by_flow.append(build_ipv6(src, dst, IPPROTO_UDP,
+                    _udp.pack(sport, dport, size - 40, 0) + bytes(size - 48)))
+        else:
+            by_flow.append(build_ipv4(src, dst, IPPROTO_UDP,
+                    _udp.pack(sport, dport, size - 20, 0) + bytes(size - 28)))
+    return [by_flow[i] for i in choices]
+
+def build_frames(macs, choices, size):
+    '''
+    Return a list of Ethernet frames of size bytes, one for each (src, dst)
+    pair of indexes into macs in choices.
+
+    macs: list of bytes
+    choices: list of (int, int) tuples
+    size: int (at least 14)
+    '''
+
+    payload = bytes(size - 14)
+    return [build_ethernet(macs[dst], macs[src], ETH_P_IP) + payload
+            for src, dst in choices]
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1,
+            int(len(sorted_values) * p / 100))]
+
+def measure(func, items, sample_every=100):
+    '''
+    Call func(item) for each of items, and return a dict with the count,
+    the elapsed time, the rate (per second), and percentiles of the latency
+    (in nanoseconds) of every sample_every-th call.  Sampling keeps the
+    cost of timing individual calls out of the rate.
+
+    func: callable
+    items: list
+    sample_every: int
+    '''
+
+    samples = []
+    perf_counter_ns = time.perf_counter_ns
+    start = perf_counter_ns()
+    for i in range(0, len(items), sample_every):
+        t = perf_counter_ns()
+        func(items[i])
+        samples.append(perf_counter_ns() - t)
+        for item in items[i + 1:i + sample_every]:
+            func(item)
+    elapsed = (perf_counter_ns() - start) / 1e9
+
+    samples.sort()
+    return {
+        'count': len(items),
+        'seconds': elapsed,
+        'per_second': len(items) / elapsed if elapsed else None,
+        'latency_ns': {
+            'p50': _percentile(samples, 50),
+            'p90': _percentile(samples, 90),
+            'p99': _percentile(samples, 99),
+            'max': samples[-1] if samples else None,
+        },
+    }
+
+def max_rss():
+    '''Return the peak resident set size of this process, in bytes.'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def environment():
+    '''Return a dict describing the code and machine the benchmark ran on.'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+def save_results(path, results):
+    '''
+    Write the results, along with environment(), to path as JSON.
+
+    path: str
+    results: list of dict
+    '''
+
+    with open(path, 'w') as fh:
+        json.dump({'environment': environment(), 'results': results}, fh,
+                indent=2)
+
+def compare_results(path, results):
+    '''
+    Print the change in rate of each of results from the result with the same
+    name in the JSON file at path.
+
+    path: str
+    results: list of dict
+    '''
+
+    with open(path) as fh:
+        baseline = {r['name']: r for r in json.load(fh)['results']}
+    for result in results:
+        old = baseline.get(result['name'])
+        if old is None or not old['per_second']:
+            continue
+        print('%-50s %12.0f/s -> %12.0f/s (%+.1f%%)' % (result['name'],
+                old['per_second'], result['per_second'],
+                100 * (result['per_second'] / old['per_second'] - 1)))